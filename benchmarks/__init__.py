@@ -0,0 +1,8 @@
+"""
+Benchmarks.
+
+    python -m benchmarks.chunking workers --folder-path ./data --copies 20 --workers 1 --workers 2 --workers 4
+    python -m benchmarks.chunking chunkers --folder-path ./data --copies 20 --window-size 256 --overlap 32
+    python -m benchmarks.suite run --chunks 1000 --chunks 100000 --chunks 1000000 --output-path results.json
+    python -m benchmarks.suite compare --baseline-path baseline.json --current-path results.json
+"""
@@ -0,0 +1,108 @@
+"""
+Chunking benchmarks.
+
+    python -m benchmarks.chunking workers --folder-path ./data --copies 20 --workers 1 --workers 2 --workers 4
+    python -m benchmarks.chunking chunkers --folder-path ./data --copies 20 --window-size 256 --overlap 32
+"""
+
+import os
+import time
+from pathlib import Path
+from typing import List
+import numpy as np
+import typer
+from rich.console import Console
+from rich.table import Table
+from rag_app.src.chunking import CHUNKERS, chunk_text, count_tokens, read_files
+
+app = typer.Typer()
+
+
+@app.command(help="Benchmark chunking throughput against the number of workers")
+def workers(
+    folder_path: str = typer.Option(default="./data", help="Folder to read data from"),
+    copies: int = typer.Option(default=20, help="Number of times to repeat the corpus"),
+    workers: List[int] = typer.Option(
+        default=None, help="Worker counts to benchmark (repeatable)"
+    ),
+    chunker: str = typer.Option(
+        default="unstructured", help="Chunking strategy ( unstructured or window )"
+    ),
+):
+    documents = list(read_files(Path(folder_path), file_suffix=".md")) * copies
+    total_bytes = sum(len(doc.content.encode("utf-8")) for doc in documents)
+    workers = workers or sorted({1, 2, 4, os.cpu_count() or 1})
+
+    table = Table(
+        title=f"Chunking {len(documents)} documents ({total_bytes / 1e6:.1f} MB)"
+    )
+    table.add_column("Workers", style="cyan")
+    table.add_column("Seconds", style="magenta")
+    table.add_column("Docs/s", style="green")
+    table.add_column("MB/s", style="green")
+    table.add_column("Speedup", style="yellow")
+
+    baseline = None
+    for n in workers:
+        start = time.perf_counter()
+        num_chunks = sum(1 for _ in chunk_text(documents, workers=n, chunker=chunker))
+        elapsed = time.perf_counter() - start
+        baseline = baseline or elapsed
+        table.add_row(
+            str(n),
+            f"{elapsed:.2f}",
+            f"{len(documents) / elapsed:.1f}",
+            f"{total_bytes / 1e6 / elapsed:.2f}",
+            f"{baseline / elapsed:.2f}x",
+        )
+
+    Console().print(table)
+    Console().print(f"{num_chunks} chunks per run")
+
+
+@app.command(help="Compare chunk throughput and chunk sizes across chunkers")
+def chunkers(
+    folder_path: str = typer.Option(default="./data", help="Folder to read data from"),
+    copies: int = typer.Option(default=20, help="Number of times to repeat the corpus"),
+    window_size: int = typer.Option(
+        default=256, help="Maximum tokens per chunk with the window chunker"
+    ),
+    overlap: int = typer.Option(
+        default=32, help="Tokens shared by consecutive chunks with the window chunker"
+    ),
+):
+    documents = list(read_files(Path(folder_path), file_suffix=".md")) * copies
+
+    table = Table(title=f"Chunking {len(documents)} documents")
+    table.add_column("Chunker", style="cyan")
+    table.add_column("Chunks", style="magenta")
+    table.add_column("Chunks/s", style="green")
+    for label in ["Min", "P50", "P95", "Max", "Mean"]:
+        table.add_column(f"{label} Tokens", style="yellow")
+
+    for chunker in CHUNKERS:
+        start = time.perf_counter()
+        chunks = list(
+            chunk_text(
+                documents, window_size=window_size, overlap=overlap, chunker=chunker
+            )
+        )
+        elapsed = time.perf_counter() - start
+
+        sizes = np.array(count_tokens([chunk["text"] for chunk in chunks]))
+        table.add_row(
+            chunker,
+            str(len(chunks)),
+            f"{len(chunks) / elapsed:.1f}",
+            str(sizes.min()),
+            str(int(np.percentile(sizes, 50))),
+            str(int(np.percentile(sizes, 95))),
+            str(sizes.max()),
+            f"{sizes.mean():.1f}",
+        )
+
+    Console().print(table)
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,158 @@
+"""
+Synthetic markdown corpora for offline benchmarks.
+
+    python -m benchmarks.corpus --output-path ./synthetic --chunks 100000
+"""
+
+import time
+from pathlib import Path
+from typing import List
+import numpy as np
+import typer
+from rag_app.models import EvaluationDataItem
+from rag_app.src.keyword_index import tokenize
+
+app = typer.Typer()
+
+CONSONANTS = list("bcdfghjklmnprstvwz")
+VOWELS = list("aeiou")
+
+
+class SyntheticCorpus:
+    """
+    Generates essays with frontmatter in the format `ingest from-folder`
+    reads. Words are drawn from a made-up vocabulary with Zipf distributed
+    frequencies, so common words appear in most chunks and rare ones in few,
+    much like real text.
+
+    Paragraphs are at most `paragraph_tokens` words and punctuation marks
+    long. Chunking with the window chunker and a window of at least that many
+    tokens therefore gives exactly one chunk per paragraph, which is how the
+    number of chunks of a corpus is controlled. Every document only depends
+    on `seed` and its index.
+    """
+
+    def __init__(
+        self,
+        seed: int = 0,
+        vocabulary_size: int = 20000,
+        paragraph_tokens: int = 96,
+        paragraphs_per_document: int = 20,
+        zipf_exponent: float = 1.1,
+    ):
+        self.seed = seed
+        self.paragraph_tokens = paragraph_tokens
+        self.paragraphs_per_document = paragraphs_per_document
+        self.vocabulary = self.make_vocabulary(vocabulary_size)
+        weights = 1 / np.arange(1, vocabulary_size + 1) ** zipf_exponent
+        self.cumulative = np.cumsum(weights / weights.sum())
+
+    def make_vocabulary(self, size: int) -> np.ndarray:
+        rng = np.random.default_rng([self.seed, 0])
+        words = {}
+        while len(words) < size:
+            syllables = rng.integers(1, 5)
+            word = "".join(
+                CONSONANTS[rng.integers(len(CONSONANTS))]
+                + VOWELS[rng.integers(len(VOWELS))]
+                for _ in range(syllables)
+            )
+            words.setdefault(word, None)
+        return np.array(list(words))
+
+    def paragraph(self, rng: np.random.Generator) -> str:
+        lengths = []
+        # Every sentence is its words and a full stop
+        while sum(lengths) + len(lengths) < self.paragraph_tokens - 16:
+            lengths.append(int(rng.integers(6, 16)))
+        words = self.vocabulary[
+            np.searchsorted(self.cumulative, rng.random(sum(lengths)), side="right")
+        ].tolist()
+
+        sentences, start = [], 0
+        for length in lengths:
+            sentence = words[start : start + length]
+            sentences.append(" ".join([sentence[0].capitalize(), *sentence[1:]]) + ".")
+            start += length
+        return " ".join(sentences)
+
+    def document(self, index: int, num_paragraphs: int) -> str:
+        rng = np.random.default_rng([self.seed, index + 1])
+        title = " ".join(self.vocabulary[rng.integers(0, 500, 4)]).capitalize()
+        paragraphs = [self.paragraph(rng) for _ in range(num_paragraphs)]
+        return "\n".join(
+            [
+                "---",
+                f'title: "{title}"',
+                f'date: "{2000 + index % 25}-{index % 12 + 1:02d}"',
+                f"url: https://example.com/essays/{index}",
+                "---",
+                "\n\n".join(paragraphs),
+                "",
+            ]
+        )
+
+    def write(self, folder: Path, num_chunks: int) -> int:
+        """
+        Writes documents totalling `num_chunks` paragraphs to `folder` and
+        returns the number of documents written
+        """
+        folder.mkdir(parents=True, exist_ok=True)
+        index = 0
+        for start in range(0, num_chunks, self.paragraphs_per_document):
+            num_paragraphs = min(self.paragraphs_per_document, num_chunks - start)
+            (folder / f"essay-{index:07d}.md").write_text(
+                self.document(index, num_paragraphs)
+            )
+            index += 1
+        return index
+
+
+def make_question(chunk_id: str, text: str, rng: np.random.Generator):
+    """
+    Asks about a handful of the words of a chunk, so both vector and keyword
+    search can find the chunk from its question
+    """
+    words = list(dict.fromkeys(tokenize(text)))
+    picked = sorted(rng.choice(len(words), size=min(6, len(words)), replace=False))
+    return EvaluationDataItem(
+        question=f"What does the essay say about {' '.join(words[i] for i in picked)}?",
+        answer=text.split(". ")[0],
+        chunk=text,
+        chunk_id=chunk_id,
+    )
+
+
+def sample_questions(table, count: int, seed: int = 0) -> List[EvaluationDataItem]:
+    """
+    Makes one question for each of `count` chunks picked at random from a table
+    """
+    rng = np.random.default_rng(seed)
+    dataset = table.to_lance()
+    rows = sorted(
+        rng.choice(
+            dataset.count_rows(), size=min(count, dataset.count_rows()), replace=False
+        ).tolist()
+    )
+    data = dataset.take(rows, columns=["chunk_id", "text"]).to_pylist()
+    return [make_question(row["chunk_id"], row["text"], rng) for row in data]
+
+
+@app.command(help="Write a synthetic corpus of essays to a folder")
+def main(
+    output_path: str = typer.Option(help="Folder to write the essays to"),
+    chunks: int = typer.Option(
+        default=1000, help="Number of chunks (paragraphs) to generate"
+    ),
+    seed: int = typer.Option(default=0, help="Seed of the corpus"),
+):
+    start = time.perf_counter()
+    documents = SyntheticCorpus(seed=seed).write(Path(output_path), chunks)
+    print(
+        f"Wrote {documents} documents with {chunks} chunks to {output_path} "
+        f"in {time.perf_counter() - start:.2f}s"
+    )
+
+
+if __name__ == "__main__":
+    app()
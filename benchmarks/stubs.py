@@ -0,0 +1,163 @@
+"""
+Deterministic stand-ins for everything the benchmarks would otherwise need
+the network for: OpenAI embeddings and chat completions, and the tiktoken
+encoding used to count tokens.
+"""
+
+import os
+import re
+import zlib
+from contextlib import ExitStack, contextmanager
+from functools import lru_cache
+from types import SimpleNamespace
+from typing import Dict, List
+from unittest.mock import patch
+import numpy as np
+from rag_app.models import KeywordExtractionResponse
+from rag_app.src.embeddings import EMBEDDING_DIMENSIONS, get_embedding_cache
+from rag_app.src.keyword_index import tokenize
+from rag_app.src.llm_cache import get_llm_cache
+
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+QUESTION_WORDS = {"the", "question", "is", "what", "does", "essay", "say", "about"}
+
+
+def count_words(texts: List[str]) -> List[int]:
+    """
+    Counts words and punctuation marks, which is close enough to the number
+    of tokens for chunking and request packing
+    """
+    return [len(TOKEN_PATTERN.findall(text)) for text in texts]
+
+
+class HashingEmbedder:
+    """
+    Embeds a text as the normalized sum of a fixed random vector per word, so
+    texts sharing words are close together. Words are hashed into `buckets`
+    vectors, which only depend on `seed`.
+    """
+
+    def __init__(
+        self,
+        dimensions: int = EMBEDDING_DIMENSIONS,
+        buckets: int = 2**15,
+        seed: int = 0,
+    ):
+        self.buckets = buckets
+        self.projection = np.random.default_rng(seed).standard_normal(
+            (buckets, dimensions), dtype=np.float32
+        )
+        self._buckets: Dict[str, int] = {}
+
+    def bucket(self, token: str) -> int:
+        bucket = self._buckets.get(token)
+        if bucket is None:
+            bucket = zlib.crc32(token.encode("utf-8")) % self.buckets
+            self._buckets[token] = bucket
+        return bucket
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        ids = [[self.bucket(token) for token in tokenize(text)] for text in texts]
+        lengths = np.array([len(row) for row in ids])
+        flat = np.fromiter(
+            (bucket for row in ids for bucket in row),
+            dtype=np.int64,
+            count=lengths.sum(),
+        )
+        embeddings = np.zeros((len(texts), self.projection.shape[1]), dtype=np.float32)
+        nonempty = lengths > 0
+        if nonempty.any():
+            starts = (np.cumsum(lengths) - lengths)[nonempty]
+            embeddings[nonempty] = np.add.reduceat(self.projection[flat], starts)
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return embeddings / np.maximum(norms, 1e-12)
+
+
+@lru_cache(maxsize=None)
+def get_embedder(dimensions: int = EMBEDDING_DIMENSIONS) -> HashingEmbedder:
+    return HashingEmbedder(dimensions)
+
+
+def extract_keywords(question: str) -> List[str]:
+    """
+    Every word of the question and every pair of adjacent words, leaving out
+    the words every question is phrased with
+    """
+    words = [word for word in tokenize(question) if word not in QUESTION_WORDS]
+    keywords = words + [" ".join(pair) for pair in zip(words, words[1:])]
+    while keywords and len(keywords) < 8:
+        keywords += keywords[: 8 - len(keywords)]
+    return keywords
+
+
+class StubEmbeddings:
+    async def create(
+        self, input: List[str], model: str, dimensions: int = None, **kwargs
+    ):
+        embeddings = get_embedder(dimensions or EMBEDDING_DIMENSIONS).embed(input)
+        return SimpleNamespace(
+            data=[
+                SimpleNamespace(index=index, embedding=embedding)
+                for index, embedding in enumerate(embeddings.tolist())
+            ]
+        )
+
+
+class StubCompletions:
+    async def create(self, model: str, messages: list, response_model=None, **kwargs):
+        if response_model is not KeywordExtractionResponse:
+            raise NotImplementedError(
+                f"The stub client only answers keyword extraction, not {response_model}"
+            )
+        return KeywordExtractionResponse(
+            keywords=extract_keywords(messages[-1]["content"])
+        )
+
+
+class StubAsyncOpenAI:
+    """
+    Answers the embedding and keyword extraction requests the app makes,
+    without an API key or network access
+    """
+
+    def __init__(self, **kwargs):
+        self.embeddings = StubEmbeddings()
+        self.chat = SimpleNamespace(completions=StubCompletions())
+
+    def with_options(self, **kwargs) -> "StubAsyncOpenAI":
+        return self
+
+
+@contextmanager
+def offline():
+    """
+    Routes every OpenAI client the app creates to `StubAsyncOpenAI`, counts
+    tokens with `count_words` and disables the on-disk embedding and LLM
+    caches, so that stub results never end up in them
+    """
+    with ExitStack() as stack:
+        stack.enter_context(
+            patch.dict(
+                os.environ,
+                {"RAG_APP_EMBEDDING_CACHE_SIZE": "0", "RAG_APP_LLM_CACHE_SIZE": "0"},
+            )
+        )
+        for target in [
+            "rag_app.src.embeddings.openai_client",
+            "rag_app.evaluate.AsyncOpenAI",
+        ]:
+            stack.enter_context(patch(target, StubAsyncOpenAI))
+        stack.enter_context(
+            patch("rag_app.evaluate.instructor", SimpleNamespace(patch=lambda c: c))
+        )
+        for target in [
+            "rag_app.src.chunking.count_tokens",
+            "rag_app.src.embeddings.count_tokens",
+        ]:
+            stack.enter_context(patch(target, count_words))
+
+        get_embedding_cache.cache_clear()
+        get_llm_cache.cache_clear()
+        stack.callback(get_embedding_cache.cache_clear)
+        stack.callback(get_llm_cache.cache_clear)
+        yield
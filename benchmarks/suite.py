@@ -0,0 +1,528 @@
+"""
+Offline benchmarks of every hot path against synthetic corpora.
+
+    python -m benchmarks.suite run --chunks 1000 --chunks 100000 --chunks 1000000 --output-path results.json
+    python -m benchmarks.suite compare --baseline-path baseline.json --current-path results.json
+"""
+
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, List, Optional
+import numpy as np
+import typer
+from lancedb import connect
+from rich.console import Console
+from rich.table import Table
+from benchmarks.corpus import SyntheticCorpus, sample_questions
+from benchmarks.stubs import offline
+from rag_app.evaluate import (
+    EVAL_MODES,
+    BM25SearchEvaluationItem,
+    QueryResult,
+    RetrievedChunk,
+    Retriever,
+    evaluate_items,
+    score,
+)
+from rag_app.ingest import from_folder
+from rag_app.models import EvaluationDataItem
+from rag_app.query import search_chunks
+from rag_app.src.filters import SearchFilter, build_filter
+from rag_app.src.chunking import chunk_text, list_files, read_files
+from rag_app.src.embeddings import (
+    EMBEDDING_PROVIDERS,
+    embed_for_table,
+    table_embedding_function,
+)
+from rag_app.src.metrics import MetricAggregate
+
+app = typer.Typer()
+
+TABLE_NAME = "chunks"
+# Bumped whenever results stop being comparable with older files
+RESULTS_VERSION = 1
+
+
+def make_result(
+    benchmark: str, chunks: int, items: int, unit: str, seconds: float, **extra
+) -> dict:
+    return {
+        "benchmark": benchmark,
+        "chunks": chunks,
+        "unit": unit,
+        "items": items,
+        "seconds": seconds,
+        "per_second": items / max(seconds, 1e-9),
+        **extra,
+    }
+
+
+def run_benchmark(
+    results: List[dict], benchmark: str, chunks: int, measure: Callable[[], dict]
+):
+    """
+    Records the result of one benchmark, or the error it failed with so that
+    the benchmarks after it still run
+    """
+    print(f"Running {benchmark} at {chunks} chunks")
+    try:
+        result = measure()
+    except Exception as e:
+        traceback.print_exc()
+        result = {
+            "benchmark": benchmark,
+            "chunks": chunks,
+            "error": f"{type(e).__name__}: {e}",
+        }
+    results.append(result)
+
+
+def bench_chunk_text(corpus_path: Path, chunks: int, window_size: int) -> dict:
+    size = sum(file.stat().st_size for file in list_files(corpus_path, ".md"))
+    start = time.perf_counter()
+    count = sum(
+        1
+        for _ in chunk_text(
+            read_files(corpus_path, ".md"), window_size=window_size, chunker="window"
+        )
+    )
+    elapsed = time.perf_counter() - start
+    return make_result(
+        "chunk_text",
+        chunks,
+        count,
+        "chunks",
+        elapsed,
+        mb_per_second=size / 1e6 / elapsed,
+    )
+
+
+def bench_ingest(
+    corpus_path: Path,
+    db_path: Path,
+    chunks: int,
+    window_size: int,
+    batch_size: int,
+    embedding_provider: str,
+) -> dict:
+    start = time.perf_counter()
+    from_folder(
+        db_path=str(db_path),
+        table_name=TABLE_NAME,
+        folder_path=str(corpus_path),
+        file_suffix=".md",
+        incremental=False,
+        recursive=False,
+        workers=1,
+        chunker="window",
+        window_size=window_size,
+        overlap=0,
+        batch_size=batch_size,
+        dedup=False,
+        dedup_threshold=0.85,
+        embedding_provider=embedding_provider,
+        embedding_model=None,
+        embedding_dimensions=None,
+        profile=False,
+        trace_path=None,
+    )
+    elapsed = time.perf_counter() - start
+    rows = connect(db_path).open_table(TABLE_NAME).count_rows()
+    return make_result("ingest", chunks, rows, "chunks", elapsed)
+
+
+def bench_embed(table, chunks: int, batch_size: int = 10_000) -> dict:
+    """
+    Re-embeds every chunk of the table with its embedding function, like a
+    bulk re-embed would
+    """
+    function = table_embedding_function(table)
+    count = 0
+    start = time.perf_counter()
+    for batch in table.to_lance().to_batches(columns=["text"], batch_size=batch_size):
+        texts = batch.column("text").to_pylist()
+        count += len(function.compute_source_embeddings(texts))
+    return make_result("embed", chunks, count, "chunks", time.perf_counter() - start)
+
+
+def bench_query_db(table, questions: List[EvaluationDataItem], chunks: int) -> dict:
+    """
+    Embeds and searches one question at a time, like `query db`
+    """
+    latencies = []
+    for question in questions:
+        start = time.perf_counter()
+        search_chunks(table, embed_for_table(table, [question.question])[0], 3)
+        latencies.append(time.perf_counter() - start)
+    latencies = np.array(latencies) * 1000
+    return make_result(
+        "query_db",
+        chunks,
+        len(questions),
+        "queries",
+        latencies.sum() / 1000,
+        p50_ms=float(np.percentile(latencies, 50)),
+        p95_ms=float(np.percentile(latencies, 95)),
+    )
+
+
+def bench_query_filtered(
+    table, questions: List[EvaluationDataItem], chunks: int
+) -> dict:
+    """
+    Like `query_db`, but only searches the one in 25 years of essays published
+    in 2021
+    """
+    start = time.perf_counter()
+    search_filter = SearchFilter.resolve(
+        table, build_filter(after=datetime(2021, 1, 1), before=datetime(2022, 1, 1))
+    )
+    resolve_ms = (time.perf_counter() - start) * 1000
+
+    latencies = []
+    for question in questions:
+        start = time.perf_counter()
+        search_chunks(
+            table,
+            embed_for_table(table, [question.question])[0],
+            3,
+            search_filter=search_filter,
+        )
+        latencies.append(time.perf_counter() - start)
+    latencies = np.array(latencies) * 1000
+    return make_result(
+        "query_filtered",
+        chunks,
+        len(questions),
+        "queries",
+        latencies.sum() / 1000,
+        p50_ms=float(np.percentile(latencies, 50)),
+        p95_ms=float(np.percentile(latencies, 95)),
+        resolve_ms=resolve_ms,
+        selectivity=search_filter.selectivity,
+    )
+
+
+def bench_evaluate(
+    db_path: Path, eval_mode: str, questions: List[EvaluationDataItem], chunks: int
+) -> dict:
+    start = time.perf_counter()
+    retriever = Retriever(eval_mode, str(db_path), TABLE_NAME)
+    load_seconds = time.perf_counter() - start
+
+    aggregate = MetricAggregate()
+    start = time.perf_counter()
+    count = evaluate_items(iter(questions), retriever, aggregate)
+    return make_result(
+        f"evaluate_{eval_mode}",
+        chunks,
+        count,
+        "questions",
+        time.perf_counter() - start,
+        load_seconds=load_seconds,
+        recall_at_10=aggregate.means()["Recall@10"],
+    )
+
+
+def bench_score(chunks: int, batch_size: int = 1000, k: int = 25) -> dict:
+    """
+    Scores as many questions as there are chunks, `batch_size` at a time like
+    `evaluate_items`, reusing one batch of results with the gold chunk at
+    every rank and missing for some
+    """
+    batch = [
+        QueryResult(
+            source=BM25SearchEvaluationItem(question="", chunk_id=f"gold-{i}"),
+            results=[
+                RetrievedChunk(
+                    chunk_id=f"gold-{i}" if rank == i % (k + 5) else f"chunk-{rank}",
+                    score=rank,
+                )
+                for rank in range(k)
+            ],
+        )
+        for i in range(batch_size)
+    ]
+    aggregate = MetricAggregate()
+    start = time.perf_counter()
+    for offset in range(0, chunks, batch_size):
+        df = score(batch[: chunks - offset])
+        aggregate.update(df.drop(columns=["chunk_id"]).to_dict("series"))
+    return make_result(
+        "score", chunks, chunks, "questions", time.perf_counter() - start
+    )
+
+
+def benchmark_scale(
+    work_dir: Path,
+    chunks: int,
+    num_questions: int,
+    eval_modes: List[str],
+    seed: int,
+    window_size: int,
+    batch_size: int,
+    embedding_provider: str,
+) -> List[dict]:
+    corpus_path = work_dir / f"corpus-{chunks}"
+    db_path = work_dir / f"db-{chunks}"
+    shutil.rmtree(corpus_path, ignore_errors=True)
+    shutil.rmtree(db_path, ignore_errors=True)
+    results = []
+
+    start = time.perf_counter()
+    documents = SyntheticCorpus(seed=seed, paragraph_tokens=min(96, window_size)).write(
+        corpus_path, chunks
+    )
+    results.append(
+        make_result(
+            "generate_corpus",
+            chunks,
+            chunks,
+            "chunks",
+            time.perf_counter() - start,
+            documents=documents,
+        )
+    )
+
+    run_benchmark(
+        results,
+        "chunk_text",
+        chunks,
+        lambda: bench_chunk_text(corpus_path, chunks, window_size),
+    )
+    run_benchmark(
+        results,
+        "ingest",
+        chunks,
+        lambda: bench_ingest(
+            corpus_path, db_path, chunks, window_size, batch_size, embedding_provider
+        ),
+    )
+    if db_path.exists() and TABLE_NAME in connect(db_path).table_names():
+        table = connect(db_path).open_table(TABLE_NAME)
+        run_benchmark(results, "embed", chunks, lambda: bench_embed(table, chunks))
+        questions = sample_questions(table, num_questions, seed)
+        run_benchmark(
+            results,
+            "query_db",
+            chunks,
+            lambda: bench_query_db(table, questions, chunks),
+        )
+        run_benchmark(
+            results,
+            "query_filtered",
+            chunks,
+            lambda: bench_query_filtered(table, questions, chunks),
+        )
+        for eval_mode in eval_modes:
+            run_benchmark(
+                results,
+                f"evaluate_{eval_mode}",
+                chunks,
+                lambda: bench_evaluate(db_path, eval_mode, questions, chunks),
+            )
+    run_benchmark(results, "score", chunks, lambda: bench_score(chunks))
+    return results
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=Path(__file__).parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results: List[dict]):
+    table = Table(title="Benchmarks")
+    table.add_column("Benchmark", style="cyan")
+    table.add_column("Chunks", style="cyan")
+    table.add_column("Items", style="magenta")
+    table.add_column("Seconds", style="magenta")
+    table.add_column("Items/s", style="green")
+    for result in results:
+        if "error" in result:
+            table.add_row(
+                result["benchmark"], str(result["chunks"]), "-", "-", result["error"]
+            )
+            continue
+        table.add_row(
+            result["benchmark"],
+            str(result["chunks"]),
+            f"{result['items']} {result['unit']}",
+            f"{result['seconds']:.2f}",
+            f"{result['per_second']:.1f}",
+        )
+    Console().print(table)
+
+
+@app.command(help="Benchmark every hot path against synthetic corpora, offline")
+def run(
+    chunks: List[int] = typer.Option(
+        default=[1000, 100_000, 1_000_000],
+        help="Corpus sizes to benchmark, in chunks (repeatable)",
+    ),
+    questions: int = typer.Option(
+        default=200, help="Number of questions to search and evaluate at each size"
+    ),
+    eval_mode: List[str] = typer.Option(
+        default=EVAL_MODES, help="Evaluation modes to benchmark (repeatable)"
+    ),
+    output_path: str = typer.Option(
+        default="benchmark-results.json", help="JSON file to write the results to"
+    ),
+    work_dir: Optional[str] = typer.Option(
+        default=None,
+        help="Folder to write corpora and tables to, a temporary folder by default",
+    ),
+    seed: int = typer.Option(default=0, help="Seed of the corpora and questions"),
+    window_size: int = typer.Option(
+        default=128, help="Maximum tokens per chunk with the window chunker"
+    ),
+    batch_size: int = typer.Option(
+        default=500, help="Number of chunks to embed and write at a time when ingesting"
+    ),
+    embedding_provider: str = typer.Option(
+        default="openai",
+        help=f"Embedding backend of the tables ( {' or '.join(EMBEDDING_PROVIDERS)} ), OpenAI being stubbed",
+    ),
+):
+    for mode in eval_mode:
+        if mode not in EVAL_MODES:
+            raise ValueError(
+                f"Invalid eval mode. Only {', '.join(EVAL_MODES)} is supported at the moment"
+            )
+    temporary = work_dir is None
+    root = Path(tempfile.mkdtemp(prefix="rag-app-bench-") if temporary else work_dir)
+    root.mkdir(parents=True, exist_ok=True)
+
+    results = []
+    try:
+        with offline():
+            for size in chunks:
+                results.extend(
+                    benchmark_scale(
+                        root,
+                        size,
+                        questions,
+                        eval_mode,
+                        seed,
+                        window_size,
+                        batch_size,
+                        embedding_provider,
+                    )
+                )
+    finally:
+        if temporary:
+            shutil.rmtree(root, ignore_errors=True)
+
+    report = {
+        "version": RESULTS_VERSION,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "git_commit": git_commit(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "config": {
+            "chunks": chunks,
+            "questions": questions,
+            "eval_modes": eval_mode,
+            "seed": seed,
+            "window_size": window_size,
+            "batch_size": batch_size,
+            "embedding_provider": embedding_provider,
+        },
+        "results": results,
+    }
+    Path(output_path).write_text(json.dumps(report, indent=2))
+    print_results(results)
+    print(f"Wrote {len(results)} results to {output_path}")
+
+
+def compare_results(baseline: dict, current: dict, threshold: float) -> List[dict]:
+    """
+    Pairs up the results of the same benchmark at the same size and flags the
+    ones whose throughput dropped by more than `threshold`
+    """
+    before = {
+        (result["benchmark"], result["chunks"]): result
+        for result in baseline["results"]
+    }
+    rows = []
+    for result in current["results"]:
+        previous = before.get((result["benchmark"], result["chunks"]))
+        if previous is None:
+            continue
+        row = {"benchmark": result["benchmark"], "chunks": result["chunks"]}
+        if "error" in result or "error" in previous:
+            row.update(
+                baseline=previous.get("per_second"),
+                current=result.get("per_second"),
+                change=None,
+                regression="error" in result and "error" not in previous,
+            )
+        else:
+            change = result["per_second"] / previous["per_second"] - 1
+            row.update(
+                baseline=previous["per_second"],
+                current=result["per_second"],
+                change=change,
+                regression=change < -threshold,
+            )
+        rows.append(row)
+    return rows
+
+
+@app.command(help="Compare two result files and fail if any throughput dropped")
+def compare(
+    baseline_path: str = typer.Option(help="Results of the run to compare against"),
+    current_path: str = typer.Option(help="Results of the run to check"),
+    threshold: float = typer.Option(
+        default=0.1, help="Largest drop in throughput that isn't a regression"
+    ),
+):
+    baseline = json.loads(Path(baseline_path).read_text())
+    current = json.loads(Path(current_path).read_text())
+    if baseline.get("config") != current.get("config"):
+        print("The runs were configured differently, so they may not be comparable")
+    rows = compare_results(baseline, current, threshold)
+
+    table = Table(title=f"{current_path} against {baseline_path}")
+    table.add_column("Benchmark", style="cyan")
+    table.add_column("Chunks", style="cyan")
+    table.add_column("Baseline/s", style="magenta")
+    table.add_column("Current/s", style="magenta")
+    table.add_column("Change", style="green")
+    for row in rows:
+        change = "error" if row["change"] is None else f"{row['change']:+.1%}"
+        table.add_row(
+            row["benchmark"],
+            str(row["chunks"]),
+            "-" if row["baseline"] is None else f"{row['baseline']:.1f}",
+            "-" if row["current"] is None else f"{row['current']:.1f}",
+            f"[red]{change}[/red]" if row["regression"] else change,
+        )
+    Console().print(table)
+
+    regressions = [row for row in rows if row["regression"]]
+    if regressions:
+        print(f"{len(regressions)} benchmarks regressed by more than {threshold:.0%}")
+        raise typer.Exit(code=1)
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,51 @@
+import typer
+from rich import print
+from rag_app.src.embedding_cache import get_embedding_cache
+from rag_app.src.llm_cache import get_llm_cache
+
+app = typer.Typer()
+
+CACHES = ["embeddings", "llm", "all"]
+
+
+@app.command(help="Show how much is stored in the local embedding and LLM caches")
+def stats():
+    cache = get_embedding_cache()
+    if not cache.enabled:
+        print("The embedding cache is disabled (RAG_APP_EMBEDDING_CACHE_SIZE=0)")
+    else:
+        size = cache.path.stat().st_size if cache.path.exists() else 0
+        print(f"Embedding cache at {cache.path}")
+        print(f"{len(cache)}/{cache.max_entries} embeddings ({size / 1e6:.1f} MB)")
+
+    llm_cache = get_llm_cache()
+    if not llm_cache.enabled:
+        print(
+            "The LLM cache is disabled "
+            "(RAG_APP_LLM_CACHE_MODE=off or RAG_APP_LLM_CACHE_SIZE=0)"
+        )
+        return
+
+    size = llm_cache.path.stat().st_size if llm_cache.path.exists() else 0
+    print(f"LLM cache at {llm_cache.path} in {llm_cache.mode} mode")
+    print(f"{len(llm_cache)}/{llm_cache.max_entries} responses ({size / 1e6:.1f} MB)")
+
+
+@app.command(help="Remove everything from the local embedding and/or LLM cache")
+def clear(
+    cache: str = typer.Option(
+        default="embeddings", help="Cache to clear ( embeddings, llm or all )"
+    ),
+):
+    if cache not in CACHES:
+        raise ValueError(
+            f"Invalid cache {cache}. Only {', '.join(CACHES)} is supported at the moment"
+        )
+    if cache in ("embeddings", "all"):
+        embedding_cache = get_embedding_cache()
+        embedding_cache.clear()
+        print(f"Cleared the embedding cache at {embedding_cache.path}")
+    if cache in ("llm", "all"):
+        llm_cache = get_llm_cache()
+        llm_cache.clear()
+        print(f"Cleared the LLM cache at {llm_cache.path}")
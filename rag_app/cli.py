@@ -1,31 +1,74 @@
+import importlib
 import typer
-import rag_app.query as QueryApp
-import rag_app.ingest as IngestApp
-import rag_app.generate_synthetic_question as GenerateApp
-import rag_app.evaluate as EvaluateApp
+from typer.core import TyperGroup
+
+# Every subcommand lives in its own module, which is only imported when the
+# subcommand is run so that each command only pays for the dependencies it uses
+SUBCOMMANDS = {
+    "query": (
+        "rag_app.query",
+        "Commands to help query your local lancedb instance",
+    ),
+    "ingest": (
+        "rag_app.ingest",
+        "Commands to help ingest data into your local lancedb instance",
+    ),
+    "generate": (
+        "rag_app.generate_synthetic_question",
+        "Commands to help generate synthethic data from your documents",
+    ),
+    "evaluate": (
+        "rag_app.evaluate",
+        "Commands to help evaluate the quality of your rag application",
+    ),
+    "cache": (
+        "rag_app.cache",
+        "Commands to help manage the local embedding and LLM response caches",
+    ),
+    "serve": (
+        "rag_app.serve",
+        "Serve queries against a table over HTTP from a long running process",
+    ),
+    "index": (
+        "rag_app.index",
+        "Commands to help build and tune vector indexes on your tables",
+    ),
+}
+
+
+def load_subcommand(name: str) -> TyperGroup:
+    module, help = SUBCOMMANDS[name]
+    group = typer.main.get_group(importlib.import_module(module).app)
+    group.name = name
+    group.help = help
+    return group
+
+
+class LazyGroup(TyperGroup):
+    """
+    Lists the subcommands in `SUBCOMMANDS` from their names and help alone, and
+    only imports the module of a subcommand once it is resolved to be run
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        for name, (_, help) in SUBCOMMANDS.items():
+            self.add_command(TyperGroup(name=name, help=help))
+
+    def resolve_command(self, ctx, args: list):
+        cmd_name, cmd, args = super().resolve_command(ctx, args)
+        if cmd_name in SUBCOMMANDS:
+            cmd = load_subcommand(cmd_name)
+        return cmd_name, cmd, args
+
 
 app = typer.Typer(
     name="Rag-App",
     help="A CLI for querying a local RAG application backed by LanceDB",
+    cls=LazyGroup,
 )
 
-app.add_typer(
-    QueryApp.app,
-    name="query",
-    help="Commands to help query your local lancedb instance",
-)
-app.add_typer(
-    IngestApp.app,
-    name="ingest",
-    help="Commands to help ingest data into your local lancedb instance",
-)
-app.add_typer(
-    GenerateApp.app,
-    name="generate",
-    help="Commands to help generate synthethic data from your documents",
-)
-app.add_typer(
-    EvaluateApp.app,
-    name="evaluate",
-    help="Commands to help evaluate the quality of your rag application",
-)
+
+@app.callback()
+def main():
+    pass
@@ -1,36 +1,43 @@
 import typer
 from pathlib import Path
 import json
-import duckdb
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from itertools import islice
+from multiprocessing import get_context
 from rag_app.models import EvaluationDataItem, KeywordExtractionResponse
 from lancedb import connect
-from typing import List, Union
+from typing import Callable, Iterable, List, Optional, Union
 from openai import AsyncOpenAI
+import numpy as np
 import pandas as pd
 from pydantic import BaseModel
 from tqdm.asyncio import tqdm_asyncio as asyncio
-from rag_app.src.chunking import batch_items
-from tenacity import retry, stop_after_attempt, wait_fixed
+from rag_app.src.embeddings import get_embedding_cache, get_query_embedder
 from asyncio import run
-from rag_app.models import TextChunk
-from rag_app.src.metrics import (
-    calculate_mrr,
-    calculate_ndcg,
-    slice_predictions_decorator,
+from rag_app.query import filtered_search
+from rag_app.src.chunking import batch_items
+from rag_app.src.keyword_index import KeywordIndex, load_keyword_index
+from rag_app.src.bm25 import BM25Index
+from rag_app.src.exact_search import VectorMatrix, load_vector_matrix
+from rag_app.src.quantization import (
+    QUANTIZATIONS,
+    QuantizedVectors,
+    load_quantized_vectors,
 )
+from rag_app.src.filters import SearchFilter, build_filter
+from rag_app.src.metrics import MetricAggregate, score_predictions
+from rag_app.src.llm_cache import cached_client, get_llm_cache
+from rag_app.src.profiling import profiling, span
 from rich.console import Console
-from collections import OrderedDict
 import instructor
 from rich.table import Table
 
 app = typer.Typer()
-evals = OrderedDict()
-SIZES = [3, 5, 10, 20]
-for size in SIZES:
-    evals[f"MRR@{size}"] = slice_predictions_decorator(size)(calculate_mrr)
 
-for size in SIZES:
-    evals[f"NDCG@{size}"] = slice_predictions_decorator(size)(calculate_ndcg)
+EVAL_MODES = ["semantic", "fts", "bm25", "bm25-fast"]
 
 
 class EmbeddedEvaluationItem(BaseModel):
@@ -50,21 +57,49 @@ class BM25SearchEvaluationItem(BaseModel):
     chunk_id: str
 
 
+class RetrievedChunk(BaseModel):
+    chunk_id: str
+    # The distance of the chunk for vector search, its relevance otherwise
+    score: float
+
+
 class QueryResult(BaseModel):
     source: Union[
         EmbeddedEvaluationItem, FullTextSearchEvaluationItem, BM25SearchEvaluationItem
     ]
-    results: List[TextChunk]
+    results: List[RetrievedChunk]
 
 
-@retry(stop=stop_after_attempt(5), wait=wait_fixed(30))
-async def embed_query(queries: List[EvaluationDataItem], client: AsyncOpenAI):
-    query_strings = [query.question for query in queries]
-    embeddings = await client.embeddings.create(
-        input=query_strings, model="text-embedding-3-large", dimensions=256
-    )
-    embeddings = [embedding_object.embedding for embedding_object in embeddings.data]
+class EvaluationCheckpoint(BaseModel):
+    input_file_path: str
+    eval_mode: str
+    where: Optional[str] = None
+    shard: int = 0
+    num_shards: int = 1
+    processed: int = 0
+    output_offset: int = 0
+    aggregate: dict = {}
+
+
+class ShardResult(BaseModel):
+    shard: int
+    evaluated: int
+    elapsed: float
+    aggregate: dict
+    # Spans and lane names recorded by the shard's process when profiling
+    spans: list = []
+    lanes: list = []
+
 
+async def embed_test_queries(
+    queries: List[EvaluationDataItem], table
+) -> List[EmbeddedEvaluationItem]:
+    batcher = get_query_embedder(table)
+    embeddings = await batcher.embed([query.question for query in queries])
+    print(
+        f"Embedded {len(queries)} queries in {batcher.requests} requests "
+        f"({batcher.deduplicated} duplicates, {batcher.retries} retries)"
+    )
     return [
         EmbeddedEvaluationItem(
             question=query.question, embedding=embedding, chunk_id=query.chunk_id
@@ -73,152 +108,515 @@ async def embed_query(queries: List[EvaluationDataItem], client: AsyncOpenAI):
     ]
 
 
-async def embed_test_queries(
-    queries: List[EvaluationDataItem],
-) -> List[EmbeddedEvaluationItem]:
-    client = AsyncOpenAI()
-    batched_queries = batch_items(queries)
-    coros = [embed_query(query_batch, client) for query_batch in batched_queries]
-    result = await asyncio.gather(*coros)
-    return [item for sublist in result for item in sublist]
-
-
 async def fetch_relevant_results(
     queries: List[EmbeddedEvaluationItem],
-    db_path: str,
-    table_name: str,
+    table,
+    nprobes: Optional[int] = None,
+    refine_factor: Optional[int] = None,
+    search_filter: Optional[SearchFilter] = None,
 ) -> List[QueryResult]:
-    db = connect(db_path)
-    table = db.open_table(table_name)
-
     async def query_table(query: EmbeddedEvaluationItem):
-        results = table.search(query.embedding).limit(25).to_pydantic(TextChunk)
+        rows = filtered_search(
+            table,
+            query.embedding,
+            25,
+            nprobes,
+            refine_factor,
+            search_filter,
+            columns=["chunk_id"],
+        )
+        results = [
+            RetrievedChunk(chunk_id=row["chunk_id"], score=row["_distance"])
+            for row in rows
+        ]
         return QueryResult(results=results, source=query)
 
     coros = [query_table(query) for query in queries]
     return await asyncio.gather(*coros)
 
 
+def fetch_exact_results(
+    queries: List[EmbeddedEvaluationItem], matrix: VectorMatrix
+) -> List[QueryResult]:
+    ids, distances = matrix.search(
+        np.array([query.embedding for query in queries], dtype=np.float32), k=25
+    )
+    return to_query_results(queries, ids, distances)
+
+
+def fetch_quantized_results(
+    queries: List[EmbeddedEvaluationItem],
+    quantized: QuantizedVectors,
+    matrix: VectorMatrix,
+    rescore_factor: int = 10,
+) -> List[QueryResult]:
+    ids, distances = quantized.search(
+        np.array([query.embedding for query in queries], dtype=np.float32),
+        matrix,
+        k=25,
+        rescore_factor=rescore_factor,
+    )
+    return to_query_results(queries, ids, distances)
+
+
+def to_query_results(
+    queries: List[EmbeddedEvaluationItem],
+    ids: List[List[str]],
+    distances: np.ndarray,
+) -> List[QueryResult]:
+    return [
+        QueryResult(
+            source=query,
+            results=[
+                RetrievedChunk(chunk_id=chunk_id, score=distance)
+                for chunk_id, distance in zip(chunk_ids, row)
+            ],
+        )
+        for query, chunk_ids, row in zip(queries, ids, distances.tolist())
+    ]
+
+
 async def generate_keywords_for_questions(
     queries: List[EvaluationDataItem],
 ) -> List[str]:
     async def generate_query_keywords(query: EvaluationDataItem, client: AsyncOpenAI):
-        response: KeywordExtractionResponse = await client.chat.completions.create(
-            model="gpt-4-0613",
-            response_model=KeywordExtractionResponse,
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are a world class search engine. You are about to be given a question by a user. Make sure to generate as many possible keywords that are relevant to the question at hand which can help to identify relevant chunks of information to the user's query.",
-                },
-                {
-                    "role": "assistant",
-                    "content": "Make sure to extract all possible keywords within the question itself first before generating new ones. Also expand all accronyms, identify synonyms and related topics.",
-                },
-                {"role": "user", "content": f"The question is {query.question}."},
-            ],
-            max_retries=5,
-        )
+        with span("llm_keywords"):
+            response: KeywordExtractionResponse = await client.chat.completions.create(
+                model="gpt-4-0613",
+                response_model=KeywordExtractionResponse,
+                messages=[
+                    {
+                        "role": "system",
+                        "content": "You are a world class search engine. You are about to be given a question by a user. Make sure to generate as many possible keywords that are relevant to the question at hand which can help to identify relevant chunks of information to the user's query.",
+                    },
+                    {
+                        "role": "assistant",
+                        "content": "Make sure to extract all possible keywords within the question itself first before generating new ones. Also expand all accronyms, identify synonyms and related topics.",
+                    },
+                    {"role": "user", "content": f"The question is {query.question}."},
+                ],
+                max_retries=5,
+            )
         return FullTextSearchEvaluationItem(
             question=query.question,
             keywords=response.keywords,
             chunk_id=query.chunk_id,
         )
 
-    client = instructor.patch(AsyncOpenAI())
+    client = cached_client(lambda: instructor.patch(AsyncOpenAI()))
     coros = [generate_query_keywords(query, client) for query in queries]
     return await asyncio.gather(*coros)
 
 
-async def match_chunks_with_keywords(
-    queries: List[FullTextSearchEvaluationItem], db_path: str, table_name: str
-):
-    async def query_table(query: FullTextSearchEvaluationItem) -> pd.DataFrame:
-        keywords = query.keywords
-        keywords = [keyword.replace("'", "''") for keyword in keywords]
-        keyword_conditions = " +\n".join(
-            [
-                f"CASE WHEN regexp_matches(text, '(?i){keyword}') THEN 1 ELSE 0 END"
-                for keyword in keywords
-            ]
-        )
-        keyword_search = "|".join(keywords)
-        duckdb_query = f"""
-            SELECT 
-            *,
-            ({keyword_conditions}) AS num_keywords_matched
-        FROM 
-            chunks
-        WHERE 
-            regexp_matches(text, '(?i)({keyword_search})')
-            ORDER BY
-            num_keywords_matched DESC
-            LIMIT 25
-        """
-
-        db = connect(db_path)
-        chunk_table = db.open_table(table_name)
-        chunks = chunk_table.to_lance()
-        result = duckdb.query(duckdb_query).to_df()
-        return QueryResult(
+def match_chunks_with_keywords(
+    queries: List[FullTextSearchEvaluationItem],
+    index: KeywordIndex,
+    mask: Optional[np.ndarray] = None,
+) -> List[QueryResult]:
+    return [
+        QueryResult(
             source=query,
             results=[
-                TextChunk(
-                    **{
-                        key: value
-                        for key, value in row.items()
-                        if key != "num_keywords_matched"
-                    }
-                )
-                for index, row in result.iterrows()
+                RetrievedChunk(chunk_id=chunk_id, score=count)
+                for chunk_id, count in index.search(query.keywords, 25, mask)
             ],
         )
-
-    coros = [query_table(query) for query in queries]
-    return await asyncio.gather(*coros)
+        for query in queries
+    ]
 
 
 def match_chunks_with_bm25(
-    db_path: str, table_name: str, queries: List[EvaluationDataItem]
+    chunk_table,
+    queries: List[EvaluationDataItem],
+    search_filter: Optional[SearchFilter] = None,
 ):
-    db = connect(db_path)
-    chunk_table = db.open_table(table_name)
-    try:
-        chunk_table.create_fts_index("text", replace=False)
-    except ValueError as e:
-        print("Index on the column 'text' has already been created.")
-
     def query_table(query: EvaluationDataItem):
-        db = connect(db_path)
-        chunk_table = db.open_table(table_name)
-
-        retrieved_queries = (
-            chunk_table.search(query.question).limit(25).to_pydantic(TextChunk)
+        # The table has an embedding function, so a text query would
+        # otherwise be embedded and searched by vector
+        rows = (
+            chunk_table.search(query.question, query_type="fts")
+            .limit(25)
+            .select(["chunk_id"])
         )
+        if search_filter is not None:
+            rows = rows.where(search_filter.sql, prefilter=True)
         return QueryResult(
             source=BM25SearchEvaluationItem(
                 question=query.question, chunk_id=query.chunk_id
             ),
-            results=retrieved_queries,
+            results=[
+                RetrievedChunk(chunk_id=row["chunk_id"], score=row["_score"])
+                for row in rows.to_list()
+            ],
         )
 
     return [query_table(query) for query in queries]
 
 
-def score(query: QueryResult) -> dict[str, float]:
-    y_true = query.source.chunk_id
-    y_pred = [x.chunk_id for x in query.results]
+def match_chunks_with_bm25_fast(index: BM25Index, queries: List[EvaluationDataItem]):
+    matches = index.search([query.question for query in queries], k=25)
+    return [
+        QueryResult(
+            source=BM25SearchEvaluationItem(
+                question=query.question, chunk_id=query.chunk_id
+            ),
+            results=[
+                RetrievedChunk(chunk_id=chunk_id, score=score)
+                for chunk_id, score in match
+            ],
+        )
+        for query, match in zip(queries, matches)
+    ]
+
+
+class Retriever:
+    """
+    Opens the table and loads whatever index an eval mode needs once, then
+    retrieves chunks for one batch of questions at a time
+    """
+
+    def __init__(
+        self,
+        eval_mode: str,
+        db_path: str,
+        table_name: str,
+        nprobes: Optional[int] = None,
+        refine_factor: Optional[int] = None,
+        exact: bool = False,
+        quantization: Optional[str] = None,
+        rescore_factor: int = 10,
+        where: Optional[str] = None,
+    ):
+        if eval_mode not in EVAL_MODES:
+            raise ValueError(
+                f"Invalid eval mode. Only {', '.join(EVAL_MODES)} is supported at the moment"
+            )
+        self.eval_mode = eval_mode
+        self.nprobes = nprobes
+        self.refine_factor = refine_factor
+        self.exact = exact
+        self.quantization = quantization
+        self.rescore_factor = rescore_factor
+        self.table = connect(db_path).open_table(table_name)
+        self.index = None
+        self.quantized = None
+        self.mask = None
+        with span("resolve_filter"):
+            self.filter = SearchFilter.resolve(self.table, where)
+
+        start = time.perf_counter()
+        with span("load_index", eval_mode=eval_mode):
+            if eval_mode == "semantic" and (exact or quantization):
+                self.index = load_vector_matrix(db_path, table_name, self.table)
+                if quantization:
+                    self.quantized = load_quantized_vectors(
+                        db_path, table_name, self.table, self.index, quantization
+                    )
+            elif eval_mode == "fts":
+                self.index = load_keyword_index(db_path, table_name, self.table)
+            elif eval_mode == "bm25":
+                indexed = [index.columns for index in self.table.list_indices()]
+                if ["text"] not in indexed:
+                    # LanceDB's native index, which bm25-fast mirrors
+                    self.table.create_fts_index("text", use_tantivy=False)
+            elif eval_mode == "bm25-fast":
+                rows = (
+                    self.table.to_lance()
+                    .to_table(columns=["chunk_id", "text"])
+                    .to_pylist()
+                )
+                self.index = BM25Index.build(
+                    (row["chunk_id"], row["text"]) for row in rows
+                )
+        if self.index is not None:
+            print(f"Loaded the {eval_mode} index in {time.perf_counter() - start:.2f}s")
+        if self.filter is not None and self.index is not None:
+            self.filter_index()
+
+    def filter_index(self):
+        """
+        Narrows an index held in memory down to the chunks matching the filter
+        """
+        with span("filter_index"):
+            rows = self.filter.rows(self.table, self.index.chunk_ids)
+            if self.eval_mode == "fts":
+                self.mask = np.zeros(len(self.index.chunk_ids), dtype=bool)
+                self.mask[rows] = True
+                return
+            self.index = self.index.subset(rows)
+            if self.quantized is not None:
+                self.quantized = self.quantized.subset(rows)
+
+    def retrieve(self, items: List[EvaluationDataItem]) -> List[QueryResult]:
+        if self.eval_mode == "semantic":
+            with span("embed_queries", queries=len(items)):
+                queries = run(embed_test_queries(items, self.table))
+        elif self.eval_mode == "fts":
+            with span("generate_keywords", queries=len(items)):
+                queries = run(generate_keywords_for_questions(items))
+        else:
+            queries = items
+        with span("search", queries=len(items)):
+            return self.search(queries)
+
+    def search(self, queries: list) -> List[QueryResult]:
+        if self.eval_mode == "semantic":
+            if self.quantized is not None:
+                return fetch_quantized_results(
+                    queries, self.quantized, self.index, self.rescore_factor
+                )
+            if self.exact:
+                return fetch_exact_results(queries, self.index)
+            return run(
+                fetch_relevant_results(
+                    queries,
+                    self.table,
+                    self.nprobes,
+                    self.refine_factor,
+                    self.filter,
+                )
+            )
+        if self.eval_mode == "fts":
+            return match_chunks_with_keywords(queries, self.index, self.mask)
+        if self.eval_mode == "bm25":
+            return match_chunks_with_bm25(self.table, queries, self.filter)
+        return match_chunks_with_bm25_fast(self.index, queries)
+
+
+def score(query_results: List[QueryResult]) -> pd.DataFrame:
+    chunk_ids = [query.source.chunk_id for query in query_results]
+    metrics = score_predictions(
+        chunk_ids,
+        [[chunk.chunk_id for chunk in query.results] for query in query_results],
+    )
+    df = pd.DataFrame(metrics).round(2)
+    df["chunk_id"] = chunk_ids
+    df["retrieved_size"] = [len(query.results) for query in query_results]
+    return df
+
+
+def read_evaluation_items(
+    input_file_path: str, skip: int = 0, shard: int = 0, num_shards: int = 1
+) -> Iterable[EvaluationDataItem]:
+    """
+    Streams every `num_shards`-th question of the file starting from the
+    `shard`-th, skipping the first `skip` questions of that shard
+    """
+    with open(input_file_path, "r") as file:
+        lines = islice((line for line in file if line.strip()), shard, None, num_shards)
+        for line in islice(lines, skip, None):
+            yield EvaluationDataItem(**json.loads(line))
+
+
+def format_rows(query_results: List[QueryResult], df: pd.DataFrame) -> List[dict]:
+    rows = df.astype(object).where(df.notna(), None).to_dict("records")
+    return [
+        {
+            "question": query.source.question,
+            **row,
+            "retrieved": [chunk.chunk_id for chunk in query.results],
+        }
+        for query, row in zip(query_results, rows)
+    ]
+
+
+def evaluate_items(
+    items: Iterable[EvaluationDataItem],
+    retriever: Retriever,
+    aggregate: MetricAggregate,
+    batch_size: int = 1000,
+    on_batch: Optional[Callable[[List[QueryResult], pd.DataFrame], None]] = None,
+) -> int:
+    """
+    Retrieves and scores `batch_size` questions at a time, folding their
+    metrics into `aggregate`. Only one batch of results is held at once.
+    """
+    ttl = 0
+    for batch in batch_items(items, batch_size):
+        query_results = retriever.retrieve(batch)
+        with span("score", queries=len(batch)):
+            df = score(query_results)
+            aggregate.update(df.drop(columns=["chunk_id"]).to_dict("series"))
+        ttl += len(batch)
+        if on_batch is not None:
+            with span("write_results", queries=len(batch)):
+                on_batch(query_results, df)
+    return ttl
+
+
+def save_checkpoint(path: Path, checkpoint: EvaluationCheckpoint):
+    temporary = path.with_suffix(".tmp")
+    temporary.write_text(checkpoint.model_dump_json())
+    os.replace(temporary, path)
+
+
+def print_mean_values(console: Console, means: dict):
+    mean_values_table = Table(title="Mean Values")
+    mean_values_table.add_column("Metric", style="cyan")
+    mean_values_table.add_column("Value", style="magenta")
+    for metric, value in means.items():
+        mean_values_table.add_row(metric, str(round(value, 2)))
+    console.print(mean_values_table)
+
+
+def shard_output_path(output_file_path: str, shard: int, num_shards: int) -> str:
+    if num_shards == 1:
+        return output_file_path
+    return str(Path(output_file_path).with_suffix(f".shard-{shard}.jsonl"))
+
+
+def evaluate_shard(
+    input_file_path: str,
+    db_path: str,
+    table_name: str,
+    eval_mode: str,
+    nprobes: Optional[int] = None,
+    refine_factor: Optional[int] = None,
+    exact: bool = False,
+    quantization: Optional[str] = None,
+    rescore_factor: int = 10,
+    where: Optional[str] = None,
+    batch_size: int = 1000,
+    output_file_path: Optional[str] = None,
+    resume: bool = False,
+    shard: int = 0,
+    num_shards: int = 1,
+    profile: bool = False,
+) -> ShardResult:
+    """
+    Evaluates one shard of the evaluation file with its own table handle,
+    checkpointing to `output_file_path` when one is given. With `profile`,
+    the spans the shard recorded are returned with its result, so that a
+    shard running in its own process can be profiled.
+    """
+    if profile:
+        with profiling(summary=False) as profiler:
+            result = evaluate_shard(
+                input_file_path,
+                db_path,
+                table_name,
+                eval_mode,
+                nprobes,
+                refine_factor,
+                exact,
+                quantization,
+                rescore_factor,
+                where,
+                batch_size,
+                output_file_path,
+                resume,
+                shard,
+                num_shards,
+            )
+        result.spans = profiler.spans
+        result.lanes = [
+            [pid, lane, name] for (pid, lane), name in profiler.lane_names.items()
+        ]
+        return result
+
+    checkpoint = EvaluationCheckpoint(
+        input_file_path=input_file_path,
+        eval_mode=eval_mode,
+        where=where,
+        shard=shard,
+        num_shards=num_shards,
+    )
+    checkpoint_path = None
+    if output_file_path:
+        checkpoint_path = Path(output_file_path).with_suffix(".checkpoint.json")
+        if resume and checkpoint_path.exists():
+            checkpoint = EvaluationCheckpoint.model_validate_json(
+                checkpoint_path.read_text()
+            )
+            assert (
+                checkpoint.input_file_path == input_file_path
+                and checkpoint.eval_mode == eval_mode
+                and checkpoint.where == where
+                and checkpoint.shard == shard
+                and checkpoint.num_shards == num_shards
+            ), f"{checkpoint_path} is a checkpoint of a different evaluation"
+            print(f"Resuming after {checkpoint.processed} questions")
+
+    retriever = Retriever(
+        eval_mode,
+        db_path,
+        table_name,
+        nprobes,
+        refine_factor,
+        exact,
+        quantization,
+        rescore_factor,
+        where,
+    )
+    aggregate = MetricAggregate.from_dict(checkpoint.aggregate)
+    console = Console()
+
+    output = None
+    if output_file_path:
+        if resume and Path(output_file_path).exists():
+            # Drop anything written after the last checkpoint
+            os.truncate(output_file_path, checkpoint.output_offset)
+            output = open(output_file_path, "ab")
+        else:
+            output = open(output_file_path, "wb")
+
+    def on_batch(query_results: List[QueryResult], df: pd.DataFrame):
+        if output is None:
+            if num_shards == 1:
+                console.print(df.set_index("chunk_id").fillna("N/A"))
+            return
+
+        for row in format_rows(query_results, df):
+            output.write((json.dumps(row) + "\n").encode("utf-8"))
+        output.flush()
+        os.fsync(output.fileno())
+        checkpoint.processed += len(query_results)
+        checkpoint.output_offset = output.tell()
+        checkpoint.aggregate = aggregate.to_dict()
+        save_checkpoint(checkpoint_path, checkpoint)
+
+    start = time.perf_counter()
+    try:
+        ttl = evaluate_items(
+            read_evaluation_items(
+                input_file_path, checkpoint.processed, shard, num_shards
+            ),
+            retriever,
+            aggregate,
+            batch_size,
+            on_batch,
+        )
+    finally:
+        if output is not None:
+            output.close()
 
-    metrics = {label: metric_fn(y_true, y_pred) for label, metric_fn in evals.items()}
-    metrics = {
-        label: round(value, 2) if value != "N/A" else value
-        for label, value in metrics.items()
-    }
-    return {
-        **metrics,
-        "chunk_id": query.source.chunk_id,
-        "retrieved_size": len(query.results),
-    }
+    if eval_mode == "semantic":
+        cache = get_embedding_cache()
+        print(f"Embedding cache: {cache.hits} hits, {cache.misses} misses")
+    elif eval_mode == "fts":
+        print(get_llm_cache().summary())
+    return ShardResult(
+        shard=shard,
+        evaluated=ttl,
+        elapsed=time.perf_counter() - start,
+        aggregate=aggregate.to_dict(),
+    )
+
+
+def print_shards(console: Console, results: List[ShardResult]):
+    shards_table = Table(title="Shards")
+    shards_table.add_column("Shard", style="cyan")
+    shards_table.add_column("Questions", style="magenta")
+    shards_table.add_column("Seconds", style="green")
+    shards_table.add_column("Questions/s", style="green")
+    for result in results:
+        shards_table.add_row(
+            str(result.shard),
+            str(result.evaluated),
+            f"{result.elapsed:.2f}",
+            f"{result.evaluated / max(result.elapsed, 1e-9):.1f}",
+        )
+    console.print(shards_table)
 
 
 @app.command(help="Evaluate document retrieval")
@@ -228,7 +626,66 @@ def from_jsonl(
     ),
     db_path: str = typer.Option(help="Your LanceDB path"),
     table_name: str = typer.Option(help="Table to read data from"),
-    eval_mode=typer.Option(help="Query Method ( semantic or fts )", default="semantic"),
+    eval_mode=typer.Option(
+        help="Query Method ( semantic, fts, bm25 or bm25-fast )", default="semantic"
+    ),
+    nprobes: Optional[int] = typer.Option(
+        default=None, help="Number of index partitions to search (indexed tables only)"
+    ),
+    refine_factor: Optional[int] = typer.Option(
+        default=None,
+        help="Re-rank refine_factor * n candidates exactly (indexed tables only)",
+    ),
+    exact: bool = typer.Option(
+        default=False,
+        help="Score semantic mode with an exact in-memory search over the chunk vectors",
+    ),
+    quantization: Optional[str] = typer.Option(
+        default=None,
+        help=f"Score semantic mode by searching quantized codes of the vectors ( {', '.join(QUANTIZATIONS)} ) and rescoring a shortlist exactly",
+    ),
+    rescore_factor: int = typer.Option(
+        default=10,
+        help="Rescore rescore_factor * 25 chunks exactly (with --quantization only)",
+    ),
+    batch_size: int = typer.Option(
+        default=1000, help="Number of questions to retrieve and score at a time"
+    ),
+    output_file_path: Optional[str] = typer.Option(
+        default=None,
+        help="Jsonl file to write per-question results to instead of printing them",
+    ),
+    resume: bool = typer.Option(
+        default=False,
+        help="Continue an interrupted run from the checkpoint of --output-file-path",
+    ),
+    workers: int = typer.Option(
+        default=1, help="Number of processes to shard the evaluation file across"
+    ),
+    where: Optional[str] = typer.Option(
+        default=None,
+        help="SQL filter on the chunk columns, e.g. \"source LIKE '%startup%'\"",
+    ),
+    after: Optional[datetime] = typer.Option(
+        default=None,
+        formats=["%Y-%m-%d"],
+        help="Only retrieve chunks published on or after this date",
+    ),
+    before: Optional[datetime] = typer.Option(
+        default=None,
+        formats=["%Y-%m-%d"],
+        help="Only retrieve chunks published before this date",
+    ),
+    doc_id: Optional[List[str]] = typer.Option(
+        default=None, help="Only retrieve chunks of this document (repeatable)"
+    ),
+    profile: bool = typer.Option(
+        default=False, help="Print how long every stage of the evaluation took"
+    ),
+    trace_path: Optional[str] = typer.Option(
+        default=None,
+        help="Write a Chrome trace of every stage to this JSON file (implies --profile)",
+    ),
 ):
     assert Path(
         input_file_path
@@ -237,39 +694,73 @@ def from_jsonl(
         Path(input_file_path).suffix == ".jsonl"
     ), "The output file must have a .jsonl extension."
     assert Path(db_path).exists(), f"Database path {db_path} does not exist"
-
-    with open(input_file_path, "r") as file:
-        data = file.readlines()
-        evaluation_data = [EvaluationDataItem(**json.loads(item)) for item in data]
-
-    if eval_mode == "semantic":
-        embedded_queries = run(embed_test_queries(evaluation_data))
-        query_results = run(
-            fetch_relevant_results(embedded_queries, db_path, table_name)
-        )
-    elif eval_mode == "fts":
-        fts_queries = run(generate_keywords_for_questions(evaluation_data))
-        query_results = run(
-            match_chunks_with_keywords(fts_queries, db_path, table_name)
+    assert (
+        not resume or output_file_path
+    ), "--resume needs the --output-file-path of the run to resume"
+    assert workers >= 1, "--workers must be at least 1"
+    assert not (
+        exact and quantization
+    ), "--exact and --quantization are different searches, pick one"
+    if quantization is not None and quantization not in QUANTIZATIONS:
+        raise ValueError(
+            f"Invalid quantization {quantization}. Only {', '.join(QUANTIZATIONS)} is supported at the moment"
         )
-    elif eval_mode == "bm25":
-        query_results = match_chunks_with_bm25(db_path, table_name, evaluation_data)
-    else:
+    if eval_mode not in EVAL_MODES:
         raise ValueError(
-            "Invalid eval mode. Only semantic, fts or bm25 is supported at the moment"
+            f"Invalid eval mode. Only {', '.join(EVAL_MODES)} is supported at the moment"
         )
 
-    evals = [score(result) for result in query_results]
+    where = build_filter(where, after, before, doc_id)
+    shard_args = [
+        (
+            input_file_path,
+            db_path,
+            table_name,
+            eval_mode,
+            nprobes,
+            refine_factor,
+            exact,
+            quantization,
+            rescore_factor,
+            where,
+            batch_size,
+            output_file_path and shard_output_path(output_file_path, shard, workers),
+            resume,
+            shard,
+            workers,
+            bool(profile or trace_path) and workers > 1,
+        )
+        for shard in range(workers)
+    ]
 
-    df = pd.DataFrame(evals)
-    df = df.set_index("chunk_id")
-    console = Console()
-    console.print(df)
-    print("")
-    numeric_df = df.apply(pd.to_numeric, errors="coerce")
-    mean_values_table = Table(title="Mean Values")
-    mean_values_table.add_column("Metric", style="cyan")
-    mean_values_table.add_column("Value", style="magenta")
-    for metric, value in numeric_df.mean().items():
-        mean_values_table.add_row(metric, str(round(value, 2)))
-    console.print(mean_values_table)
+    with profiling(profile, trace_path) as profiler:
+        start = time.perf_counter()
+        if workers == 1:
+            results = [evaluate_shard(*shard_args[0])]
+        else:
+            # LanceDB runs background threads, so workers are spawned, not forked
+            with ProcessPoolExecutor(
+                max_workers=workers, mp_context=get_context("spawn")
+            ) as pool:
+                futures = [pool.submit(evaluate_shard, *args) for args in shard_args]
+                results = [future.result() for future in futures]
+        elapsed = time.perf_counter() - start
+        if profiler is not None:
+            for result in results:
+                lanes = {(pid, lane): name for pid, lane, name in result.lanes}
+                profiler.merge(result.spans, lanes)
+
+        aggregate = MetricAggregate()
+        for result in results:
+            aggregate.merge(MetricAggregate.from_dict(result.aggregate))
+        ttl = sum(result.evaluated for result in results)
+
+        console = Console()
+        if workers > 1:
+            print_shards(console, results)
+        print(
+            f"Evaluated {ttl} questions in {elapsed:.2f}s "
+            f"({ttl / max(elapsed, 1e-9):.1f} questions/s)"
+        )
+        print("")
+        print_mean_values(console, aggregate.means())
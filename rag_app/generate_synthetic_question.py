@@ -1,59 +1,160 @@
+import asyncio
+import json
 import typer
 from pathlib import Path
 from rag_app.src.chunking import read_files, chunk_text
+from rag_app.src.embeddings import RequestBackoff, get_retry_after, retryable_errors
 from instructor import patch
 from openai import AsyncOpenAI
-from tqdm.asyncio import tqdm_asyncio as asyncio
-from asyncio import run
+from pydantic import ValidationError
+from tqdm import tqdm
 from rag_app.models import TextChunk, EvaluationDataItem, QuestionAnswerPair
-from typing import List
-from tenacity import retry, stop_after_attempt, wait_fixed
-
+from typing import Iterable, Optional, Set, TextIO
+from rag_app.src.llm_cache import cached_client, get_llm_cache
+from rag_app.src.profiling import profiling, span, timed
 
 app = typer.Typer()
 
+# What instructor raises once a response still fails validation after its own
+# retries: the last validation error before 1.0, wrapped since then
+try:
+    from instructor.core import InstructorRetryException
+except ImportError:
+    try:
+        from instructor.exceptions import InstructorRetryException
+    except ImportError:
+        InstructorRetryException = ValidationError
+VALIDATION_ERRORS = (ValidationError, json.JSONDecodeError, InstructorRetryException)
+
 
-@retry(stop=stop_after_attempt(5), wait=wait_fixed(30))
 async def generate_question_answer_pair(
     client: AsyncOpenAI,
     chunk: TextChunk,
+    backoff: Optional[RequestBackoff] = None,
+    max_retries: int = 5,
 ) -> tuple[QuestionAnswerPair, TextChunk]:
-    res = await client.chat.completions.create(
-        model="gpt-3.5-turbo",
-        messages=[
-            {
-                "role": "system",
-                "content": "You are a world class algorithm that excels at generating great questions that can be only answered by a specific text that will soon be passed to you. ",
-            },
-            {
-                "role": "assistant",
-                "content": f"Generate a question and answer pair that uses information and content that is specific to the following text chunk, including a chain of thought:\n\n{chunk}",
-            },
-        ],
-        response_model=QuestionAnswerPair,
-    )
-    return (res, chunk)
-
-
-async def gather_questions(chunks: TextChunk) -> List[EvaluationDataItem]:
-    client = patch(AsyncOpenAI())
-    coros = [generate_question_answer_pair(client, chunk) for chunk in chunks]
-    output = []
-    for response in asyncio.as_completed(coros):
-        questionAnswer, chunkData = await response
-        assert isinstance(chunkData, TextChunk)
-        assert isinstance(questionAnswer, QuestionAnswerPair)
-        output.append(
-            EvaluationDataItem(
-                **{
-                    "question": questionAnswer.question,
-                    "answer": questionAnswer.answer,
-                    "chunk": chunkData.text,
-                    "chunk_id": chunkData.chunk_id,
-                }
+    """
+    Generates a question answer pair for a chunk. Rate limits and server errors
+    are retried after pausing every request that shares `backoff`. Responses
+    which fail validation are asked for again straight away.
+    """
+    backoff = RequestBackoff() if backoff is None else backoff
+    for attempt in range(max_retries + 1):
+        await backoff.wait()
+        try:
+            with span("llm_question", attempt=attempt):
+                res = await client.chat.completions.create(
+                    model="gpt-3.5-turbo",
+                    messages=[
+                        {
+                            "role": "system",
+                            "content": "You are a world class algorithm that excels at generating great questions that can be only answered by a specific text that will soon be passed to you. ",
+                        },
+                        {
+                            "role": "assistant",
+                            "content": f"Generate a question and answer pair that uses information and content that is specific to the following text chunk, including a chain of thought:\n\n{chunk}",
+                        },
+                    ],
+                    response_model=QuestionAnswerPair,
+                )
+        except retryable_errors() as e:
+            if attempt == max_retries:
+                raise
+            backoff.record_failure(attempt, get_retry_after(e))
+            continue
+        except VALIDATION_ERRORS:
+            # A malformed response says nothing about how loaded the API is
+            if attempt == max_retries:
+                raise
+            continue
+        backoff.record_success()
+        return (res, chunk)
+
+
+def read_generated_chunk_ids(output_path: Path) -> Set[str]:
+    """
+    Returns the chunk ids already in an output file, dropping a trailing line
+    left incomplete by an interrupted run
+    """
+    chunk_ids = set()
+    if not output_path.exists():
+        return chunk_ids
+    with open(output_path, "rb+") as f:
+        complete = 0
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            chunk_ids.add(json.loads(line)["chunk_id"])
+            complete += len(line)
+        f.truncate(complete)
+    return chunk_ids
+
+
+async def gather_questions(
+    chunks: Iterable[TextChunk],
+    output: TextIO,
+    concurrency: int = 10,
+    progress: Optional[tqdm] = None,
+    client: Optional[AsyncOpenAI] = None,
+) -> int:
+    """
+    Generates a question for every chunk with at most `concurrency` requests
+    in flight and appends each one to `output` as soon as it is done. Chunks
+    are only read when a slot frees up, so the corpus is consumed lazily.
+    Returns the number of questions written.
+    """
+    if client is None:
+        client = cached_client(lambda: patch(AsyncOpenAI()))
+    backoff = RequestBackoff()
+    slots = asyncio.Semaphore(concurrency)
+    chunks = iter(chunks)
+    written = 0
+
+    async def generate(chunk: TextChunk):
+        nonlocal written
+        try:
+            questionAnswer, chunkData = await generate_question_answer_pair(
+                client, chunk, backoff
             )
-        )
-    return output
+            item = EvaluationDataItem(
+                question=questionAnswer.question,
+                answer=questionAnswer.answer,
+                chunk=chunkData.text,
+                chunk_id=chunkData.chunk_id,
+            )
+            with span("write_results", rows=1):
+                output.write(item.model_dump_json() + "\n")
+                output.flush()
+            written += 1
+            if progress is not None:
+                progress.update()
+        finally:
+            slots.release()
+
+    tasks = set()
+    error = None
+    try:
+        while error is None:
+            await slots.acquire()
+            # Stop reading chunks after the first failure
+            for finished in [task for task in tasks if task.done()]:
+                tasks.remove(finished)
+                error = error or finished.exception()
+            # Chunking blocks, so it runs in a thread to keep requests moving
+            chunk = None if error else await asyncio.to_thread(next, chunks, None)
+            if chunk is None:
+                slots.release()
+                break
+            tasks.add(asyncio.create_task(generate(chunk)))
+        # Requests already in flight are paid for, so their results are kept
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+    finally:
+        for task in tasks:
+            task.cancel()
+    error = error or next((r for r in results if isinstance(r, Exception)), None)
+    if error is not None:
+        raise error
+    return written
 
 
 @app.command(help="Generate questions for each chunk in a given file")
@@ -65,6 +166,33 @@ def synthethic_questions(
     output_path: str = typer.Option(
         help="Json file to write output to", default="output.jsonl"
     ),
+    workers: int = typer.Option(
+        default=1, help="Number of processes to chunk documents with"
+    ),
+    chunker: str = typer.Option(
+        default="unstructured",
+        help="Chunking strategy ( unstructured or window )",
+    ),
+    window_size: int = typer.Option(
+        default=1024, help="Maximum tokens per chunk with the window chunker"
+    ),
+    overlap: int = typer.Option(
+        default=0, help="Tokens shared by consecutive chunks with the window chunker"
+    ),
+    concurrency: int = typer.Option(
+        default=10, help="Maximum number of requests to the model in flight at once"
+    ),
+    resume: bool = typer.Option(
+        default=False,
+        help="Append to the output file, skipping chunks it already has questions for",
+    ),
+    profile: bool = typer.Option(
+        default=False, help="Print how long every stage of the run took"
+    ),
+    trace_path: Optional[str] = typer.Option(
+        default=None,
+        help="Write a Chrome trace of every stage to this JSON file (implies --profile)",
+    ),
 ):
     assert Path(
         output_path
@@ -72,14 +200,42 @@ def synthethic_questions(
     assert (
         Path(output_path).suffix == ".jsonl"
     ), "The output file must have a .jsonl extension."
+    assert concurrency > 0, "The concurrency must be at least 1."
+
+    done = read_generated_chunk_ids(Path(output_path)) if resume else set()
+    remaining = max_questions - len(done) if max_questions > 0 else None
+    if remaining is not None and remaining <= 0:
+        print(f"{output_path} already has {len(done)} questions")
+        return
 
     file = read_files(Path(folder_path), file_suffix=".md")
-    chunks = chunk_text(file)
-    chunks = [TextChunk(**chunk) for chunk in chunks]
-    if max_questions > 0:
-        chunks = chunks[:max_questions]
-
-    questions = run(gather_questions(chunks))
-    with open(output_path, "w") as f:
-        for question in questions:
-            f.write(question.model_dump_json() + "\n")
+    chunks = chunk_text(
+        file,
+        window_size=window_size,
+        overlap=overlap,
+        workers=workers,
+        chunker=chunker,
+    )
+
+    def pending_chunks():
+        pulled = 0
+        for chunk in chunks:
+            if chunk["chunk_id"] in done:
+                continue
+            yield TextChunk(**chunk)
+            pulled += 1
+            if pulled == remaining:
+                return
+
+    with profiling(profile, trace_path), open(
+        output_path, "a" if resume else "w"
+    ) as f, tqdm(
+        total=max_questions if max_questions > 0 else None, initial=len(done)
+    ) as progress:
+        written = asyncio.run(
+            gather_questions(
+                timed(pending_chunks(), "read_and_chunk"), f, concurrency, progress
+            )
+        )
+    print(f"Wrote {written} new questions to {output_path}")
+    print(get_llm_cache().summary())
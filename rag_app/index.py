@@ -0,0 +1,332 @@
+import json
+import math
+import time
+import typer
+import numpy as np
+from pathlib import Path
+from typing import List, Optional
+from lancedb import connect
+from rich import print
+from rich.console import Console
+from rich.table import Table
+from rag_app.models import EvaluationDataItem
+from rag_app.query import vector_query
+from rag_app.src.embeddings import embed_for_table
+from rag_app.src.filters import SCALAR_INDEXES, create_scalar_indexes
+from rag_app.src.keyword_index import keyword_index_path, load_keyword_index
+from rag_app.src.exact_search import (
+    VectorMatrix,
+    load_vector_matrix,
+    vector_matrix_path,
+)
+from rag_app.src.quantization import (
+    QUANTIZATIONS,
+    QuantizedVectors,
+    quantized_path,
+)
+
+app = typer.Typer()
+
+INDEX_TYPES = ["IVF_PQ", "IVF_HNSW_PQ", "IVF_HNSW_SQ"]
+
+
+def default_num_partitions(num_rows: int) -> int:
+    """
+    Aims for roughly sqrt(num_rows) rows per partition, which keeps both the
+    partition centroids and the partitions themselves small to scan
+    """
+    return max(1, int(math.sqrt(num_rows)))
+
+
+def default_num_sub_vectors(dimensions: int) -> int:
+    """
+    Uses one sub-vector per 16 dimensions, the largest divisor of the
+    dimensions which keeps PQ training fast
+    """
+    for num_sub_vectors in range(max(1, dimensions // 16), 0, -1):
+        if dimensions % num_sub_vectors == 0:
+            return num_sub_vectors
+    return 1
+
+
+@app.command(help="Build (or rebuild) a vector index on the chunk vectors")
+def build(
+    db_path: str = typer.Option(help="Your LanceDB path"),
+    table_name: str = typer.Option(help="Table to index"),
+    index_type: str = typer.Option(
+        default="IVF_PQ", help=f"Index type ( {', '.join(INDEX_TYPES)} )"
+    ),
+    num_partitions: Optional[int] = typer.Option(
+        default=None, help="Number of IVF partitions (defaults to sqrt(rows))"
+    ),
+    num_sub_vectors: Optional[int] = typer.Option(
+        default=None, help="Number of PQ sub-vectors (defaults to dimensions / 16)"
+    ),
+):
+    if index_type not in INDEX_TYPES:
+        raise ValueError(
+            f"Invalid index type {index_type}. Only {', '.join(INDEX_TYPES)} is supported at the moment"
+        )
+    assert Path(db_path).exists(), f"Database path {db_path} does not exist"
+
+    table = connect(db_path).open_table(table_name)
+    num_rows = table.count_rows()
+    num_partitions = num_partitions or default_num_partitions(num_rows)
+    num_sub_vectors = num_sub_vectors or default_num_sub_vectors(
+        table.schema.field("vector").type.list_size
+    )
+
+    start = time.perf_counter()
+    # Queries are always searched with L2, the metric their exact ground truth
+    # uses too. Both embedding backends normalize their vectors, so cosine
+    # would rank chunks the same way.
+    table.create_index(
+        metric="L2",
+        num_partitions=num_partitions,
+        num_sub_vectors=num_sub_vectors,
+        vector_column_name="vector",
+        replace=True,
+        index_type=index_type,
+    )
+    print(
+        f"Built a {index_type} index on {num_rows} chunks in {table_name} with "
+        f"{num_partitions} partitions and {num_sub_vectors} sub-vectors "
+        f"in {time.perf_counter() - start:.2f}s"
+    )
+
+
+@app.command(help="Build (or refresh) the keyword index used by fts evaluation")
+def keywords(
+    db_path: str = typer.Option(help="Your LanceDB path"),
+    table_name: str = typer.Option(help="Table to index"),
+):
+    assert Path(db_path).exists(), f"Database path {db_path} does not exist"
+    table = connect(db_path).open_table(table_name)
+
+    start = time.perf_counter()
+    index = load_keyword_index(db_path, table_name, table)
+    print(
+        f"Keyword index on {len(index.chunk_ids)} chunks with {len(index.terms)} "
+        f"terms saved to {keyword_index_path(db_path, table_name)} "
+        f"in {time.perf_counter() - start:.2f}s"
+    )
+
+
+@app.command(help="Build (or update) the scalar indexes that filtered search uses")
+def scalar(
+    db_path: str = typer.Option(help="Your LanceDB path"),
+    table_name: str = typer.Option(help="Table to index"),
+):
+    assert Path(db_path).exists(), f"Database path {db_path} does not exist"
+    table = connect(db_path).open_table(table_name)
+
+    start = time.perf_counter()
+    create_scalar_indexes(table)
+    print(
+        f"Indexed {', '.join(SCALAR_INDEXES)} of {table.count_rows()} chunks in "
+        f"{table_name} in {time.perf_counter() - start:.2f}s"
+    )
+
+
+@app.command(
+    help="Export the chunk vectors to a .npy file that exact evaluation memory-maps"
+)
+def export_vectors(
+    db_path: str = typer.Option(help="Your LanceDB path"),
+    table_name: str = typer.Option(help="Table to export"),
+):
+    assert Path(db_path).exists(), f"Database path {db_path} does not exist"
+    table = connect(db_path).open_table(table_name)
+
+    start = time.perf_counter()
+    matrix = VectorMatrix.from_table(table)
+    path = vector_matrix_path(db_path, table_name)
+    matrix.save(path)
+    print(
+        f"Exported {len(matrix.chunk_ids)} vectors to {path} "
+        f"in {time.perf_counter() - start:.2f}s"
+    )
+
+
+@app.command(help="Build the quantized codes that quantized search scans")
+def quantize(
+    db_path: str = typer.Option(help="Your LanceDB path"),
+    table_name: str = typer.Option(help="Table to quantize"),
+    quantization: List[str] = typer.Option(
+        default=QUANTIZATIONS,
+        help=f"Quantizations to build ( {', '.join(QUANTIZATIONS)} ) (repeatable)",
+    ),
+):
+    assert Path(db_path).exists(), f"Database path {db_path} does not exist"
+    table = connect(db_path).open_table(table_name)
+    matrix = load_vector_matrix(db_path, table_name, table)
+
+    for kind in quantization:
+        start = time.perf_counter()
+        quantized = QuantizedVectors.build(matrix, kind)
+        path = quantized_path(db_path, table_name, kind)
+        quantized.save(path)
+        print(
+            f"Quantized {len(quantized)} vectors to {kind} codes of "
+            f"{quantized.nbytes / 1e6:.1f} MB ({matrix.vectors.nbytes / 1e6:.1f} MB "
+            f"as float32) saved to {path} in {time.perf_counter() - start:.2f}s"
+        )
+
+
+@app.command(help="List the indexes on a table")
+def show(
+    db_path: str = typer.Option(help="Your LanceDB path"),
+    table_name: str = typer.Option(help="Table to inspect"),
+):
+    table = connect(db_path).open_table(table_name)
+    indices = list(table.list_indices())
+    if not indices:
+        print(f"{table_name} has no indexes, every search is an exact scan")
+        return
+
+    for index in indices:
+        stats = table.index_stats(index.name)
+        print(f"{index.name}: {index.index_type} on {', '.join(index.columns)}")
+        if stats is not None:
+            print(
+                f"  {stats.num_indexed_rows} rows indexed, "
+                f"{stats.num_unindexed_rows} rows not yet indexed"
+            )
+
+
+@app.command(help="Compare recall and latency of indexed search against exact search")
+def report(
+    db_path: str = typer.Option(help="Your LanceDB path"),
+    table_name: str = typer.Option(help="Table to query"),
+    input_file_path: str = typer.Option(
+        default="output.jsonl", help="Jsonl file of evaluation questions"
+    ),
+    k: int = typer.Option(default=10, help="Number of chunks to retrieve"),
+    nprobes: List[int] = typer.Option(
+        default=[1, 5, 10, 20, 50], help="nprobes values to try (repeatable)"
+    ),
+    refine_factor: List[int] = typer.Option(
+        default=[0, 5], help="refine_factor values to try, 0 for none (repeatable)"
+    ),
+):
+    assert Path(db_path).exists(), f"Database path {db_path} does not exist"
+    with open(input_file_path, "r") as file:
+        questions = [EvaluationDataItem(**json.loads(line)).question for line in file]
+
+    table = connect(db_path).open_table(table_name)
+    embeddings = embed_for_table(table, questions)
+
+    def run(build_query) -> tuple[List[set], np.ndarray]:
+        retrieved, latencies = [], []
+        for embedding in embeddings:
+            start = time.perf_counter()
+            rows = build_query(embedding).select(["chunk_id"]).to_list()
+            latencies.append(time.perf_counter() - start)
+            retrieved.append({row["chunk_id"] for row in rows})
+        return retrieved, np.array(latencies) * 1000
+
+    exact, exact_latencies = run(
+        lambda embedding: vector_query(table, embedding, k).bypass_vector_index()
+    )
+
+    results = Table(title=f"Recall@{k} over {len(questions)} questions")
+    results.add_column("nprobes", style="cyan")
+    results.add_column("refine_factor", style="cyan")
+    results.add_column(f"Recall@{k}", style="magenta")
+    results.add_column("P50 ms", style="green")
+    results.add_column("P95 ms", style="green")
+    results.add_row(
+        "exact",
+        "-",
+        "1.00",
+        f"{np.percentile(exact_latencies, 50):.2f}",
+        f"{np.percentile(exact_latencies, 95):.2f}",
+    )
+
+    for probes in nprobes:
+        for refine in refine_factor:
+            approximate, latencies = run(
+                lambda embedding: vector_query(table, embedding, k, probes, refine)
+            )
+            recall = np.mean(
+                [
+                    len(found & truth) / len(truth) if truth else 1.0
+                    for found, truth in zip(approximate, exact)
+                ]
+            )
+            results.add_row(
+                str(probes),
+                str(refine or "-"),
+                f"{recall:.2f}",
+                f"{np.percentile(latencies, 50):.2f}",
+                f"{np.percentile(latencies, 95):.2f}",
+            )
+
+    Console().print(results)
+
+
+@app.command(
+    help="Compare memory, throughput and recall of quantized search against exact search"
+)
+def quantization_report(
+    db_path: str = typer.Option(help="Your LanceDB path"),
+    table_name: str = typer.Option(help="Table to query"),
+    input_file_path: str = typer.Option(
+        default="output.jsonl", help="Jsonl file of evaluation questions"
+    ),
+    k: int = typer.Option(default=10, help="Number of chunks to retrieve"),
+    quantization: List[str] = typer.Option(
+        default=QUANTIZATIONS,
+        help=f"Quantizations to try ( {', '.join(QUANTIZATIONS)} ) (repeatable)",
+    ),
+    rescore_factor: List[int] = typer.Option(
+        default=[1, 4, 10], help="rescore_factor values to try (repeatable)"
+    ),
+):
+    assert Path(db_path).exists(), f"Database path {db_path} does not exist"
+    with open(input_file_path, "r") as file:
+        questions = [EvaluationDataItem(**json.loads(line)).question for line in file]
+
+    table = connect(db_path).open_table(table_name)
+    matrix = load_vector_matrix(db_path, table_name, table)
+    queries = np.array(embed_for_table(table, questions), dtype=np.float32)
+
+    start = time.perf_counter()
+    exact, _ = matrix.search(queries, k)
+    exact_qps = len(queries) / max(time.perf_counter() - start, 1e-9)
+
+    results = Table(title=f"Recall@{k} over {len(questions)} questions")
+    results.add_column("Search", style="cyan")
+    results.add_column("rescore_factor", style="cyan")
+    results.add_column("Memory MB", style="yellow")
+    results.add_column(f"Recall@{k}", style="magenta")
+    results.add_column("Queries/s", style="green")
+    results.add_row(
+        "float32",
+        "-",
+        f"{matrix.vectors.nbytes / 1e6:.1f}",
+        "1.00",
+        f"{exact_qps:.1f}",
+    )
+
+    for kind in quantization:
+        quantized = QuantizedVectors.build(matrix, kind)
+        for factor in rescore_factor:
+            start = time.perf_counter()
+            found, _ = quantized.search(queries, matrix, k, rescore_factor=factor)
+            qps = len(queries) / max(time.perf_counter() - start, 1e-9)
+            recall = np.mean(
+                [
+                    len(set(approximate) & set(truth)) / len(truth) if truth else 1.0
+                    for approximate, truth in zip(found, exact)
+                ]
+            )
+            results.add_row(
+                kind,
+                str(factor),
+                f"{quantized.nbytes / 1e6:.1f}",
+                f"{recall:.2f}",
+                f"{qps:.1f}",
+            )
+
+    Console().print(results)
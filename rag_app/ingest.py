@@ -1,46 +1,406 @@
 import typer
 from lancedb import connect
-from rag_app.models import TextChunk, Document
+from lancedb.db import DBConnection
+from rag_app.models import (
+    ChunkDuplicate,
+    TextChunk,
+    Document,
+    FileManifest,
+    get_text_chunk_model,
+)
 from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set
 from tqdm import tqdm
 from rich import print
-from rag_app.src.chunking import read_files, batch_items, chunk_text
+from rag_app.src.chunking import read_file, read_files, batch_items, chunk_documents
+from rag_app.src.manifest import build_manifest_entry, diff_manifest
+from rag_app.src.pipeline import stream_documents
+from rag_app.src.profiling import profiling, span, timed
+from rag_app.src.embeddings import (
+    EMBEDDING_PROVIDERS,
+    describe_embedding_function,
+    get_embedding_cache,
+    table_embedding_function,
+)
+from rag_app.src.filters import create_scalar_indexes
+from rag_app.src.dedup import (
+    ChunkDeduplicator,
+    duplicate_index_path,
+    load_duplicate_index,
+)
 
 app = typer.Typer()
 
 
+def format_ids(ids: Iterable[str]) -> str:
+    return ", ".join(f"'{id}'" for id in ids)
+
+
+def fetch_chunk_vectors(table, doc_ids: Iterable[str]) -> Dict[str, List[float]]:
+    doc_ids = list(doc_ids)
+    if not doc_ids:
+        return {}
+    rows = (
+        table.to_lance()
+        .to_table(
+            columns=["chunk_id", "vector"],
+            filter=f"doc_id IN ({format_ids(doc_ids)})",
+        )
+        .to_pylist()
+    )
+    return {row["chunk_id"]: row["vector"] for row in rows if row["vector"]}
+
+
+def delete_documents(
+    table, document_table, doc_ids: Iterable[str], duplicate_table=None
+):
+    doc_ids = list(doc_ids)
+    if not doc_ids:
+        return
+    table.delete(f"doc_id IN ({format_ids(doc_ids)})")
+    document_table.delete(f"id IN ({format_ids(doc_ids)})")
+    if duplicate_table is not None:
+        duplicate_table.delete(f"doc_id IN ({format_ids(doc_ids)})")
+
+
+def open_chunk_table(
+    db: DBConnection,
+    table_name: str,
+    provider: Optional[str] = None,
+    model: Optional[str] = None,
+    dimensions: Optional[int] = None,
+):
+    """
+    Creates a chunk table embedded with the given backend, or checks that an
+    existing table is embedded with it. Options left unset default to the
+    backend of the existing table, or the OpenAI one for a new table.
+    """
+    if table_name not in db.table_names():
+        schema = get_text_chunk_model(provider or "openai", model, dimensions)
+        return db.create_table(table_name, schema=schema, mode="overwrite")
+
+    table = db.open_table(table_name)
+    recorded = describe_embedding_function(table_embedding_function(table))
+    for option, requested, value in zip(
+        ["provider", "model", "dimensions"], [provider, model, dimensions], recorded
+    ):
+        if requested is not None and requested != value:
+            raise ValueError(
+                f"Table {table_name} is embedded with the embedding {option} {value}, not {requested}"
+            )
+    return table
+
+
+def open_duplicate_table(db: DBConnection, table_name: str):
+    duplicate_table_name = f"{table_name}_duplicates"
+    if duplicate_table_name not in db.table_names():
+        return db.create_table(
+            duplicate_table_name, schema=ChunkDuplicate, mode="overwrite"
+        )
+    return db.open_table(duplicate_table_name)
+
+
+def vector_bytes(table) -> int:
+    vector = table.schema.field("vector").type
+    return vector.list_size * vector.value_type.bit_width // 8
+
+
+def promote_orphans(
+    table,
+    duplicate_table,
+    deduplicator: ChunkDeduplicator,
+    removed_ids: Set[str],
+    batch_size: int = 500,
+) -> int:
+    """
+    Re-checks the duplicates of chunks which were removed from the table.
+    Those which no longer duplicate anything are added to the table in their
+    place and the rest point at their new canonical chunk. Returns the number
+    of chunks added.
+    """
+    if not removed_ids:
+        return 0
+    orphaned = f"canonical_id IN ({format_ids(removed_ids)})"
+    orphans = duplicate_table.to_lance().to_table(filter=orphaned).to_pylist()
+    if not orphans:
+        return 0
+    duplicate_table.delete(orphaned)
+
+    chunk_fields = set(TextChunk.model_fields) - {"vector"}
+    chunks = [
+        {field: value for field, value in orphan.items() if field in chunk_fields}
+        for orphan in orphans
+    ]
+    promoted = list(deduplicator.filter(chunks, duplicate_table.add))
+    for chunk_batch in batch_items(promoted, batch_size):
+        table.add(chunk_batch)
+    return len(promoted)
+
+
+def ingest_incremental(
+    db: DBConnection,
+    table_name: str,
+    path: Path,
+    file_suffix: str,
+    recursive: bool = False,
+    workers: int = 1,
+    chunker: str = "unstructured",
+    window_size: int = 1024,
+    overlap: int = 0,
+    batch_size: int = 500,
+    deduplicator: Optional[ChunkDeduplicator] = None,
+):
+    manifest_table_name = f"{table_name}_manifest"
+    if manifest_table_name not in db.table_names():
+        db.create_table(manifest_table_name, schema=FileManifest, mode="overwrite")
+
+    table = db.open_table(table_name)
+    document_table = db.open_table("document")
+    manifest_table = db.open_table(manifest_table_name)
+    manifest = {
+        row["path"]: FileManifest(**row)
+        for row in manifest_table.to_lance().to_table().to_pylist()
+    }
+
+    with span("diff_manifest"):
+        diff = diff_manifest(path, file_suffix, manifest, recursive)
+    live_ids = {entry.doc_id for entry in diff.unchanged}
+    entries = list(diff.unchanged)
+    embedded, reused = 0, 0
+    duplicate_table = None
+    removed_ids: Set[str] = set()
+    if deduplicator is not None:
+        duplicate_table = open_duplicate_table(db, table_name)
+
+    def delete_stale(doc_ids: Set[str]):
+        delete_documents(table, document_table, doc_ids, duplicate_table)
+        if deduplicator is not None:
+            removed_ids.update(deduplicator.index.remove_documents(doc_ids))
+
+    documents = (read_file(file) for file in diff.changed)
+    chunked_documents = chunk_documents(
+        documents, window_size, overlap, workers=workers, chunker=chunker
+    )
+
+    for file, (document, chunks) in tqdm(
+        timed(zip(diff.changed, chunked_documents), "read_and_chunk"),
+        total=len(diff.changed),
+    ):
+        previous = manifest.get(file.relative_to(path).as_posix())
+        stale_ids = {document.id}
+        if previous is not None:
+            stale_ids.add(previous.doc_id)
+
+        # Chunks whose text survived an edit keep their chunk_id, so their
+        # existing vectors can be carried over instead of being re-embedded
+        with span("fetch_vectors"):
+            cached_vectors = fetch_chunk_vectors(table, stale_ids)
+        with span("delete_stale"):
+            delete_stale(stale_ids - live_ids)
+        with span("write_documents", rows=1):
+            document_table.add([document])
+        kept = chunks
+        if deduplicator is not None:
+            with span("dedup", chunks=len(chunks)):
+                kept = list(deduplicator.filter(chunks, duplicate_table.add))
+
+        cached_chunks = [
+            {**chunk, "vector": cached_vectors[chunk["chunk_id"]]}
+            for chunk in kept
+            if chunk["chunk_id"] in cached_vectors
+        ]
+        new_chunks = [
+            chunk for chunk in kept if chunk["chunk_id"] not in cached_vectors
+        ]
+        for chunk_batch in batch_items(cached_chunks, batch_size):
+            with span("write_chunks", rows=len(chunk_batch), reused=True):
+                table.add(chunk_batch)
+        for chunk_batch in batch_items(new_chunks, batch_size):
+            with span("write_chunks", rows=len(chunk_batch)):
+                table.add(chunk_batch)
+
+        embedded += len(new_chunks)
+        reused += len(cached_chunks)
+        live_ids.add(document.id)
+        entries.append(build_manifest_entry(path, file, document, len(chunks)))
+
+    delete_stale({entry.doc_id for entry in diff.removed} - live_ids)
+    if deduplicator is not None:
+        embedded += promote_orphans(
+            table, duplicate_table, deduplicator, removed_ids, batch_size
+        )
+    db.create_table(
+        manifest_table_name,
+        data=[entry.model_dump() for entry in entries],
+        schema=FileManifest,
+        mode="overwrite",
+    )
+
+    skipped = sum(entry.chunk_count for entry in diff.unchanged)
+    print(
+        f"Embedded {embedded} new chunks into {table_name} "
+        f"({len(diff.changed)} changed, {len(diff.unchanged)} unchanged and {len(diff.removed)} removed files)"
+    )
+    print(f"Avoided {skipped + reused} embeddings ({reused} reused from edited files)")
+
+
+def ingest_folder(
+    db: DBConnection,
+    table_name: str,
+    path: Path,
+    file_suffix: str,
+    recursive: bool = False,
+    workers: int = 1,
+    chunker: str = "unstructured",
+    window_size: int = 1024,
+    overlap: int = 0,
+    batch_size: int = 500,
+    deduplicator: Optional[ChunkDeduplicator] = None,
+):
+    table = db.open_table(table_name)
+    document_table = db.open_table("document")
+    documents = read_files(path, file_suffix, recursive)
+    filter_chunks = None
+    if deduplicator is not None:
+        duplicate_table = open_duplicate_table(db, table_name)
+
+        def filter_chunks(chunks: Iterable[dict]) -> Iterable[dict]:
+            return deduplicator.filter(chunks, duplicate_table.add)
+
+    with tqdm(unit="chunks") as progress:
+        ttl = stream_documents(
+            documents,
+            table,
+            document_table,
+            workers=workers,
+            chunker=chunker,
+            window_size=window_size,
+            overlap=overlap,
+            chunk_batch_size=batch_size,
+            on_chunks=progress.update,
+            filter_chunks=filter_chunks,
+        )
+
+    print(f"Added {ttl} chunks to {table_name}")
+
+
 @app.command(help="Ingest data into a given lancedb")
 def from_folder(
     db_path: str = typer.Option(help="Your LanceDB path"),
     table_name: str = typer.Option(help="Table to ingest data into"),
     folder_path: str = typer.Option(help="Folder to read data from"),
     file_suffix: str = typer.Option(default=".md", help="File suffix to filter by"),
+    incremental: bool = typer.Option(
+        default=False,
+        help="Only re-ingest files that changed since the last incremental run",
+    ),
+    recursive: bool = typer.Option(
+        default=False, help="Also ingest files in nested folders"
+    ),
+    workers: int = typer.Option(
+        default=1, help="Number of processes to chunk documents with"
+    ),
+    chunker: str = typer.Option(
+        default="unstructured",
+        help="Chunking strategy ( unstructured or window )",
+    ),
+    window_size: int = typer.Option(
+        default=1024, help="Maximum tokens per chunk with the window chunker"
+    ),
+    overlap: int = typer.Option(
+        default=0, help="Tokens shared by consecutive chunks with the window chunker"
+    ),
+    batch_size: int = typer.Option(
+        default=500, help="Number of chunks to embed and write at a time"
+    ),
+    dedup: bool = typer.Option(
+        default=False,
+        help="Only embed one chunk out of every set of exact or near duplicate chunks",
+    ),
+    dedup_threshold: float = typer.Option(
+        default=0.85,
+        help="Estimated Jaccard similarity of word shingles above which chunks are near duplicates",
+    ),
+    embedding_provider: Optional[str] = typer.Option(
+        default=None,
+        help=f"Embedding backend of a new table ( {' or '.join(EMBEDDING_PROVIDERS)} ), openai by default",
+    ),
+    embedding_model: Optional[str] = typer.Option(
+        default=None, help="Embedding model of a new table"
+    ),
+    embedding_dimensions: Optional[int] = typer.Option(
+        default=None, help="Embedding dimensions of a new table"
+    ),
+    profile: bool = typer.Option(
+        default=False, help="Print how long every stage of the run took"
+    ),
+    trace_path: Optional[str] = typer.Option(
+        default=None,
+        help="Write a Chrome trace of every stage to this JSON file (implies --profile)",
+    ),
 ):
+    if embedding_provider is not None and embedding_provider not in EMBEDDING_PROVIDERS:
+        raise ValueError(
+            f"Invalid embedding provider {embedding_provider}. Only {', '.join(EMBEDDING_PROVIDERS)} is supported at the moment"
+        )
     db = connect(db_path)
-
-    if table_name not in db.table_names():
-        db.create_table(table_name, schema=TextChunk, mode="overwrite")
+    open_chunk_table(
+        db, table_name, embedding_provider, embedding_model, embedding_dimensions
+    )
 
     if "document" not in db.table_names():
         db.create_table("document", schema=Document, mode="overwrite")
 
-    table = db.open_table(table_name)
-    document_table = db.open_table("document")
     path = Path(folder_path)
 
     if not path.exists():
         raise ValueError(f"Ingestion folder of {folder_path} does not exist")
 
-    files = read_files(path, file_suffix)
-    document_table.add(list(files))
+    with profiling(profile, trace_path):
+        deduplicator = None
+        if dedup:
+            table = db.open_table(table_name)
+            deduplicator = ChunkDeduplicator(
+                load_duplicate_index(db_path, table_name, table, dedup_threshold)
+            )
 
-    files = read_files(path, file_suffix=file_suffix)
-    chunks = chunk_text(files)
-    batched_chunks = batch_items(chunks)
+        if incremental:
+            ingest_incremental(
+                db,
+                table_name,
+                path,
+                file_suffix,
+                recursive,
+                workers,
+                chunker,
+                window_size,
+                overlap,
+                batch_size,
+                deduplicator,
+            )
+        else:
+            ingest_folder(
+                db,
+                table_name,
+                path,
+                file_suffix,
+                recursive,
+                workers,
+                chunker,
+                window_size,
+                overlap,
+                batch_size,
+                deduplicator,
+            )
 
-    ttl = 0
-    for chunk_batch in tqdm(batched_chunks):
-        table.add(chunk_batch)
-        ttl += len(chunk_batch)
+        with span("scalar_indexes"):
+            create_scalar_indexes(db.open_table(table_name))
 
-    print(f"Added {ttl} chunks to {table_name}")
+        if deduplicator is not None:
+            table = db.open_table(table_name)
+            deduplicator.index.version = table.version
+            deduplicator.index.save(duplicate_index_path(db_path, table_name))
+            print(deduplicator.summary(vector_bytes(table)))
+
+    cache = get_embedding_cache()
+    print(f"Embedding cache: {cache.hits} hits, {cache.misses} misses")
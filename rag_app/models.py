@@ -1,22 +1,63 @@
 from datetime import datetime
-from typing import List
+from functools import lru_cache
+from typing import List, Optional
 from pydantic import field_validator
-from lancedb.embeddings import get_registry
+from lancedb.embeddings import EmbeddingFunction
 from lancedb.pydantic import LanceModel, Vector
 from pydantic import BaseModel, Field
 
-openai = get_registry().get("openai").create(name="text-embedding-3-large", dim=256)
 
+@lru_cache(maxsize=None)
+def get_embedding_function(
+    provider: str = "openai",
+    model: Optional[str] = None,
+    dimensions: Optional[int] = None,
+) -> EmbeddingFunction:
+    """
+    Creates the embedding function chunks are embedded with. It pulls in the
+    OpenAI client, so it is only created the first time `TextChunk` is used.
+    """
+    from rag_app.src.embeddings import create_embedding_function
 
-class TextChunk(LanceModel):
-    chunk_id: str
-    doc_id: str
-    text: str = openai.SourceField()
-    vector: Vector(openai.ndims()) = openai.VectorField(default=None)
-    post_title: str
-    publish_date: datetime
-    chunk_number: int
-    source: str
+    return create_embedding_function(provider, model, dimensions)
+
+
+@lru_cache(maxsize=None)
+def get_text_chunk_model(
+    provider: str = "openai",
+    model: Optional[str] = None,
+    dimensions: Optional[int] = None,
+) -> type:
+    """
+    The schema of a chunk table embedded with the given backend, which LanceDB
+    records with the table
+    """
+    embeddings = get_embedding_function(provider, model, dimensions)
+
+    class TextChunk(LanceModel):
+        chunk_id: str
+        doc_id: str
+        text: str = embeddings.SourceField()
+        vector: Vector(embeddings.ndims()) = embeddings.VectorField(default=None)
+        post_title: str
+        publish_date: datetime
+        chunk_number: int
+        total_chunks: Optional[int] = None
+        source: str
+        start_pos: Optional[int] = None
+        end_pos: Optional[int] = None
+
+    # Lets instances be pickled as `rag_app.models.TextChunk`
+    TextChunk.__qualname__ = "TextChunk"
+    return TextChunk
+
+
+def __getattr__(name: str):
+    if name == "TextChunk":
+        return get_text_chunk_model()
+    if name == "openai":
+        return get_embedding_function()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 class DocumentMetadata(LanceModel):
@@ -43,6 +84,35 @@ class Document(LanceModel):
     metadata: DocumentMetadata
 
 
+class FileManifest(LanceModel):
+    path: str
+    doc_id: str
+    content_hash: str
+    mtime: int
+    size: int
+    chunk_count: int
+
+
+class ChunkDuplicate(LanceModel):
+    """
+    A chunk which was not embedded because it duplicates the chunk
+    `canonical_id` already in the table, with their estimated `similarity`
+    """
+
+    chunk_id: str
+    doc_id: str
+    canonical_id: str
+    similarity: float
+    text: str
+    post_title: str
+    publish_date: datetime
+    chunk_number: int
+    total_chunks: Optional[int] = None
+    source: str
+    start_pos: Optional[int] = None
+    end_pos: Optional[int] = None
+
+
 class QuestionAnswerPair(BaseModel):
     """
     This model represents a pair of a question generated from a text chunk, its corresponding answer,
@@ -1,63 +1,475 @@
-import openai
 from rag_app.models import TextChunk
+from rag_app.src.chunking import batch_items
+from rag_app.src.exact_search import VectorMatrix, load_vector_matrix
+from rag_app.src.quantization import (
+    QUANTIZATIONS,
+    QuantizedVectors,
+    load_quantized_vectors,
+)
+from rag_app.src.embeddings import (
+    EmbeddingBatcher,
+    embed_for_table,
+    get_query_embedder,
+)
+from rag_app.src.filters import SearchFilter, build_filter
+from rag_app.src.profiling import profiling, span
 from lancedb import connect
-from typing import List
+from asyncio import run
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
 from pathlib import Path
 from rich.console import Console
 from rich.table import Table
 from rich import box
-import duckdb
+import asyncio
+import json
+import numpy as np
+import time
 import typer
 
 app = typer.Typer()
 
 
+def get_chunk_counts(db_table, doc_ids: Iterable[str]) -> Dict[str, int]:
+    """
+    Counts the chunks of the given documents. This is only needed for tables
+    ingested before `total_chunks` was stored on every chunk.
+    """
+    doc_ids = set(doc_ids)
+    if not doc_ids:
+        return {}
+    ids = ", ".join(f"'{doc_id}'" for doc_id in doc_ids)
+    with span("count_chunks", documents=len(doc_ids)):
+        rows = (
+            db_table.to_lance()
+            .to_table(columns=["doc_id"], filter=f"doc_id IN ({ids})")
+            .column("doc_id")
+            .to_pylist()
+        )
+        return dict(Counter(rows))
+
+
+def chunk_columns(db_table) -> List[str]:
+    """
+    Every column of a chunk table but its vectors, which results don't need
+    and whose dimensions vary from table to table
+    """
+    return [name for name in db_table.schema.names if name != "vector"]
+
+
+def vector_query(
+    db_table,
+    query_vector: List[float],
+    n: int,
+    nprobes: Optional[int] = None,
+    refine_factor: Optional[int] = None,
+):
+    """
+    Builds a vector search for the `n` closest chunks. `nprobes` and
+    `refine_factor` only have an effect once the table has a vector index.
+    """
+    query = db_table.search(query_vector).limit(n)
+    if nprobes:
+        query = query.nprobes(nprobes)
+    if refine_factor:
+        query = query.refine_factor(refine_factor)
+    return query
+
+
+def filtered_search(
+    db_table,
+    query_vector: List[float],
+    n: int,
+    nprobes: Optional[int] = None,
+    refine_factor: Optional[int] = None,
+    search_filter: Optional[SearchFilter] = None,
+    columns: Optional[List[str]] = None,
+) -> List[dict]:
+    """
+    Returns the rows of the `n` closest chunks to the query vector which match
+    `search_filter`. When the filter is applied after the search, the search
+    is repeated with the filter applied first unless at least `n` of the
+    chunks it found match, so filtering never drops results.
+    """
+
+    def run_query(limit: int, prefilter: bool) -> List[dict]:
+        query = vector_query(db_table, query_vector, limit, nprobes, refine_factor)
+        if search_filter is not None:
+            query = query.where(search_filter.sql, prefilter=prefilter)
+        if columns is not None:
+            query = query.select(columns)
+        return query.to_list()
+
+    if search_filter is None or search_filter.prefilter:
+        return run_query(n, True)
+    rows = run_query(search_filter.overfetch(n), False)
+    if len(rows) >= min(n, search_filter.matches):
+        return rows[:n]
+    return run_query(n, True)
+
+
+def search_chunks(
+    db_table,
+    query_vector: List[float],
+    n: int,
+    nprobes: Optional[int] = None,
+    refine_factor: Optional[int] = None,
+    search_filter: Optional[SearchFilter] = None,
+) -> List[Tuple[TextChunk, float]]:
+    """
+    Returns the `n` closest chunks to the query vector, with their distance
+    """
+    with span("search", n=n):
+        rows = filtered_search(
+            db_table,
+            query_vector,
+            n,
+            nprobes,
+            refine_factor,
+            search_filter,
+            columns=chunk_columns(db_table),
+        )
+    with span("to_model", rows=len(rows)):
+        return [(TextChunk(**row), row["_distance"]) for row in rows]
+
+
+def search_quantized_chunks(
+    db_table,
+    quantized: QuantizedVectors,
+    matrix: VectorMatrix,
+    query_vector: List[float],
+    n: int,
+    rescore_factor: int = 10,
+) -> List[Tuple[TextChunk, float]]:
+    """
+    Returns the `n` closest chunks to the query vector by a coarse search over
+    the quantized codes with exact rescoring, with their distance
+    """
+    with span("quantized_search", n=n):
+        ids, distances = quantized.search(
+            np.array([query_vector], dtype=np.float32),
+            matrix,
+            n,
+            rescore_factor=rescore_factor,
+        )
+    if not ids[0]:
+        return []
+    columns = chunk_columns(db_table)
+    chunk_ids = ", ".join(f"'{chunk_id}'" for chunk_id in ids[0])
+    with span("fetch_rows", rows=len(ids[0])):
+        rows = (
+            db_table.to_lance()
+            .to_table(columns=columns, filter=f"chunk_id IN ({chunk_ids})")
+            .to_pylist()
+        )
+    with span("to_model", rows=len(rows)):
+        chunks = {row["chunk_id"]: TextChunk(**row) for row in rows}
+    return [
+        (chunks[chunk_id], distance)
+        for chunk_id, distance in zip(ids[0], distances[0].tolist())
+    ]
+
+
+def format_result(
+    result: TextChunk, distance: float, doc_id_to_count: Dict[str, int]
+) -> dict:
+    return {
+        "chunk_id": result.chunk_id,
+        "doc_id": result.doc_id,
+        "post_title": result.post_title,
+        "source": result.source,
+        "text": result.text,
+        "chunk_number": result.chunk_number,
+        "total_chunks": result.total_chunks or doc_id_to_count.get(result.doc_id),
+        "publish_date": result.publish_date.strftime("%Y-%m"),
+        "distance": distance,
+    }
+
+
 @app.command(help="Query LanceDB for some results")
 def db(
     db_path: str = typer.Option(help="Your LanceDB path"),
     table_name: str = typer.Option(help="Table to ingest data into"),
     query: str = typer.Option(help="Text to query against existing vector db chunks"),
     n: int = typer.Option(default=3, help="Maximum number of chunks to return"),
+    nprobes: Optional[int] = typer.Option(
+        default=None, help="Number of index partitions to search (indexed tables only)"
+    ),
+    refine_factor: Optional[int] = typer.Option(
+        default=None,
+        help="Re-rank refine_factor * n candidates exactly (indexed tables only)",
+    ),
+    quantization: Optional[str] = typer.Option(
+        default=None,
+        help=f"Search quantized codes of the vectors ( {', '.join(QUANTIZATIONS)} ) and rescore a shortlist exactly",
+    ),
+    rescore_factor: int = typer.Option(
+        default=10,
+        help="Rescore rescore_factor * n chunks exactly (with --quantization only)",
+    ),
+    where: Optional[str] = typer.Option(
+        default=None,
+        help="SQL filter on the chunk columns, e.g. \"source LIKE '%startup%'\"",
+    ),
+    after: Optional[datetime] = typer.Option(
+        default=None,
+        formats=["%Y-%m-%d"],
+        help="Only search chunks published on or after this date",
+    ),
+    before: Optional[datetime] = typer.Option(
+        default=None,
+        formats=["%Y-%m-%d"],
+        help="Only search chunks published before this date",
+    ),
+    doc_id: Optional[List[str]] = typer.Option(
+        default=None, help="Only search chunks of this document (repeatable)"
+    ),
+    profile: bool = typer.Option(
+        default=False, help="Print how long every stage of the query took"
+    ),
+    trace_path: Optional[str] = typer.Option(
+        default=None,
+        help="Write a Chrome trace of every stage to this JSON file (implies --profile)",
+    ),
 ):
     if not Path(db_path).exists():
         raise ValueError(f"Database path {db_path} does not exist.")
-    db = connect(db_path)
-    db_table = db.open_table(table_name)
+    if quantization is not None and quantization not in QUANTIZATIONS:
+        raise ValueError(
+            f"Invalid quantization {quantization}. Only {', '.join(QUANTIZATIONS)} is supported at the moment"
+        )
+    with profiling(profile, trace_path):
+        with span("open_table"):
+            db_table = connect(db_path).open_table(table_name)
+        with span("resolve_filter"):
+            search_filter = SearchFilter.resolve(
+                db_table, build_filter(where, after, before, doc_id)
+            )
 
-    client = openai.OpenAI()
-    query_vector = (
-        client.embeddings.create(
-            input=query, model="text-embedding-3-large", dimensions=256
+        with span("embed_query"):
+            query_vector = embed_for_table(db_table, [query])[0]
+        if quantization:
+            with span("load_index"):
+                matrix = load_vector_matrix(db_path, table_name, db_table)
+                quantized = load_quantized_vectors(
+                    db_path, table_name, db_table, matrix, quantization
+                )
+            if search_filter is not None:
+                with span("filter_index"):
+                    rows = search_filter.rows(db_table, matrix.chunk_ids)
+                    matrix, quantized = matrix.subset(rows), quantized.subset(rows)
+            results = search_quantized_chunks(
+                db_table, quantized, matrix, query_vector, n, rescore_factor
+            )
+        else:
+            results = search_chunks(
+                db_table, query_vector, n, nprobes, refine_factor, search_filter
+            )
+        doc_id_to_count = get_chunk_counts(
+            db_table,
+            [chunk.doc_id for chunk, _ in results if chunk.total_chunks is None],
         )
-        .data[0]
-        .embedding
-    )
 
-    results: List[TextChunk] = (
-        db_table.search(query_vector).limit(n).to_pydantic(TextChunk)
+        table = Table(title="Results", box=box.HEAVY, padding=(1, 2), show_lines=True)
+        table.add_column("Chunk Id", style="magenta")
+        table.add_column("Content", style="magenta", max_width=120)
+        table.add_column("Post Title", style="green", max_width=30)
+        table.add_column("Chunk Number", style="yellow")
+        table.add_column("Publish Date", style="blue")
+
+        for chunk, distance in results:
+            result = format_result(chunk, distance, doc_id_to_count)
+            table.add_row(
+                result["chunk_id"],
+                f"{result['post_title']}({result['source']})",
+                result["text"],
+                f"{result['chunk_number']}/{result['total_chunks']}",
+                result["publish_date"],
+            )
+        with span("render"):
+            Console().print(table)
+
+
+def read_queries(input_path: Path) -> Iterable[dict]:
+    """
+    Streams queries from a jsonl file. Each line needs a `query` (or, for
+    evaluation files, a `question`) and any other fields are passed through.
+    """
+    with open(input_path, "r") as file:
+        for line_number, line in enumerate(file, start=1):
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            query = item.get("query") or item.get("question")
+            if not query:
+                raise ValueError(f"Line {line_number} of {input_path} has no query")
+            yield {**item, "query": query}
+
+
+async def run_batch_queries(
+    items: Iterable[dict],
+    db_table,
+    batcher: EmbeddingBatcher,
+    output_file,
+    n: int = 3,
+    batch_size: int = 1000,
+    concurrency: int = 8,
+    include_text: bool = False,
+    nprobes: Optional[int] = None,
+    refine_factor: Optional[int] = None,
+    search_filter: Optional[SearchFilter] = None,
+) -> int:
+    """
+    Embeds queries `batch_size` at a time and searches each batch with
+    `concurrency` threads against the same table. The next batch is embedded
+    while the current one is being searched, and results are written as soon
+    as each batch is done.
+    """
+    loop = asyncio.get_running_loop()
+
+    async def search_and_write(batch: List[dict], embeddings: List[List[float]]):
+        results = await asyncio.gather(
+            *[
+                loop.run_in_executor(
+                    pool,
+                    search_chunks,
+                    db_table,
+                    embedding,
+                    n,
+                    nprobes,
+                    refine_factor,
+                    search_filter,
+                )
+                for embedding in embeddings
+            ]
+        )
+        # Tables ingested before chunks recorded their count leave it null
+        doc_id_to_count = get_chunk_counts(
+            db_table,
+            {
+                chunk.doc_id
+                for chunks in results
+                for chunk, _ in chunks
+                if chunk.total_chunks is None
+            },
+        )
+        with span("write_results", rows=len(batch)):
+            for item, chunks in zip(batch, results):
+                formatted = [
+                    format_result(chunk, distance, doc_id_to_count)
+                    for chunk, distance in chunks
+                ]
+                if not include_text:
+                    for result in formatted:
+                        result.pop("text")
+                output_file.write(json.dumps({**item, "results": formatted}) + "\n")
+            output_file.flush()
+
+    ttl = 0
+    previous = None
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for batch in batch_items(items, batch_size):
+            embedding = asyncio.create_task(
+                batcher.embed([item["query"] for item in batch])
+            )
+            if previous is not None:
+                await search_and_write(*previous)
+            previous = (batch, await embedding)
+            ttl += len(batch)
+
+        if previous is not None:
+            await search_and_write(*previous)
+
+    return ttl
+
+
+@app.command(help="Run every query in a jsonl file and write the results to another")
+def batch(
+    db_path: str = typer.Option(help="Your LanceDB path"),
+    table_name: str = typer.Option(help="Table to query"),
+    input_path: str = typer.Option(
+        ..., "--input", help="Jsonl file of queries, one {'query': ...} per line"
+    ),
+    output_path: str = typer.Option(
+        ..., "--output", help="Jsonl file to write results to"
+    ),
+    n: int = typer.Option(default=3, help="Maximum number of chunks per query"),
+    batch_size: int = typer.Option(
+        default=1000, help="Number of queries to embed at a time"
+    ),
+    concurrency: int = typer.Option(
+        default=8, help="Number of searches to run at the same time"
+    ),
+    include_text: bool = typer.Option(
+        default=False, help="Include the text of every chunk in the results"
+    ),
+    nprobes: Optional[int] = typer.Option(
+        default=None, help="Number of index partitions to search (indexed tables only)"
+    ),
+    refine_factor: Optional[int] = typer.Option(
+        default=None,
+        help="Re-rank refine_factor * n candidates exactly (indexed tables only)",
+    ),
+    where: Optional[str] = typer.Option(
+        default=None,
+        help="SQL filter on the chunk columns, e.g. \"source LIKE '%startup%'\"",
+    ),
+    after: Optional[datetime] = typer.Option(
+        default=None,
+        formats=["%Y-%m-%d"],
+        help="Only search chunks published on or after this date",
+    ),
+    before: Optional[datetime] = typer.Option(
+        default=None,
+        formats=["%Y-%m-%d"],
+        help="Only search chunks published before this date",
+    ),
+    doc_id: Optional[List[str]] = typer.Option(
+        default=None, help="Only search chunks of this document (repeatable)"
+    ),
+    profile: bool = typer.Option(
+        default=False, help="Print how long every stage of the run took"
+    ),
+    trace_path: Optional[str] = typer.Option(
+        default=None,
+        help="Write a Chrome trace of every stage to this JSON file (implies --profile)",
+    ),
+):
+    if not Path(db_path).exists():
+        raise ValueError(f"Database path {db_path} does not exist.")
+    assert Path(input_path).exists(), f"Input file {input_path} does not exist"
+    assert (
+        Path(output_path).suffix == ".jsonl"
+    ), "The output file must have a .jsonl extension."
+
+    db_table = connect(db_path).open_table(table_name)
+    batcher = get_query_embedder(db_table)
+    search_filter = SearchFilter.resolve(
+        db_table, build_filter(where, after, before, doc_id)
     )
 
-    sql_table = db_table.to_lance()
-    df = duckdb.query(
-        "SELECT doc_id, count(chunk_id) as count FROM sql_table GROUP BY doc_id"
-    ).to_df()
-
-    doc_id_to_count = df.set_index("doc_id")["count"].to_dict()
-
-    table = Table(title="Results", box=box.HEAVY, padding=(1, 2), show_lines=True)
-    table.add_column("Chunk Id", style="magenta")
-    table.add_column("Content", style="magenta", max_width=120)
-    table.add_column("Post Title", style="green", max_width=30)
-    table.add_column("Chunk Number", style="yellow")
-    table.add_column("Publish Date", style="blue")
-
-    for result in results:
-        chunk_number = f"{result.chunk_number}/{doc_id_to_count[result.doc_id]}"
-        table.add_row(
-            result.chunk_id,
-            f"{result.post_title}({result.source})",
-            result.text,
-            chunk_number,
-            result.publish_date.strftime("%Y-%m"),
-        )
-    Console().print(table)
+    start = time.perf_counter()
+    with profiling(profile, trace_path), open(output_path, "w") as output_file:
+        ttl = run(
+            run_batch_queries(
+                read_queries(Path(input_path)),
+                db_table,
+                batcher,
+                output_file,
+                n=n,
+                batch_size=batch_size,
+                concurrency=concurrency,
+                include_text=include_text,
+                nprobes=nprobes,
+                refine_factor=refine_factor,
+                search_filter=search_filter,
+            )
+        )
+    elapsed = time.perf_counter() - start
+
+    print(
+        f"Ran {ttl} queries in {elapsed:.2f}s ({ttl / elapsed:.1f} queries/s) "
+        f"with {batcher.requests} embedding requests"
+    )
@@ -0,0 +1,191 @@
+import asyncio
+import json
+import time
+import typer
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from threading import Lock, Thread
+from typing import Optional
+from urllib.parse import parse_qs, urlparse
+from lancedb import connect
+from rich import print
+from rag_app.query import format_result, get_chunk_counts, search_chunks
+from rag_app.src.embeddings import get_query_embedder
+
+app = typer.Typer()
+
+
+class SearchService:
+    """
+    Keeps the LanceDB table and the embedding client warm between requests.
+    Embeddings are computed on a single background event loop so that
+    concurrent requests share one client and one batcher.
+
+    The table is reopened at most once every `refresh_interval` seconds and
+    swapped in whenever a new version of it has been written.
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        table_name: str,
+        refresh_interval: float = 5.0,
+        nprobes: Optional[int] = None,
+        refine_factor: Optional[int] = None,
+    ):
+        self.db = connect(db_path)
+        self.table_name = table_name
+        self.refresh_interval = refresh_interval
+        self.nprobes = nprobes
+        self.refine_factor = refine_factor
+        self._lock = Lock()
+        self._load(self.db.open_table(table_name))
+
+        self.loop = asyncio.new_event_loop()
+        Thread(target=self.loop.run_forever, daemon=True).start()
+        self.batcher = get_query_embedder(self.table)
+
+    def _load(self, table):
+        self.table = table
+        self.checked_at = time.monotonic()
+
+    def current_table(self):
+        with self._lock:
+            if time.monotonic() - self.checked_at >= self.refresh_interval:
+                latest = self.db.open_table(self.table_name)
+                if latest.version != self.table.version:
+                    self._load(latest)
+                else:
+                    self.checked_at = time.monotonic()
+            return self.table
+
+    def embed(self, query: str):
+        future = asyncio.run_coroutine_threadsafe(
+            self.batcher.embed([query]), self.loop
+        )
+        return future.result()[0]
+
+    def search(self, query: str, n: int = 3) -> dict:
+        query_vector = self.embed(query)
+        table = self.current_table()
+        results = search_chunks(
+            table, query_vector, n, self.nprobes, self.refine_factor
+        )
+        doc_id_to_count = get_chunk_counts(
+            table, [chunk.doc_id for chunk, _ in results if chunk.total_chunks is None]
+        )
+        return {
+            "query": query,
+            "version": table.version,
+            "results": [
+                format_result(chunk, distance, doc_id_to_count)
+                for chunk, distance in results
+            ],
+        }
+
+
+class SearchRequestHandler(BaseHTTPRequestHandler):
+    """
+    Serves `GET /search?query=...&n=3`, `POST /search` with a JSON body of
+    `{"query": ..., "n": 3}` and `GET /health`
+    """
+
+    server: "SearchServer"
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/health":
+            table = self.server.service.current_table()
+            self.send_json(200, {"status": "ok", "version": table.version})
+        elif url.path == "/search":
+            params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+            self.handle_search(params)
+        else:
+            self.send_json(404, {"error": f"Unknown path {url.path}"})
+
+    def do_POST(self):
+        if urlparse(self.path).path != "/search":
+            self.send_json(404, {"error": f"Unknown path {self.path}"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            params = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self.send_json(400, {"error": "Request body must be valid JSON"})
+            return
+        self.handle_search(params)
+
+    def handle_search(self, params: dict):
+        query = params.get("query")
+        if not query:
+            self.send_json(400, {"error": "A non-empty query is required"})
+            return
+        try:
+            n = int(params.get("n", self.server.default_n))
+        except ValueError:
+            self.send_json(400, {"error": "n must be an integer"})
+            return
+
+        try:
+            self.send_json(200, self.server.service.search(query, n))
+        except Exception as e:
+            self.send_json(500, {"error": str(e)})
+
+    def send_json(self, status: int, payload: dict):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class SearchServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self, address, service: SearchService, default_n: int = 3, verbose: bool = False
+    ):
+        super().__init__(address, SearchRequestHandler)
+        self.service = service
+        self.default_n = default_n
+        self.verbose = verbose
+
+
+@app.callback(invoke_without_command=True)
+def serve(
+    db_path: str = typer.Option(help="Your LanceDB path"),
+    table_name: str = typer.Option(help="Table to query"),
+    host: str = typer.Option(default="127.0.0.1", help="Host to listen on"),
+    port: int = typer.Option(default=8000, help="Port to listen on"),
+    n: int = typer.Option(default=3, help="Default number of chunks to return"),
+    refresh_interval: float = typer.Option(
+        default=5.0, help="Seconds between checks for a new table version"
+    ),
+    verbose: bool = typer.Option(default=False, help="Log every request"),
+    nprobes: Optional[int] = typer.Option(
+        default=None, help="Number of index partitions to search (indexed tables only)"
+    ),
+    refine_factor: Optional[int] = typer.Option(
+        default=None,
+        help="Re-rank refine_factor * n candidates exactly (indexed tables only)",
+    ),
+):
+    if not Path(db_path).exists():
+        raise ValueError(f"Database path {db_path} does not exist.")
+
+    service = SearchService(
+        db_path, table_name, refresh_interval, nprobes, refine_factor
+    )
+    server = SearchServer((host, port), service, default_n=n, verbose=verbose)
+    print(f"Serving {table_name} on http://{host}:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
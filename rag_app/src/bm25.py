@@ -0,0 +1,110 @@
+from typing import Iterable, List, Tuple
+import numpy as np
+from scipy import sparse
+from rag_app.src.keyword_index import tokenize
+
+# Mirrors the defaults of LanceDB's full text search index
+MAX_TOKEN_LENGTH = 40
+
+
+def bm25_tokenize(text: str) -> List[str]:
+    return [token for token in tokenize(text) if len(token) <= MAX_TOKEN_LENGTH]
+
+
+class BM25Index:
+    """
+    An in-memory BM25 scorer over the chunks of a table.
+
+    The chunks are tokenized once into a sparse term x chunk matrix holding
+    the BM25 weight of every term in every chunk, so a batch of questions is
+    scored with a single sparse matrix product.
+    """
+
+    def __init__(
+        self, chunk_ids: List[str], vocabulary: dict, weights: sparse.csr_matrix
+    ):
+        self.chunk_ids = chunk_ids
+        self.vocabulary = vocabulary
+        self.weights = weights
+
+    @classmethod
+    def build(
+        cls, chunks: Iterable[Tuple[str, str]], k1: float = 1.2, b: float = 0.75
+    ) -> "BM25Index":
+        chunk_ids, rows, cols = [], [], []
+        vocabulary = {}
+        for idx, (chunk_id, text) in enumerate(chunks):
+            chunk_ids.append(chunk_id)
+            for token in bm25_tokenize(text):
+                rows.append(vocabulary.setdefault(token, len(vocabulary)))
+                cols.append(idx)
+
+        # Duplicate (term, chunk) entries are summed into term frequencies
+        tf = sparse.csr_matrix(
+            (np.ones(len(rows), dtype=np.float32), (rows, cols)),
+            shape=(len(vocabulary), len(chunk_ids)),
+        )
+        tf.sum_duplicates()
+
+        lengths = np.asarray(tf.sum(axis=0)).ravel()
+        avg_length = lengths.mean() if len(lengths) else 0.0
+        num_chunks = len(chunk_ids)
+        doc_freq = np.diff(tf.indptr)
+        idf = np.log(1 + (num_chunks - doc_freq + 0.5) / (doc_freq + 0.5))
+
+        norm = k1 * (1 - b + b * lengths / max(avg_length, 1e-9))
+        term_idx = np.repeat(np.arange(len(vocabulary)), doc_freq)
+        tf.data = (
+            idf[term_idx] * tf.data * (k1 + 1) / (tf.data + norm[tf.indices])
+        ).astype(np.float32)
+        return cls(chunk_ids, vocabulary, tf)
+
+    def subset(self, rows: np.ndarray) -> "BM25Index":
+        """
+        Only scores the chunks at `rows`. Weights keep the term statistics of
+        every chunk, like a filtered LanceDB full text search.
+        """
+        return BM25Index(
+            [self.chunk_ids[row] for row in rows],
+            self.vocabulary,
+            self.weights[:, rows].tocsr(),
+        )
+
+    def encode(self, questions: List[str]) -> sparse.csr_matrix:
+        rows, cols = [], []
+        for idx, question in enumerate(questions):
+            for token in bm25_tokenize(question):
+                term = self.vocabulary.get(token)
+                if term is not None:
+                    rows.append(idx)
+                    cols.append(term)
+        encoded = sparse.csr_matrix(
+            (np.ones(len(rows), dtype=np.float32), (rows, cols)),
+            shape=(len(questions), len(self.vocabulary)),
+        )
+        # A term repeated in a question only counts once, as in LanceDB
+        encoded.sum_duplicates()
+        encoded.data[:] = 1
+        return encoded
+
+    def search(
+        self, questions: List[str], k: int = 25, batch_size: int = 1024
+    ) -> List[List[Tuple[str, float]]]:
+        """
+        Returns the `k` highest scoring chunk ids and scores for every question.
+        Chunks which share no terms with a question are never returned.
+        """
+        results = []
+        for start in range(0, len(questions), batch_size):
+            scores = self.encode(questions[start : start + batch_size]) @ self.weights
+            for row in range(scores.shape[0]):
+                begin, end = scores.indptr[row], scores.indptr[row + 1]
+                data, indices = scores.data[begin:end], scores.indices[begin:end]
+                if len(data) > k:
+                    top = np.argpartition(-data, k)[:k]
+                    data, indices = data[top], indices[top]
+                order = np.argsort(-data, kind="stable")
+                results.append(
+                    [(self.chunk_ids[indices[i]], float(data[i])) for i in order]
+                )
+        return results
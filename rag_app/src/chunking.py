@@ -1,30 +1,51 @@
 import frontmatter
 import hashlib
+import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
-from unstructured.partition.text import partition_text
 from rag_app.models import Document
-from typing import Iterable
+from rag_app.src.tokens import count_tokens
+from typing import Callable, Iterable, Optional
 from pathlib import Path
-from typing import List, TypeVar, Iterable
+from typing import List, Tuple, TypeVar, Iterable
 
 T = TypeVar("T")
+Span = Tuple[int, int]
+
+CHUNKERS = ["unstructured", "window"]
+PARAGRAPH_BOUNDARY = re.compile(r"\n\s*\n")
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+")
+WORD_BOUNDARY = re.compile(r"\s+")
 
 
 def generate_string_hash(s: str):
     return hashlib.md5(s.encode("utf-8")).hexdigest()
 
 
-def read_files(path: Path, file_suffix: str) -> Iterable[Document]:
-    for file in path.iterdir():
-        if file.suffix != file_suffix:
+def read_file(file: Path) -> Document:
+    post = frontmatter.load(file)
+    return Document(
+        id=generate_string_hash(post.content),
+        content=post.content,
+        filename=file.name,
+        metadata=post.metadata,
+    )
+
+
+def list_files(path: Path, file_suffix: str, recursive: bool = False) -> Iterable[Path]:
+    files = sorted(path.rglob("*")) if recursive else path.iterdir()
+    for file in files:
+        if file.suffix != file_suffix or not file.is_file():
             continue
-        post = frontmatter.load(file)
-        yield Document(
-            id=generate_string_hash(post.content),
-            content=post.content,
-            filename=file.name,
-            metadata=post.metadata,
-        )
+        yield file
+
+
+def read_files(
+    path: Path, file_suffix: str, recursive: bool = False
+) -> Iterable[Document]:
+    for file in list_files(path, file_suffix, recursive):
+        yield read_file(file)
 
 
 def batch_items(items: Iterable[T], batch_size: int = 20) -> Iterable[List[T]]:
@@ -39,17 +60,207 @@ def batch_items(items: Iterable[T], batch_size: int = 20) -> Iterable[List[T]]:
         yield batch
 
 
+def split_spans(text: str, pattern: re.Pattern, start: int, end: int) -> List[Span]:
+    """
+    Splits text[start:end] on `pattern`, returning the offsets of every
+    non-empty piece with surrounding whitespace trimmed.
+    """
+    spans = []
+    cursor = start
+    for match in pattern.finditer(text, start, end):
+        spans.append((cursor, match.start()))
+        cursor = match.end()
+    spans.append((cursor, end))
+
+    trimmed = []
+    for span_start, span_end in spans:
+        piece = text[span_start:span_end]
+        stripped = piece.strip()
+        if not stripped:
+            continue
+        offset = span_start + piece.index(stripped)
+        trimmed.append((offset, offset + len(stripped)))
+    return trimmed
+
+
+def sentence_spans(text: str) -> List[Tuple[Span, bool]]:
+    """
+    Returns the offsets of every sentence in the text, flagging the ones which
+    start a new paragraph.
+    """
+    spans = []
+    for paragraph_start, paragraph_end in split_spans(
+        text, PARAGRAPH_BOUNDARY, 0, len(text)
+    ):
+        sentences = split_spans(text, SENTENCE_BOUNDARY, paragraph_start, paragraph_end)
+        spans.extend((span, i == 0) for i, span in enumerate(sentences))
+    return spans
+
+
+def window_spans(
+    text: str,
+    window_size: int,
+    overlap: int = 0,
+    tokenizer: Optional[Callable[[List[str]], List[int]]] = None,
+) -> List[Span]:
+    """
+    Packs whole sentences into windows of at most `window_size` tokens. Each
+    window repeats the trailing sentences of the previous one, up to `overlap`
+    tokens. Windows prefer to end on a paragraph boundary once they are at
+    least half full, and sentences longer than the window are split on words.
+    """
+    if overlap < 0 or overlap >= window_size:
+        raise ValueError(
+            f"Overlap must be between 0 and window_size ({window_size}), got {overlap}"
+        )
+    tokenizer = tokenizer or count_tokens
+
+    units: List[Tuple[Span, bool]] = []
+    sentences = sentence_spans(text)
+    sizes = tokenizer([text[start:end] for (start, end), _ in sentences])
+    unit_sizes = []
+    for (span, is_paragraph_start), size in zip(sentences, sizes):
+        if size <= window_size:
+            units.append((span, is_paragraph_start))
+            unit_sizes.append(size)
+            continue
+        words = split_spans(text, WORD_BOUNDARY, *span)
+        word_sizes = tokenizer([text[start:end] for start, end in words])
+        for i, (word, word_size) in enumerate(zip(words, word_sizes)):
+            units.append((word, is_paragraph_start and i == 0))
+            unit_sizes.append(word_size)
+
+    windows = []
+    start, covered = 0, 0
+    while start < len(units):
+        end, total = start, 0
+        while end < len(units) and (
+            end == start or total + unit_sizes[end] <= window_size
+        ):
+            total += unit_sizes[end]
+            end += 1
+
+        # Back off to the last paragraph boundary if that keeps the window half
+        # full and still moves past the end of the previous window
+        if end < len(units) and not units[end][1]:
+            for boundary in range(end - 1, max(start, covered), -1):
+                if units[boundary][1]:
+                    if sum(unit_sizes[start:boundary]) >= window_size // 2:
+                        end = boundary
+                    break
+
+        windows.append((units[start][0][0], units[end - 1][0][1]))
+        if end == len(units):
+            break
+        covered = end
+
+        next_start, carried = end, 0
+        while (
+            next_start - 1 > start
+            and carried + unit_sizes[next_start - 1] <= overlap
+            and carried + unit_sizes[next_start - 1] + unit_sizes[end] <= window_size
+        ):
+            carried += unit_sizes[next_start - 1]
+            next_start -= 1
+        start = next_start
+
+    return windows
+
+
+def partition_spans(text: str) -> List[Tuple[str, Optional[int], Optional[int]]]:
+    """
+    Chunks text with `unstructured`, recovering the offsets of every element
+    that can still be found verbatim in the original text
+    """
+    # unstructured takes seconds to import, so only the chunker using it pays
+    from unstructured.partition.text import partition_text
+
+    chunks = []
+    cursor = 0
+    for element in partition_text(text=text):
+        start = text.find(element.text, cursor)
+        if start == -1:
+            chunks.append((element.text, None, None))
+            continue
+        cursor = start + len(element.text)
+        chunks.append((element.text, start, cursor))
+    return chunks
+
+
+def chunk_document(
+    doc: Document,
+    window_size: int = 1024,
+    overlap: int = 0,
+    chunker: str = "unstructured",
+) -> List[dict]:
+    if chunker == "window":
+        chunks = [
+            (doc.content[start:end], start, end)
+            for start, end in window_spans(doc.content, window_size, overlap)
+        ]
+    elif chunker == "unstructured":
+        chunks = partition_spans(doc.content)
+    else:
+        raise ValueError(
+            f"Invalid chunker {chunker}. Only {' or '.join(CHUNKERS)} is supported at the moment"
+        )
+
+    return [
+        {
+            "chunk_id": generate_string_hash(text),
+            "chunk_number": chunk_num + 1,
+            "total_chunks": len(chunks),
+            "doc_id": doc.id,
+            "text": text,
+            "post_title": doc.metadata.title,
+            "publish_date": datetime.strptime(doc.metadata.date, "%Y-%m"),
+            "source": doc.metadata.url,
+            "start_pos": start,
+            "end_pos": end,
+        }
+        for chunk_num, (text, start, end) in enumerate(chunks)
+    ]
+
+
+def chunk_documents(
+    documents: Iterable[Document],
+    window_size: int = 1024,
+    overlap: int = 0,
+    workers: int = 1,
+    chunker: str = "unstructured",
+) -> Iterable[Tuple[Document, List[dict]]]:
+    """
+    Yields each document alongside its chunks, in the order the documents were
+    given. With `workers > 1` documents are chunked in a process pool. At most
+    `2 * workers` documents are in flight at once and results are yielded as
+    soon as the next document in order is done.
+    """
+    if workers <= 1:
+        for doc in documents:
+            yield doc, chunk_document(doc, window_size, overlap, chunker)
+        return
+
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for doc in documents:
+            pending.append(
+                (doc, pool.submit(chunk_document, doc, window_size, overlap, chunker))
+            )
+            if len(pending) >= 2 * workers:
+                doc, future = pending.popleft()
+                yield doc, future.result()
+
+        while pending:
+            doc, future = pending.popleft()
+            yield doc, future.result()
+
+
 def chunk_text(
-    documents: Iterable[Document], window_size: int = 1024, overlap: int = 0
-):
-    for doc in documents:
-        for chunk_num, chunk in enumerate(partition_text(text=doc.content)):
-            yield {
-                "chunk_id": generate_string_hash(chunk.text),
-                "chunk_number": chunk_num + 1,
-                "doc_id": doc.id,
-                "text": chunk.text,
-                "post_title": doc.metadata.title,
-                "publish_date": datetime.strptime(doc.metadata.date, "%Y-%m"),
-                "source": doc.metadata.url,
-            }
+    documents: Iterable[Document],
+    window_size: int = 1024,
+    overlap: int = 0,
+    workers: int = 1,
+    chunker: str = "unstructured",
+) -> Iterable[dict]:
+    for _, chunks in chunk_documents(documents, window_size, overlap, workers, chunker):
+        yield from chunks
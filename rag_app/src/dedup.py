@@ -0,0 +1,318 @@
+import zlib
+from collections import defaultdict
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+import numpy as np
+from rag_app.src.chunking import batch_items
+from rag_app.src.keyword_index import tokenize
+
+MAX_HASH = np.uint32(np.iinfo(np.uint32).max)
+SHINGLE_PRIME = np.uint64(1000003)
+HASH_MASK = np.uint64(0xFFFFFFFF)
+DEFAULT_NUM_PERM = 128
+
+
+class MinHasher:
+    """
+    Computes MinHash signatures of texts over their `shingle_size` word
+    shingles. The fraction of equal values in two signatures estimates the
+    Jaccard similarity of the texts' shingle sets. Signatures only depend on
+    `num_perm` and `seed`, so they can be persisted and compared across runs.
+
+    Each permutation is a multiply-shift hash `(a * x + b) >> 32` computed
+    with wrapping uint64 arithmetic, which needs no modulo.
+    """
+
+    def __init__(
+        self,
+        num_perm: int = DEFAULT_NUM_PERM,
+        shingle_size: int = 5,
+        seed: int = 1,
+        block_size: int = 16384,
+    ):
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.block_size = block_size
+        rng = np.random.default_rng(seed)
+        info = np.iinfo(np.uint64)
+        self.a = rng.integers(1, info.max, num_perm, dtype=np.uint64, endpoint=True)
+        self.a |= np.uint64(1)
+        self.b = rng.integers(0, info.max, num_perm, dtype=np.uint64, endpoint=True)
+
+    def shingles(self, text: str) -> np.ndarray:
+        tokens = np.array(
+            [zlib.crc32(token.encode("utf-8")) for token in tokenize(text)],
+            dtype=np.uint64,
+        )
+        if len(tokens) == 0:
+            return tokens
+        # Texts shorter than a shingle are a single shingle of every token
+        size = min(self.shingle_size, len(tokens))
+        count = len(tokens) - size + 1
+        hashes = np.zeros(count, dtype=np.uint64)
+        for offset in range(size):
+            hashes = (hashes * SHINGLE_PRIME + tokens[offset : offset + count]) & (
+                HASH_MASK
+            )
+        return hashes
+
+    def signatures(self, texts: List[str]) -> np.ndarray:
+        """
+        Returns a `len(texts)` x `num_perm` matrix of signatures. Texts without
+        a single token get a signature of `MAX_HASH` which matches nothing.
+        """
+        signatures = np.full((len(texts), self.num_perm), MAX_HASH, dtype=np.uint32)
+        block, rows, size = [], [], 0
+        for row, text in enumerate(texts):
+            shingles = self.shingles(text)
+            if len(shingles):
+                block.append(shingles)
+                rows.append(row)
+                size += len(shingles)
+            if size >= self.block_size or (row == len(texts) - 1 and block):
+                signatures[rows] = self._min_hashes(block)
+                block, rows, size = [], [], 0
+        return signatures
+
+    def signature(self, text: str) -> np.ndarray:
+        return self.signatures([text])[0]
+
+    def _min_hashes(self, block: List[np.ndarray]) -> np.ndarray:
+        shingles = np.concatenate(block)
+        starts = np.cumsum([0] + [len(shingles) for shingles in block[:-1]])
+        with np.errstate(over="ignore"):
+            hashes = np.multiply(self.a[:, None], shingles[None, :])
+            hashes += self.b[:, None]
+        hashes >>= np.uint64(32)
+        return np.minimum.reduceat(hashes, starts, axis=1).T.astype(np.uint32)
+
+
+def lsh_rows_per_band(num_perm: int, threshold: float, recall: float = 0.99) -> int:
+    """
+    Returns the largest number of rows per band for which two texts with a
+    similarity of `threshold` still share a band with probability `recall`.
+    More rows per band means fewer dissimilar candidates to compare.
+    """
+    best = 1
+    for rows in range(1, num_perm + 1):
+        if num_perm % rows:
+            continue
+        bands = num_perm // rows
+        if 1 - (1 - threshold**rows) ** bands >= recall:
+            best = rows
+    return best
+
+
+class DuplicateIndex:
+    """
+    The MinHash signatures of every chunk kept in a table, bucketed into LSH
+    bands so a new chunk is only compared with chunks that share a band.
+
+    A chunk is an exact duplicate of a kept chunk with the same `chunk_id`
+    (the hash of its text) and a near duplicate of the most similar kept
+    chunk whose estimated Jaccard similarity is at least `threshold`.
+    """
+
+    def __init__(
+        self,
+        chunk_ids: List[str],
+        doc_ids: List[str],
+        signatures: np.ndarray,
+        threshold: float = 0.85,
+        version: Optional[int] = None,
+    ):
+        self.chunk_ids = list(chunk_ids)
+        self.doc_ids = list(doc_ids)
+        self.signatures = [signature for signature in signatures]
+        self.threshold = threshold
+        self.version = version
+        num_perm = signatures.shape[1] if signatures.ndim == 2 else DEFAULT_NUM_PERM
+        self.rows_per_band = lsh_rows_per_band(num_perm, threshold)
+        self.alive: List[bool] = []
+        self.exact: Dict[str, Set[int]] = defaultdict(set)
+        self.rows_by_doc: Dict[str, List[int]] = defaultdict(list)
+        self.buckets: List[Dict[bytes, List[int]]] = [
+            defaultdict(list) for _ in range(num_perm // self.rows_per_band)
+        ]
+        for row in range(len(self.chunk_ids)):
+            self._insert(row)
+
+    def __len__(self) -> int:
+        return sum(self.alive)
+
+    def _bands(self, signature: np.ndarray) -> Iterable[Tuple[int, bytes]]:
+        for band in range(len(self.buckets)):
+            start = band * self.rows_per_band
+            yield band, signature[start : start + self.rows_per_band].tobytes()
+
+    def _insert(self, row: int):
+        self.alive.append(True)
+        self.exact[self.chunk_ids[row]].add(row)
+        self.rows_by_doc[self.doc_ids[row]].append(row)
+        signature = self.signatures[row]
+        if signature[0] == MAX_HASH and (signature == MAX_HASH).all():
+            return
+        for band, key in self._bands(signature):
+            self.buckets[band][key].append(row)
+
+    def add(self, chunk_id: str, doc_id: str, signature: np.ndarray):
+        self.chunk_ids.append(chunk_id)
+        self.doc_ids.append(doc_id)
+        self.signatures.append(signature)
+        self._insert(len(self.chunk_ids) - 1)
+
+    def match(
+        self, chunk_id: str, signature: np.ndarray
+    ) -> Optional[Tuple[str, float]]:
+        """
+        Returns the id of the kept chunk a chunk duplicates and their estimated
+        similarity, or None when the chunk should be kept
+        """
+        if any(self.alive[row] for row in self.exact.get(chunk_id, ())):
+            return chunk_id, 1.0
+        if signature[0] == MAX_HASH and (signature == MAX_HASH).all():
+            return None
+
+        candidates = {
+            row
+            for band, key in self._bands(signature)
+            for row in self.buckets[band].get(key, ())
+            if self.alive[row]
+        }
+        if not candidates:
+            return None
+        rows = np.fromiter(candidates, dtype=np.int64, count=len(candidates))
+        similarities = (
+            np.stack([self.signatures[row] for row in rows]) == signature
+        ).mean(axis=1)
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.threshold:
+            return None
+        return self.chunk_ids[rows[best]], float(similarities[best])
+
+    def remove_documents(self, doc_ids: Iterable[str]) -> Set[str]:
+        """
+        Forgets every chunk of the given documents and returns their chunk ids
+        """
+        removed = set()
+        for doc_id in set(doc_ids):
+            for row in self.rows_by_doc.pop(doc_id, ()):
+                if self.alive[row]:
+                    self.alive[row] = False
+                    removed.add(self.chunk_ids[row])
+        return removed
+
+    def save(self, path: Path):
+        rows = [row for row, alive in enumerate(self.alive) if alive]
+        num_perm = len(self.buckets) * self.rows_per_band
+        np.savez(
+            path,
+            chunk_ids=np.array([self.chunk_ids[row] for row in rows], dtype=str),
+            doc_ids=np.array([self.doc_ids[row] for row in rows], dtype=str),
+            signatures=np.array(
+                [self.signatures[row] for row in rows], dtype=np.uint32
+            ).reshape(len(rows), num_perm),
+            version=np.array(-1 if self.version is None else self.version),
+        )
+
+    @classmethod
+    def load(cls, path: Path, threshold: float = 0.85) -> "DuplicateIndex":
+        with np.load(path) as data:
+            version = int(data["version"])
+            return cls(
+                data["chunk_ids"].tolist(),
+                data["doc_ids"].tolist(),
+                data["signatures"],
+                threshold,
+                None if version == -1 else version,
+            )
+
+
+class ChunkDeduplicator:
+    """
+    Filters a stream of chunks down to the ones which don't duplicate a chunk
+    already in the index, adding every kept chunk to the index as it goes.
+    Duplicates are handed to `on_duplicates` a batch at a time, each with the
+    `canonical_id` of the chunk it duplicates and their `similarity`.
+    """
+
+    def __init__(
+        self,
+        index: DuplicateIndex,
+        hasher: Optional[MinHasher] = None,
+        batch_size: int = 500,
+    ):
+        self.index = index
+        self.hasher = MinHasher() if hasher is None else hasher
+        self.batch_size = batch_size
+        self.kept = 0
+        self.exact = 0
+        self.near = 0
+
+    @property
+    def duplicates(self) -> int:
+        return self.exact + self.near
+
+    def filter(
+        self,
+        chunks: Iterable[dict],
+        on_duplicates: Callable[[List[dict]], None],
+    ) -> Iterable[dict]:
+        for batch in batch_items(chunks, self.batch_size):
+            signatures = self.hasher.signatures([chunk["text"] for chunk in batch])
+            duplicates = []
+            for chunk, signature in zip(batch, signatures):
+                match = self.index.match(chunk["chunk_id"], signature)
+                if match is None:
+                    self.index.add(chunk["chunk_id"], chunk["doc_id"], signature)
+                    self.kept += 1
+                    yield chunk
+                    continue
+
+                canonical_id, similarity = match
+                if canonical_id == chunk["chunk_id"]:
+                    self.exact += 1
+                else:
+                    self.near += 1
+                duplicates.append(
+                    {**chunk, "canonical_id": canonical_id, "similarity": similarity}
+                )
+            if duplicates:
+                on_duplicates(duplicates)
+
+    def summary(self, vector_bytes: int) -> str:
+        saved = self.duplicates * vector_bytes
+        return (
+            f"Skipped {self.duplicates} duplicate chunks ({self.exact} exact, "
+            f"{self.near} near duplicates), saving {self.duplicates} embeddings "
+            f"and {saved / 1e6:.1f} MB of vectors"
+        )
+
+
+def duplicate_index_path(db_path: str, table_name: str) -> Path:
+    return Path(db_path) / f"{table_name}.minhash.npz"
+
+
+def load_duplicate_index(
+    db_path: str, table_name: str, table, threshold: float = 0.85
+) -> DuplicateIndex:
+    """
+    Loads the persisted duplicate index of a table, rebuilding it from the
+    chunks in the table whenever the table has changed since it was saved
+    """
+    path = duplicate_index_path(db_path, table_name)
+    if path.exists():
+        index = DuplicateIndex.load(path, threshold)
+        if index.version == table.version:
+            return index
+
+    hasher = MinHasher()
+    rows = table.to_lance().to_table(columns=["chunk_id", "doc_id", "text"])
+    texts = rows["text"].to_pylist()
+    return DuplicateIndex(
+        rows["chunk_id"].to_pylist(),
+        rows["doc_id"].to_pylist(),
+        hasher.signatures(texts),
+        threshold,
+        table.version,
+    )
@@ -0,0 +1,195 @@
+import hashlib
+import os
+import sqlite3
+import time
+from functools import lru_cache
+from pathlib import Path
+from threading import Lock
+from typing import List, Optional, Sequence
+import numpy as np
+
+DEFAULT_CACHE_PATH = Path.home() / ".cache" / "rag-app" / "embeddings.sqlite"
+DEFAULT_CACHE_SIZE = 1_000_000
+
+
+class EmbeddingCache:
+    """
+    An on-disk cache of embeddings keyed by (model, dimensions, text hash).
+
+    Once the cache holds more than `max_entries` embeddings, the least recently
+    used ones are evicted. A `max_entries` of 0 disables the cache entirely.
+    Entries are counted once when the cache is opened and kept track of from
+    then on, so embeddings added by other processes in the meantime are only
+    counted the next time it is opened.
+    """
+
+    def __init__(
+        self, path: Path = DEFAULT_CACHE_PATH, max_entries: int = DEFAULT_CACHE_SIZE
+    ):
+        self.path = Path(path)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._count = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            # Ingest embeds from a background writer thread, so the connection
+            # is shared across threads and guarded by our own lock instead
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            # Evaluation shards and ingest write from several processes at once.
+            # WAL lets readers carry on while one of them writes, and writers
+            # wait for each other instead of failing with `database is locked`.
+            self._conn.executescript("""
+                PRAGMA busy_timeout = 30000;
+                PRAGMA journal_mode = WAL;
+                CREATE TABLE IF NOT EXISTS embeddings (
+                    model TEXT NOT NULL,
+                    dimensions INTEGER NOT NULL,
+                    text_hash TEXT NOT NULL,
+                    vector BLOB NOT NULL,
+                    last_used INTEGER NOT NULL,
+                    PRIMARY KEY (model, dimensions, text_hash)
+                );
+                CREATE INDEX IF NOT EXISTS embeddings_last_used
+                    ON embeddings (last_used);
+                """)
+            self._count = self._conn.execute(
+                "SELECT count(*) FROM embeddings"
+            ).fetchone()[0]
+        return self._conn
+
+    @staticmethod
+    def text_hash(text: str) -> str:
+        return hashlib.md5(text.encode("utf-8")).hexdigest()
+
+    def get_many(
+        self, model: str, dimensions: Optional[int], texts: Sequence[str]
+    ) -> List[Optional[List[float]]]:
+        if not self.enabled or not texts:
+            self.misses += len(texts)
+            return [None] * len(texts)
+
+        hashes = [self.text_hash(text) for text in texts]
+        with self._lock:
+            found = {}
+            for i in range(0, len(hashes), 500):
+                window = list(set(hashes[i : i + 500]))
+                rows = self.conn.execute(
+                    f"""
+                    SELECT text_hash, vector FROM embeddings
+                    WHERE model = ? AND dimensions = ?
+                    AND text_hash IN ({", ".join("?" * len(window))})
+                    """,
+                    [model, dimensions or 0, *window],
+                ).fetchall()
+                found.update(rows)
+
+            if found:
+                self.conn.executemany(
+                    """
+                    UPDATE embeddings SET last_used = ?
+                    WHERE model = ? AND dimensions = ? AND text_hash = ?
+                    """,
+                    [
+                        (time.time_ns(), model, dimensions or 0, text_hash)
+                        for text_hash in found
+                    ],
+                )
+                self.conn.commit()
+
+        results = [
+            (
+                np.frombuffer(found[text_hash], dtype=np.float32).tolist()
+                if text_hash in found
+                else None
+            )
+            for text_hash in hashes
+        ]
+        hits = sum(result is not None for result in results)
+        self.hits += hits
+        self.misses += len(results) - hits
+        return results
+
+    def put_many(
+        self,
+        model: str,
+        dimensions: Optional[int],
+        texts: Sequence[str],
+        embeddings: Sequence[Optional[Sequence[float]]],
+    ):
+        if not self.enabled:
+            return
+
+        now = time.time_ns()
+        rows = [
+            (
+                model,
+                dimensions or 0,
+                self.text_hash(text),
+                np.asarray(embedding, dtype=np.float32).tobytes(),
+                now,
+            )
+            for text, embedding in zip(texts, embeddings)
+            if embedding is not None
+        ]
+        with self._lock:
+            changes = self.conn.total_changes
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO embeddings VALUES (?, ?, ?, ?, ?)", rows
+            )
+            added = self.conn.total_changes - changes
+            if added < len(rows):
+                # Texts cached since they were looked up only need refreshing
+                self.conn.executemany(
+                    """
+                    UPDATE embeddings SET vector = ?, last_used = ?
+                    WHERE model = ? AND dimensions = ? AND text_hash = ?
+                    """,
+                    [(row[3], row[4], *row[:3]) for row in rows],
+                )
+            self._count += added
+            if self._count > self.max_entries:
+                evicted = self.conn.execute(
+                    """
+                    DELETE FROM embeddings WHERE rowid IN (
+                        SELECT rowid FROM embeddings ORDER BY last_used LIMIT ?
+                    )
+                    """,
+                    [self._count - self.max_entries],
+                ).rowcount
+                self._count -= evicted
+            self.conn.commit()
+
+    def __len__(self) -> int:
+        if not self.enabled or not self.path.exists():
+            return 0
+        with self._lock:
+            return self.conn.execute("SELECT count(*) FROM embeddings").fetchone()[0]
+
+    def clear(self):
+        if not self.path.exists():
+            return
+        with self._lock:
+            self.conn.execute("DELETE FROM embeddings")
+            self.conn.commit()
+            self._count = 0
+            self.conn.execute("VACUUM")
+
+
+@lru_cache(maxsize=1)
+def get_embedding_cache() -> EmbeddingCache:
+    return EmbeddingCache(
+        path=Path(os.environ.get("RAG_APP_EMBEDDING_CACHE", DEFAULT_CACHE_PATH)),
+        max_entries=int(
+            os.environ.get("RAG_APP_EMBEDDING_CACHE_SIZE", DEFAULT_CACHE_SIZE)
+        ),
+    )
@@ -0,0 +1,384 @@
+import asyncio
+import random
+import time
+from collections import deque
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Tuple
+import numpy as np
+from lancedb.embeddings import EmbeddingFunction, OpenAIEmbeddings, get_registry
+from lancedb.embeddings.registry import register
+from rag_app.src.embedding_cache import EmbeddingCache, get_embedding_cache
+from rag_app.src.local_embeddings import LOCAL_EMBEDDING_MODEL, HashingEmbeddings
+from rag_app.src.profiling import span
+from rag_app.src.tokens import count_tokens
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
+
+EMBEDDING_MODEL = "text-embedding-3-large"
+EMBEDDING_DIMENSIONS = 256
+
+
+# The OpenAI SDK is only imported once a request is about to be made, so that
+# commands which never call the API start up without it
+def openai_client(**kwargs) -> "AsyncOpenAI":
+    from openai import AsyncOpenAI
+
+    return AsyncOpenAI(**kwargs)
+
+
+def retryable_errors() -> Tuple[type, ...]:
+    import openai
+
+    return (
+        openai.RateLimitError,
+        openai.InternalServerError,
+        openai.APIConnectionError,
+    )
+
+
+def get_retry_after(error: Exception) -> Optional[float]:
+    """
+    Reads how long the API asked us to wait from the `Retry-After` headers of a
+    failed request, if there are any
+    """
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    for header, scale in [("retry-after-ms", 1000), ("retry-after", 1)]:
+        value = response.headers.get(header)
+        try:
+            return float(value) / scale
+        except (TypeError, ValueError):
+            continue
+    return None
+
+
+class RequestBackoff:
+    """
+    Shared backoff state for every request sent by a batcher. A failed request
+    pauses all senders until its delay has passed. Without a `Retry-After`
+    header the delay grows exponentially with the attempt number and is
+    stretched further by the error rate over the last `window` requests.
+    """
+
+    def __init__(
+        self, base_delay: float = 1.0, max_delay: float = 60.0, window: int = 50
+    ):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.outcomes = deque(maxlen=window)
+        self.resume_at = 0.0
+
+    @property
+    def error_rate(self) -> float:
+        if not self.outcomes:
+            return 0.0
+        return self.outcomes.count(False) / len(self.outcomes)
+
+    def record_success(self):
+        self.outcomes.append(True)
+
+    def record_failure(
+        self, attempt: int, retry_after: Optional[float] = None
+    ) -> float:
+        self.outcomes.append(False)
+        if retry_after is not None:
+            delay = retry_after
+        else:
+            delay = self.base_delay * 2**attempt * (1 + self.error_rate)
+            delay = min(self.max_delay, delay * random.uniform(1, 1.25))
+        self.resume_at = max(self.resume_at, time.monotonic() + delay)
+        return delay
+
+    async def wait(self):
+        delay = self.resume_at - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class EmbeddingBatcher:
+    """
+    Embeds texts through the OpenAI API with as few requests as possible.
+
+    Identical texts are only embedded once, whether they are repeated within
+    a call or requested by concurrent calls. Texts already in the cache are
+    never sent. The rest are packed into requests of at most
+    `max_tokens_per_request` tokens and `max_inputs_per_request` inputs, with
+    at most `max_concurrency` requests in flight at once.
+    """
+
+    def __init__(
+        self,
+        client: "AsyncOpenAI",
+        model: str = EMBEDDING_MODEL,
+        dimensions: Optional[int] = EMBEDDING_DIMENSIONS,
+        max_tokens_per_request: int = 100_000,
+        max_inputs_per_request: int = 2048,
+        max_concurrency: int = 4,
+        max_retries: int = 6,
+        tokenizer: Optional[Callable[[List[str]], List[int]]] = None,
+        cache: Optional[EmbeddingCache] = None,
+        backoff: Optional[RequestBackoff] = None,
+    ):
+        # Retries are handled by our own backoff rather than the client's
+        self.client = client.with_options(max_retries=0)
+        self.model = model
+        self.dimensions = dimensions
+        self.max_tokens_per_request = max_tokens_per_request
+        self.max_inputs_per_request = max_inputs_per_request
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.tokenizer = tokenizer or count_tokens
+        self.cache = cache
+        self.backoff = backoff or RequestBackoff()
+        self.requests = 0
+        self.retries = 0
+        self.deduplicated = 0
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    def pack(self, texts: List[str]) -> List[List[str]]:
+        batches, batch, total = [], [], 0
+        for text, size in zip(texts, self.tokenizer(texts)):
+            if batch and (
+                total + size > self.max_tokens_per_request
+                or len(batch) == self.max_inputs_per_request
+            ):
+                batches.append(batch)
+                batch, total = [], 0
+            batch.append(text)
+            total += size
+        if batch:
+            batches.append(batch)
+        return batches
+
+    async def request(self, batch: List[str]) -> List[List[float]]:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        kwargs = {"input": batch, "model": self.model}
+        if self.dimensions is not None:
+            kwargs["dimensions"] = self.dimensions
+
+        for attempt in range(self.max_retries + 1):
+            await self.backoff.wait()
+            async with self._semaphore:
+                try:
+                    with span("embedding_request", inputs=len(batch)):
+                        response = await self.client.embeddings.create(**kwargs)
+                except retryable_errors() as e:
+                    if attempt == self.max_retries:
+                        raise
+                    self.backoff.record_failure(attempt, get_retry_after(e))
+                    self.retries += 1
+                    continue
+
+            self.backoff.record_success()
+            self.requests += 1
+            data = sorted(response.data, key=lambda item: item.index)
+            return [item.embedding for item in data]
+
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        unique = list(dict.fromkeys(texts))
+        self.deduplicated += len(texts) - len(unique)
+        if self.cache is not None:
+            with span("embedding_cache_lookup", texts=len(unique)):
+                cached = self.cache.get_many(self.model, self.dimensions, unique)
+        else:
+            cached = [None] * len(unique)
+
+        results: Dict[str, List[float]] = {}
+        waiting: Dict[str, asyncio.Future] = {}
+        to_send = []
+        for text, embedding in zip(unique, cached):
+            if embedding is not None:
+                results[text] = embedding
+            elif text in self._inflight:
+                waiting[text] = self._inflight[text]
+                self.deduplicated += 1
+            else:
+                to_send.append(text)
+
+        loop = asyncio.get_running_loop()
+        futures = {text: loop.create_future() for text in to_send}
+        self._inflight.update(futures)
+
+        async def send(batch: List[str]):
+            try:
+                embeddings = await self.request(batch)
+            except BaseException as e:
+                for text in batch:
+                    futures[text].set_exception(e)
+                    # Mark as retrieved so unawaited failures aren't logged twice
+                    futures[text].exception()
+                raise
+            if self.cache is not None:
+                with span("embedding_cache_store", texts=len(batch)):
+                    self.cache.put_many(self.model, self.dimensions, batch, embeddings)
+            for text, embedding in zip(batch, embeddings):
+                futures[text].set_result(embedding)
+
+        try:
+            await asyncio.gather(*[send(batch) for batch in self.pack(to_send)])
+        finally:
+            for text in to_send:
+                self._inflight.pop(text, None)
+
+        for text, future in {**waiting, **futures}.items():
+            results[text] = await future
+        return [results[text] for text in texts]
+
+
+# Shared across ingest batches so that rate limits hit by one batch slow the next
+_ingest_backoff = RequestBackoff()
+
+
+@register("cached-openai")
+class CachedOpenAIEmbeddings(OpenAIEmbeddings):
+    """
+    The LanceDB OpenAI embedding function, routed through the embedding batcher
+    and the shared embedding cache so that re-ingesting a chunk never pays for
+    the same embedding twice. Azure OpenAI deployments still embed through
+    LanceDB's own client, uncached.
+    """
+
+    def create_batcher(self, **kwargs) -> EmbeddingBatcher:
+        client_kwargs = {}
+        if self.base_url:
+            client_kwargs["base_url"] = self.base_url
+        if self.default_headers:
+            client_kwargs["default_headers"] = self.default_headers
+        if self.organization:
+            client_kwargs["organization"] = self.organization
+        if self.api_key:
+            client_kwargs["api_key"] = self.api_key
+        return EmbeddingBatcher(
+            openai_client(**client_kwargs),
+            model=self.name,
+            dimensions=self.dim,
+            cache=get_embedding_cache(),
+            **kwargs,
+        )
+
+    def generate_embeddings(self, texts) -> List[Optional[List[float]]]:
+        if self.use_azure:
+            return super().generate_embeddings(texts)
+        batcher = self.create_batcher(backoff=_ingest_backoff)
+        with span("embed", texts=len(texts)):
+            return asyncio.run(batcher.embed(list(texts)))
+
+
+@register("openai")
+class LegacyOpenAIEmbeddings(CachedOpenAIEmbeddings):
+    """
+    Takes the place of LanceDB's `openai` embedding function, which tables
+    created before the cache record in their schema, so that those tables are
+    cached too while still recording the same function.
+
+    Importing this module replaces LanceDB's own `openai` entry in the
+    embedding function registry for the whole process.
+    """
+
+
+# Embedding backends a table can be created with, by the name they are
+# registered with in LanceDB and their default model
+EMBEDDING_PROVIDERS = {
+    "openai": ("cached-openai", EMBEDDING_MODEL),
+    "local": ("local-hashing", LOCAL_EMBEDDING_MODEL),
+}
+
+
+def create_embedding_function(
+    provider: str = "openai",
+    model: Optional[str] = None,
+    dimensions: Optional[int] = None,
+) -> EmbeddingFunction:
+    if provider not in EMBEDDING_PROVIDERS:
+        raise ValueError(
+            f"Invalid embedding provider {provider}. Only {', '.join(EMBEDDING_PROVIDERS)} is supported at the moment"
+        )
+    name, default_model = EMBEDDING_PROVIDERS[provider]
+    return (
+        get_registry()
+        .get(name)
+        .create(name=model or default_model, dim=dimensions or EMBEDDING_DIMENSIONS)
+    )
+
+
+def describe_embedding_function(function: EmbeddingFunction) -> Tuple[str, str, int]:
+    """
+    The provider, model and dimensions of an embedding function
+    """
+    provider = "local" if isinstance(function, HashingEmbeddings) else "openai"
+    return provider, function.name, function.ndims()
+
+
+def table_embedding_function(table) -> EmbeddingFunction:
+    """
+    The embedding function recorded in the schema of a table. Tables created
+    without one were embedded with the default OpenAI model.
+    """
+    config = table.embedding_functions.get("vector")
+    if config is None:
+        return create_embedding_function()
+    return config.function
+
+
+class FunctionEmbedder:
+    """
+    Embeds texts with an in-process embedding function on a worker thread,
+    with the same interface and counters as `EmbeddingBatcher`
+    """
+
+    def __init__(self, function: EmbeddingFunction):
+        self.function = function
+        self.requests = 0
+        self.retries = 0
+        self.deduplicated = 0
+
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        unique = list(dict.fromkeys(texts))
+        self.deduplicated += len(texts) - len(unique)
+        embeddings = await asyncio.to_thread(
+            self.function.compute_query_embeddings, unique
+        )
+        self.requests += 1
+        embedded = dict(zip(unique, np.asarray(embeddings, dtype=np.float32).tolist()))
+        return [embedded[text] for text in texts]
+
+
+def get_query_embedder(table):
+    """
+    Embeds queries the same way the chunks of `table` were embedded
+    """
+    function = table_embedding_function(table)
+    if isinstance(function, CachedOpenAIEmbeddings) and not function.use_azure:
+        return function.create_batcher()
+    return FunctionEmbedder(function)
+
+
+def embed_for_table(table, texts: List[str]) -> List[List[float]]:
+    return asyncio.run(get_query_embedder(table).embed(texts))
+
+
+async def aembed_texts(
+    texts: List[str],
+    client: "AsyncOpenAI",
+    model: str = EMBEDDING_MODEL,
+    dimensions: int = EMBEDDING_DIMENSIONS,
+) -> List[List[float]]:
+    batcher = EmbeddingBatcher(
+        client, model=model, dimensions=dimensions, cache=get_embedding_cache()
+    )
+    return await batcher.embed(texts)
+
+
+def embed_texts(
+    texts: List[str],
+    client: Optional["AsyncOpenAI"] = None,
+    model: str = EMBEDDING_MODEL,
+    dimensions: int = EMBEDDING_DIMENSIONS,
+) -> List[List[float]]:
+    return asyncio.run(
+        aembed_texts(texts, client or openai_client(), model, dimensions)
+    )
@@ -0,0 +1,212 @@
+from pathlib import Path
+from typing import List, Optional, Tuple
+import numpy as np
+import pyarrow.compute as pc
+
+METRICS = ["L2", "cosine"]
+
+
+class VectorMatrix:
+    """
+    Every chunk vector of a table held in one contiguous float32 matrix, for
+    exact search over a whole batch of queries at a time.
+
+    Distances match the ones LanceDB reports: squared euclidean distance for
+    `L2` and `1 - cosine similarity` for `cosine`.
+    """
+
+    def __init__(
+        self, chunk_ids: List[str], vectors: np.ndarray, version: Optional[int] = None
+    ):
+        self.chunk_ids = chunk_ids
+        self.vectors = vectors
+        self.version = version
+        self._norms = None
+
+    @classmethod
+    def from_table(cls, table) -> "VectorMatrix":
+        data = table.to_lance().to_table(columns=["chunk_id", "vector"])
+        data = data.filter(pc.is_valid(data["vector"]))
+        vectors = data["vector"].combine_chunks()
+        matrix = (
+            vectors.flatten()
+            .to_numpy(zero_copy_only=False)
+            .astype(np.float32, copy=False)
+            .reshape(len(vectors), -1)
+        )
+        return cls(data["chunk_id"].to_pylist(), matrix, table.version)
+
+    def save(self, path: Path):
+        np.save(path, self.vectors)
+        np.savez(
+            ids_path(path),
+            chunk_ids=np.array(self.chunk_ids, dtype=str),
+            version=np.array(-1 if self.version is None else self.version),
+        )
+
+    @classmethod
+    def load(cls, path: Path, mmap: bool = True) -> "VectorMatrix":
+        with np.load(ids_path(path)) as data:
+            version = int(data["version"])
+            chunk_ids = data["chunk_ids"].tolist()
+        vectors = np.load(path, mmap_mode="r" if mmap else None)
+        return cls(chunk_ids, vectors, None if version == -1 else version)
+
+    def subset(self, rows: np.ndarray) -> "VectorMatrix":
+        """
+        The vectors at `rows` only, copied out of a memory-mapped matrix
+        """
+        subset = VectorMatrix(
+            [self.chunk_ids[row] for row in rows],
+            np.asarray(self.vectors[rows], dtype=np.float32),
+            self.version,
+        )
+        if self._norms is not None:
+            subset._norms = self._norms[rows]
+        return subset
+
+    def norms(self) -> np.ndarray:
+        if self._norms is None:
+            self._norms = np.einsum("ij,ij->i", self.vectors, self.vectors)
+        return self._norms
+
+    def search(
+        self,
+        queries: np.ndarray,
+        k: int = 25,
+        metric: str = "L2",
+        query_block_size: int = 256,
+        chunk_block_size: int = 65536,
+    ) -> Tuple[List[List[str]], np.ndarray]:
+        """
+        Returns the ids and distances of the `k` nearest chunks to every query,
+        nearest first. Queries and chunks are both processed in blocks so only a
+        `query_block_size` x `chunk_block_size` distance matrix is held at once.
+        """
+        if metric not in METRICS:
+            raise ValueError(
+                f"Invalid metric {metric}. Only {', '.join(METRICS)} is supported at the moment"
+            )
+        queries = np.ascontiguousarray(queries, dtype=np.float32)
+        k = min(k, len(self.chunk_ids))
+        if k == 0:
+            return [[] for _ in queries], np.empty((len(queries), 0), dtype=np.float32)
+        norms = self.norms()
+        if metric == "cosine":
+            queries = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+
+        ids = np.empty((len(queries), k), dtype=np.int64)
+        distances = np.empty((len(queries), k), dtype=np.float32)
+        for start in range(0, len(queries), query_block_size):
+            block = queries[start : start + query_block_size]
+            block_norms = np.einsum("ij,ij->i", block, block)[:, None]
+            best_ids = np.empty((len(block), 0), dtype=np.int64)
+            best = np.empty((len(block), 0), dtype=np.float32)
+
+            for offset in range(0, len(self.chunk_ids), chunk_block_size):
+                chunks = self.vectors[offset : offset + chunk_block_size]
+                chunk_norms = norms[offset : offset + chunk_block_size]
+                # Terms which are the same for every chunk are added back at the
+                # end, so each block only needs one matmul and one in-place update
+                block_distances = block @ chunks.T
+                if metric == "L2":
+                    block_distances *= -2
+                    block_distances += chunk_norms
+                else:
+                    block_distances /= -np.sqrt(chunk_norms)
+                best, best_ids = merge_top_k(best, best_ids, block_distances, offset, k)
+
+            best += block_norms if metric == "L2" else 1
+            order = np.argsort(best, axis=1, kind="stable")
+            distances[start : start + len(block)] = np.take_along_axis(
+                best, order, axis=1
+            )
+            ids[start : start + len(block)] = np.take_along_axis(
+                best_ids, order, axis=1
+            )
+
+        return [[self.chunk_ids[idx] for idx in row] for row in ids], distances
+
+
+def top_k(distances: np.ndarray, k: int) -> np.ndarray:
+    """
+    Returns the column indices of the `k` smallest distances in every row, in
+    no particular order
+    """
+    if distances.shape[1] <= k:
+        return np.broadcast_to(np.arange(distances.shape[1]), distances.shape)
+    return np.argpartition(distances, k - 1, axis=1)[:, :k]
+
+
+def merge_top_k(
+    best: np.ndarray,
+    best_ids: np.ndarray,
+    distances: np.ndarray,
+    offset: int,
+    k: int,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Merges a block of distances, whose first column is chunk `offset`, into
+    the running `k` nearest chunks of every row
+    """
+    if best.shape[1] == 0:
+        # Seed each row from a small slice so the rest of the block can be
+        # filtered against it rather than partitioned in full
+        head = max(64 * k, 1024)
+        top = top_k(distances[:, :head], k)
+        best, best_ids = np.take_along_axis(distances, top, axis=1), top + offset
+        if distances.shape[1] <= head:
+            return best, best_ids
+        return merge_top_k(best, best_ids, distances[:, head:], offset + head, k)
+
+    if best.shape[1] < k:
+        candidates = np.hstack([best, distances])
+        candidate_ids = np.hstack(
+            [
+                best_ids,
+                np.broadcast_to(
+                    np.arange(offset, offset + distances.shape[1]), distances.shape
+                ),
+            ]
+        )
+        top = top_k(candidates, k)
+        return (
+            np.take_along_axis(candidates, top, axis=1),
+            np.take_along_axis(candidate_ids, top, axis=1),
+        )
+
+    # Once every row has k results only the few distances closer than a row's
+    # current k-th nearest can change it, so only those are sorted
+    rows, cols = np.nonzero(distances < best.max(axis=1, keepdims=True))
+    if not len(rows):
+        return best, best_ids
+
+    num_rows = len(best)
+    values = np.concatenate([best.ravel(), distances[rows, cols]])
+    value_rows = np.concatenate([np.repeat(np.arange(num_rows), k), rows])
+    value_ids = np.concatenate([best_ids.ravel(), cols + offset])
+    order = np.lexsort((values, value_rows))
+    starts = np.searchsorted(value_rows[order], np.arange(num_rows))
+    keep = order[(starts[:, None] + np.arange(k)).ravel()]
+    return values[keep].reshape(num_rows, k), value_ids[keep].reshape(num_rows, k)
+
+
+def ids_path(path: Path) -> Path:
+    return Path(path).with_suffix(".ids.npz")
+
+
+def vector_matrix_path(db_path: str, table_name: str) -> Path:
+    return Path(db_path) / f"{table_name}.vectors.npy"
+
+
+def load_vector_matrix(db_path: str, table_name: str, table) -> VectorMatrix:
+    """
+    Memory-maps the exported vectors of a table when they are up to date with
+    it, and otherwise reads the vectors from the table itself
+    """
+    path = vector_matrix_path(db_path, table_name)
+    if path.exists() and ids_path(path).exists():
+        matrix = VectorMatrix.load(path)
+        if matrix.version == table.version:
+            return matrix
+    return VectorMatrix.from_table(table)
@@ -0,0 +1,114 @@
+import math
+from datetime import datetime
+from typing import Iterable, List, Optional
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+# Bitmap indexes can't be built on timestamps, and documents are too many for
+# bitmaps to pay off on `doc_id` and `source`
+SCALAR_INDEXES = {"publish_date": "BTREE", "doc_id": "BTREE", "source": "BTREE"}
+# Above this fraction of the chunks, reading the matching rows through the
+# scalar indexes one by one is slower than searching every chunk and dropping
+# the ones which don't match
+PREFILTER_SELECTIVITY = 0.15
+
+
+def quote(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+
+def build_filter(
+    where: Optional[str] = None,
+    after: Optional[datetime] = None,
+    before: Optional[datetime] = None,
+    doc_ids: Optional[Iterable[str]] = None,
+) -> Optional[str]:
+    """
+    Combines the filter options of a command into one SQL filter on the chunk
+    columns. `after` is inclusive and `before` is exclusive.
+    """
+    clauses = []
+    if where:
+        clauses.append(f"({where})")
+    if after is not None:
+        clauses.append(f"publish_date >= timestamp '{after:%Y-%m-%d %H:%M:%S}'")
+    if before is not None:
+        clauses.append(f"publish_date < timestamp '{before:%Y-%m-%d %H:%M:%S}'")
+    doc_ids = list(doc_ids or [])
+    if doc_ids:
+        clauses.append(f"doc_id IN ({', '.join(quote(doc_id) for doc_id in doc_ids)})")
+    return " AND ".join(clauses) or None
+
+
+def create_scalar_indexes(table):
+    """
+    Indexes the columns chunks are filtered on. Indexes which already exist
+    have the rows added since they were built appended to them instead of
+    being rebuilt.
+    """
+    if not table.count_rows():
+        return
+    existing = {
+        index.columns[0]: index.name
+        for index in table.list_indices()
+        if len(index.columns) == 1
+    }
+    for column, index_type in SCALAR_INDEXES.items():
+        if column not in existing:
+            table.create_scalar_index(column, index_type=index_type)
+    names = [existing[column] for column in SCALAR_INDEXES if column in existing]
+    if names:
+        table.to_lance().optimize.optimize_indices(index_names=names)
+
+
+class SearchFilter:
+    """
+    A SQL filter on the chunks of a table along with how many chunks match it,
+    counted once through the scalar indexes, which decides how searches apply
+    it.
+
+    Narrow filters are applied before the search, so only the matching chunks
+    are read. Broad filters are applied to `overfetch(n)` nearest chunks, and
+    the search is only repeated with the filter applied first when fewer than
+    `n` of those match.
+    """
+
+    def __init__(self, sql: str, matches: int, total: int):
+        self.sql = sql
+        self.matches = matches
+        self.total = total
+
+    @classmethod
+    def resolve(cls, table, sql: Optional[str]) -> Optional["SearchFilter"]:
+        if not sql:
+            return None
+        return cls(sql, table.count_rows(sql), table.count_rows())
+
+    @property
+    def selectivity(self) -> float:
+        return self.matches / max(self.total, 1)
+
+    @property
+    def prefilter(self) -> bool:
+        return self.selectivity <= PREFILTER_SELECTIVITY
+
+    def overfetch(self, n: int) -> int:
+        """
+        How many chunks to search for so that `n` of them are expected to
+        match twice over
+        """
+        return min(self.total, math.ceil(2 * n / max(self.selectivity, 1e-9)))
+
+    def rows(self, table, chunk_ids: List[str]) -> np.ndarray:
+        """
+        Returns the positions of the matching chunks among `chunk_ids`, for
+        indexes held in memory
+        """
+        matching = (
+            table.to_lance()
+            .to_table(columns=["chunk_id"], filter=self.sql)
+            .column("chunk_id")
+        )
+        mask = pc.is_in(pa.array(chunk_ids, type=pa.string()), value_set=matching)
+        return np.flatnonzero(mask.to_numpy(zero_copy_only=False))
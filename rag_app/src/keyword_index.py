@@ -0,0 +1,177 @@
+import re
+from bisect import bisect_left
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class KeywordIndex:
+    """
+    A positional inverted index over the chunks of a table.
+
+    Every token in the corpus gets a global position (chunks are separated by a
+    gap so phrases never span two chunks) and each term stores the sorted
+    positions it occurs at, so phrase matching is an intersection of shifted
+    position arrays.
+
+    A keyword matches a chunk when its tokens appear in it as a phrase. The
+    last token of a keyword matches as a prefix, so `startup` also matches
+    `startups`. Keywords are only ever tokenized, never turned into a query
+    string, so punctuation or regex characters in them have no effect.
+    """
+
+    def __init__(
+        self,
+        chunk_ids: List[str],
+        chunk_starts: np.ndarray,
+        terms: List[str],
+        offsets: np.ndarray,
+        positions: np.ndarray,
+        version: Optional[int] = None,
+    ):
+        self.chunk_ids = chunk_ids
+        self.chunk_starts = chunk_starts
+        self.terms = terms
+        self.offsets = offsets
+        self.positions = positions
+        self.version = version
+
+    @classmethod
+    def build(
+        cls, chunks: Iterable[Tuple[str, str]], version: Optional[int] = None
+    ) -> "KeywordIndex":
+        chunk_ids, chunk_starts = [], []
+        postings: Dict[str, List[int]] = defaultdict(list)
+        position = 0
+        for chunk_id, text in chunks:
+            chunk_ids.append(chunk_id)
+            chunk_starts.append(position)
+            for token in tokenize(text):
+                postings[token].append(position)
+                position += 1
+            position += 1
+
+        terms = sorted(postings)
+        lengths = [len(postings[term]) for term in terms]
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        positions = np.fromiter(
+            (p for term in terms for p in postings[term]),
+            dtype=np.int64,
+            count=int(offsets[-1]),
+        )
+        return cls(
+            chunk_ids,
+            np.array(chunk_starts, dtype=np.int64),
+            terms,
+            offsets,
+            positions,
+            version,
+        )
+
+    def save(self, path: Path):
+        with open(path, "wb") as file:
+            np.savez(
+                file,
+                chunk_ids=np.array(self.chunk_ids, dtype=str),
+                chunk_starts=self.chunk_starts,
+                terms=np.array(self.terms, dtype=str),
+                offsets=self.offsets,
+                positions=self.positions,
+                version=np.array(-1 if self.version is None else self.version),
+            )
+
+    @classmethod
+    def load(cls, path: Path) -> "KeywordIndex":
+        with np.load(path) as data:
+            version = int(data["version"])
+            return cls(
+                data["chunk_ids"].tolist(),
+                data["chunk_starts"],
+                data["terms"].tolist(),
+                data["offsets"],
+                data["positions"],
+                None if version == -1 else version,
+            )
+
+    def term_positions(self, token: str, prefix: bool = False) -> np.ndarray:
+        lo = bisect_left(self.terms, token)
+        if prefix:
+            hi = bisect_left(self.terms, token[:-1] + chr(ord(token[-1]) + 1), lo)
+        else:
+            hi = lo + 1 if lo < len(self.terms) and self.terms[lo] == token else lo
+
+        positions = self.positions[self.offsets[lo] : self.offsets[hi]]
+        # Positions of a single term are already sorted, merged prefixes are not
+        return np.sort(positions) if hi - lo > 1 else positions
+
+    def match(self, keyword: str) -> np.ndarray:
+        """
+        Returns the sorted indices of the chunks which contain the keyword
+        """
+        tokens = tokenize(keyword)
+        if not tokens:
+            return np.empty(0, dtype=np.int64)
+
+        last = len(tokens) - 1
+        starts = self.term_positions(tokens[0], prefix=last == 0)
+        for offset, token in enumerate(tokens[1:], start=1):
+            if not len(starts):
+                break
+            positions = self.term_positions(token, prefix=offset == last)
+            starts = np.intersect1d(starts, positions - offset, assume_unique=True)
+
+        chunks = np.searchsorted(self.chunk_starts, starts, side="right") - 1
+        return np.unique(chunks)
+
+    def search(
+        self, keywords: List[str], limit: int = 25, mask: Optional[np.ndarray] = None
+    ) -> List[Tuple[str, int]]:
+        """
+        Returns up to `limit` chunk ids ranked by how many of the keywords they
+        match, breaking ties by the order the chunks were indexed in. With a
+        boolean `mask` over the chunks, only chunks where it is set are ranked.
+        """
+        matches = [self.match(keyword) for keyword in keywords]
+        if not matches:
+            return []
+
+        num_keywords_matched = np.bincount(
+            np.concatenate(matches), minlength=len(self.chunk_ids)
+        )
+        if mask is not None:
+            num_keywords_matched *= mask
+        candidates = np.flatnonzero(num_keywords_matched)
+        counts = num_keywords_matched[candidates]
+        top = candidates[np.lexsort((candidates, -counts))[:limit]]
+        return [(self.chunk_ids[idx], int(num_keywords_matched[idx])) for idx in top]
+
+
+def keyword_index_path(db_path: str, table_name: str) -> Path:
+    return Path(db_path) / f"{table_name}.keywords.npz"
+
+
+def load_keyword_index(db_path: str, table_name: str, table) -> KeywordIndex:
+    """
+    Loads the persisted keyword index of a table, rebuilding it whenever the
+    table has been written to since it was built
+    """
+    path = keyword_index_path(db_path, table_name)
+    if path.exists():
+        index = KeywordIndex.load(path)
+        if index.version == table.version:
+            return index
+
+    rows = table.to_lance().to_table(columns=["chunk_id", "text"]).to_pylist()
+    index = KeywordIndex.build(
+        ((row["chunk_id"], row["text"]) for row in rows), table.version
+    )
+    index.save(path)
+    return index
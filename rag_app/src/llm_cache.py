@@ -0,0 +1,248 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from functools import lru_cache
+from pathlib import Path
+from threading import Lock
+from types import SimpleNamespace
+from typing import Callable, Optional, Type
+from pydantic import BaseModel
+
+DEFAULT_LLM_CACHE_PATH = Path.home() / ".cache" / "rag-app" / "llm.sqlite"
+DEFAULT_LLM_CACHE_SIZE = 100_000
+CACHE_MODES = ["auto", "record", "replay", "off"]
+
+
+class CacheMissError(Exception):
+    pass
+
+
+class ResponseCache:
+    """
+    An on-disk cache of structured LLM responses keyed by the model, the
+    messages and the JSON schema of the response model.
+
+    `mode` controls how it is used:
+    - `auto` returns cached responses and stores new ones
+    - `record` always calls the model and overwrites what is cached
+    - `replay` only ever returns cached responses and raises `CacheMissError`
+      for anything else, so runs are reproducible and never hit the network
+    - `off` disables the cache
+
+    Responses older than `ttl` seconds are ignored (0 keeps them forever) and
+    the least recently used ones are evicted beyond `max_entries`. Like the
+    embedding cache, responses are counted once when the cache is opened and
+    kept track of from then on.
+    """
+
+    def __init__(
+        self,
+        path: Path = DEFAULT_LLM_CACHE_PATH,
+        max_entries: int = DEFAULT_LLM_CACHE_SIZE,
+        ttl: float = 0,
+        mode: str = "auto",
+    ):
+        if mode not in CACHE_MODES:
+            raise ValueError(
+                f"Invalid cache mode {mode}. Only {', '.join(CACHE_MODES)} is supported at the moment"
+            )
+        self.path = Path(path)
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.mode = mode
+        self.hits = 0
+        self.misses = 0
+        self.time_saved = 0.0
+        self._lock = Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._count = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != "off" and self.max_entries > 0
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            # Evaluation shards write from several processes at once
+            self._conn.executescript("""
+                PRAGMA busy_timeout = 30000;
+                PRAGMA journal_mode = WAL;
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    model TEXT NOT NULL,
+                    response TEXT NOT NULL,
+                    elapsed REAL NOT NULL,
+                    created_at INTEGER NOT NULL,
+                    last_used INTEGER NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS responses_last_used
+                    ON responses (last_used);
+                """)
+            self._count = self._conn.execute(
+                "SELECT count(*) FROM responses"
+            ).fetchone()[0]
+        return self._conn
+
+    @staticmethod
+    def request_key(
+        model: str, messages: list, response_model: Type[BaseModel], **kwargs
+    ) -> str:
+        request = {
+            "model": model,
+            "messages": messages,
+            "schema": response_model.model_json_schema(),
+            **kwargs,
+        }
+        return hashlib.sha256(
+            json.dumps(request, sort_keys=True).encode("utf-8")
+        ).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT response, elapsed, created_at FROM responses WHERE key = ?",
+                [key],
+            ).fetchone()
+            if row is None:
+                return None
+            response, elapsed, created_at = row
+            if self.ttl and time.time_ns() - created_at > self.ttl * 1e9:
+                return None
+            self.conn.execute(
+                "UPDATE responses SET last_used = ? WHERE key = ?",
+                [time.time_ns(), key],
+            )
+            self.conn.commit()
+        self.time_saved += elapsed
+        return response
+
+    def put(self, key: str, model: str, response: str, elapsed: float):
+        now = time.time_ns()
+        with self._lock:
+            row = [key, model, response, elapsed, now, now]
+            added = self.conn.execute(
+                "INSERT OR IGNORE INTO responses VALUES (?, ?, ?, ?, ?, ?)", row
+            ).rowcount
+            if not added:
+                # Recording over a cached response
+                self.conn.execute(
+                    """
+                    UPDATE responses SET model = ?, response = ?, elapsed = ?,
+                    created_at = ?, last_used = ? WHERE key = ?
+                    """,
+                    row[1:] + [key],
+                )
+            self._count += added
+            if self._count > self.max_entries:
+                evicted = self.conn.execute(
+                    """
+                    DELETE FROM responses WHERE rowid IN (
+                        SELECT rowid FROM responses ORDER BY last_used LIMIT ?
+                    )
+                    """,
+                    [self._count - self.max_entries],
+                ).rowcount
+                self._count -= evicted
+            self.conn.commit()
+
+    async def create(
+        self,
+        create: Callable,
+        model: str,
+        messages: list,
+        response_model: Type[BaseModel],
+        **kwargs,
+    ) -> BaseModel:
+        """
+        Returns the cached response to a request, calling `create` with it
+        when there is none (or when recording)
+        """
+        if not self.enabled:
+            return await create(
+                model=model, messages=messages, response_model=response_model, **kwargs
+            )
+
+        # Retries don't change the response, so they aren't part of the key
+        options = {k: v for k, v in kwargs.items() if k != "max_retries"}
+        key = self.request_key(model, messages, response_model, **options)
+        if self.mode != "record":
+            cached = self.get(key)
+            if cached is not None:
+                self.hits += 1
+                return response_model.model_validate_json(cached)
+
+        self.misses += 1
+        if self.mode == "replay":
+            raise CacheMissError(
+                f"No cached {model} response for request {key[:12]} in replay mode"
+            )
+
+        start = time.perf_counter()
+        response = await create(
+            model=model, messages=messages, response_model=response_model, **kwargs
+        )
+        self.put(key, model, response.model_dump_json(), time.perf_counter() - start)
+        return response
+
+    def summary(self) -> str:
+        requests = self.hits + self.misses
+        hit_rate = self.hits / requests if requests else 0.0
+        return (
+            f"LLM cache: {self.hits} hits, {self.misses} misses "
+            f"({hit_rate:.0%} hit rate), saved {self.time_saved:.1f}s"
+        )
+
+    def __len__(self) -> int:
+        if not self.path.exists():
+            return 0
+        with self._lock:
+            return self.conn.execute("SELECT count(*) FROM responses").fetchone()[0]
+
+    def clear(self):
+        if not self.path.exists():
+            return
+        with self._lock:
+            self.conn.execute("DELETE FROM responses")
+            self.conn.commit()
+            self._count = 0
+            self.conn.execute("VACUUM")
+
+
+def cached_client(client_factory: Callable, cache: ResponseCache = None):
+    """
+    Wraps an instructor patched client so `client.chat.completions.create`
+    goes through the response cache. The client is only created on the first
+    cache miss, so replaying never needs an API key.
+    """
+    cache = get_llm_cache() if cache is None else cache
+    client = None
+
+    async def create(model: str, messages: list, response_model, **kwargs):
+        async def call(**request):
+            nonlocal client
+            if client is None:
+                client = client_factory()
+            return await client.chat.completions.create(**request)
+
+        return await cache.create(call, model, messages, response_model, **kwargs)
+
+    return SimpleNamespace(
+        chat=SimpleNamespace(completions=SimpleNamespace(create=create))
+    )
+
+
+@lru_cache(maxsize=1)
+def get_llm_cache() -> ResponseCache:
+    return ResponseCache(
+        path=Path(os.environ.get("RAG_APP_LLM_CACHE", DEFAULT_LLM_CACHE_PATH)),
+        max_entries=int(
+            os.environ.get("RAG_APP_LLM_CACHE_SIZE", DEFAULT_LLM_CACHE_SIZE)
+        ),
+        ttl=float(os.environ.get("RAG_APP_LLM_CACHE_TTL", 0)),
+        mode=os.environ.get("RAG_APP_LLM_CACHE_MODE", "auto"),
+    )
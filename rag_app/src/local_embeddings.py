@@ -0,0 +1,162 @@
+import os
+import re
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from threading import Lock
+from typing import Dict, List, Optional, Sequence
+import numpy as np
+from lancedb.embeddings import TextEmbeddingFunction
+from lancedb.embeddings.registry import register
+from pydantic import field_validator
+from rag_app.src.profiling import span
+
+LOCAL_EMBEDDING_MODEL = "hashing-v1"
+# Every feature is projected onto this many (dimension, sign) pairs
+NONZEROS_PER_FEATURE = 8
+MIN_TEXTS_PER_WORKER = 64
+TOKEN_PATTERN = re.compile(r"\w+")
+BIGRAM_MIX = np.uint64(0x9E3779B97F4A7C15)
+# Word pairs help tell phrases apart, but words alone carry most of the meaning
+BIGRAM_WEIGHT = 0.25
+STOPWORDS = frozenset(
+    """a about above after again against all am an and any are as at be because
+    been before being below between both but by can could did do does doing down
+    during each few for from further had has have having he her here hers herself
+    him himself his how i if in into is it its itself just me more most my myself
+    no nor not now of off on once only or other our ours ourselves out over own
+    same she should so some such than that the their theirs them themselves then
+    there these they this those through to too under until up very was we were
+    what when where which while who whom why will with would you your yours
+    yourself yourselves""".split()
+)
+
+_token_hashes: Dict[str, int] = {}
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = Lock()
+
+
+def get_embedding_workers() -> int:
+    return int(os.environ.get("RAG_APP_EMBEDDING_WORKERS", os.cpu_count() or 1))
+
+
+def token_hash(token: str) -> int:
+    value = _token_hashes.get(token)
+    if value is None:
+        if len(_token_hashes) >= 1_000_000:
+            _token_hashes.clear()
+        value = zlib.crc32(token.encode("utf-8"))
+        _token_hashes[token] = value
+    return value
+
+
+def feature_hashes(text: str) -> np.ndarray:
+    """
+    Hashes of the words of a text, stopwords left out, followed by the hashes
+    of every pair of adjacent words
+    """
+    tokens = [
+        token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS
+    ]
+    try:
+        values = [_token_hashes[token] for token in tokens]
+    except KeyError:
+        values = [token_hash(token) for token in tokens]
+    hashes = np.array(values, dtype=np.uint64)
+    return np.concatenate([hashes, hashes[:-1] * BIGRAM_MIX + hashes[1:]])
+
+
+def embed_batch(texts: Sequence[str], dim: int, seed: int) -> np.ndarray:
+    """
+    Embeds every text as the normalized sum of a sparse random ±1 vector per
+    feature, weighted by 1 + log of how often the feature occurs in the text.
+    The vector of a feature only depends on its hash and `seed`, so texts
+    embedded in different processes or runs are comparable.
+    """
+    features = [feature_hashes(text) for text in texts]
+    lengths = np.array([len(hashes) for hashes in features], dtype=np.int64)
+    hashes = np.concatenate(features) if features else np.zeros(0, np.uint64)
+    rows = np.repeat(np.arange(len(texts), dtype=np.int64), lengths)
+    # A text of n words has n word features followed by n - 1 pair features
+    positions = np.arange(len(hashes)) - np.repeat(
+        np.cumsum(lengths) - lengths, lengths
+    )
+    is_bigram = positions >= np.repeat((lengths + 1) // 2, lengths)
+
+    # Counts every distinct feature of every text
+    order = np.lexsort((hashes, rows))
+    hashes, rows, is_bigram = hashes[order], rows[order], is_bigram[order]
+    first = np.ones(len(hashes), dtype=bool)
+    first[1:] = (hashes[1:] != hashes[:-1]) | (rows[1:] != rows[:-1])
+    starts = np.flatnonzero(first)
+    counts = np.diff(np.append(starts, len(hashes)))
+    hashes, rows = hashes[starts], rows[starts]
+    weights = (1 + np.log(counts)) * np.where(is_bigram[starts], BIGRAM_WEIGHT, 1.0)
+
+    rng = np.random.default_rng(seed)
+    multipliers = rng.integers(1, 2**63, NONZEROS_PER_FEATURE, dtype=np.uint64) | 1
+    increments = rng.integers(0, 2**63, NONZEROS_PER_FEATURE, dtype=np.uint64)
+    totals = np.zeros(len(texts) * dim, dtype=np.float64)
+    for multiplier, increment in zip(multipliers, increments):
+        mixed = hashes * multiplier + increment
+        dimension = ((mixed >> np.uint64(32)) % np.uint64(dim)).astype(np.int64)
+        sign = ((mixed >> np.uint64(31)) & np.uint64(1)).astype(np.float64) * 2 - 1
+        totals += np.bincount(
+            rows * dim + dimension, sign * weights, minlength=totals.size
+        )
+
+    embeddings = totals.reshape(len(texts), dim).astype(np.float32)
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings / np.maximum(norms, 1e-12)
+
+
+def get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # LanceDB runs background threads, which aren't safe to fork
+            _pool = ProcessPoolExecutor(
+                get_embedding_workers(), mp_context=get_context("spawn")
+            )
+        return _pool
+
+
+@register("local-hashing")
+class HashingEmbeddings(TextEmbeddingFunction):
+    """
+    Embeds texts on the CPU, without any model download or network access,
+    from hashed words and word pairs. Large batches are split across
+    `RAG_APP_EMBEDDING_WORKERS` processes (one per core by default).
+    """
+
+    name: str = LOCAL_EMBEDDING_MODEL
+    dim: int = 256
+    seed: int = 0
+
+    @field_validator("name")
+    @classmethod
+    def name_must_be_a_local_model(cls, v: str):
+        if v != LOCAL_EMBEDDING_MODEL:
+            raise ValueError(
+                f"Unknown local embedding model {v}. Only {LOCAL_EMBEDDING_MODEL} is supported at the moment"
+            )
+        return v
+
+    def ndims(self) -> int:
+        return self.dim
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        texts = list(texts)
+        workers = min(get_embedding_workers(), len(texts) // MIN_TEXTS_PER_WORKER)
+        if workers <= 1:
+            return embed_batch(texts, self.dim, self.seed)
+        bounds = np.linspace(0, len(texts), workers + 1).astype(int)
+        futures = [
+            get_pool().submit(embed_batch, texts[start:end], self.dim, self.seed)
+            for start, end in zip(bounds, bounds[1:])
+        ]
+        return np.concatenate([future.result() for future in futures])
+
+    def generate_embeddings(self, texts) -> List[np.ndarray]:
+        with span("embed", texts=len(texts)):
+            return list(self.embed(texts))
@@ -0,0 +1,74 @@
+import hashlib
+from pathlib import Path
+from typing import Dict, List
+from pydantic import BaseModel
+from rag_app.models import Document, FileManifest
+from rag_app.src.chunking import list_files
+
+
+class ManifestDiff(BaseModel):
+    """
+    The result of comparing a folder against the manifest of its last ingest.
+
+    Unchanged entries already carry a refreshed mtime/size so that the manifest
+    can be rewritten from `unchanged` plus the entries of the re-ingested files.
+    """
+
+    unchanged: List[FileManifest] = []
+    changed: List[Path] = []
+    removed: List[FileManifest] = []
+
+
+def generate_file_hash(file: Path) -> str:
+    return hashlib.md5(file.read_bytes()).hexdigest()
+
+
+def manifest_key(path: Path, file: Path) -> str:
+    return file.relative_to(path).as_posix()
+
+
+def build_manifest_entry(
+    path: Path, file: Path, document: Document, chunk_count: int
+) -> FileManifest:
+    stat = file.stat()
+    return FileManifest(
+        path=manifest_key(path, file),
+        doc_id=document.id,
+        content_hash=generate_file_hash(file),
+        mtime=stat.st_mtime_ns,
+        size=stat.st_size,
+        chunk_count=chunk_count,
+    )
+
+
+def diff_manifest(
+    path: Path,
+    file_suffix: str,
+    manifest: Dict[str, FileManifest],
+    recursive: bool = False,
+) -> ManifestDiff:
+    diff = ManifestDiff()
+    seen = set()
+
+    for file in list_files(path, file_suffix, recursive):
+        key = manifest_key(path, file)
+        seen.add(key)
+        entry = manifest.get(key)
+        stat = file.stat()
+
+        if entry is None:
+            diff.changed.append(file)
+        elif entry.mtime == stat.st_mtime_ns and entry.size == stat.st_size:
+            diff.unchanged.append(entry)
+        elif entry.content_hash == generate_file_hash(file):
+            # Touched but not edited, so we only need to refresh the stat info
+            diff.unchanged.append(
+                entry.model_copy(
+                    update={"mtime": stat.st_mtime_ns, "size": stat.st_size}
+                )
+            )
+        else:
+            diff.changed.append(file)
+
+    diff.removed = [entry for key, entry in manifest.items() if key not in seen]
+    return diff
@@ -1,4 +1,5 @@
-from sklearn.metrics import ndcg_score
+from itertools import chain
+from typing import Dict, Sequence, Tuple
 import numpy as np
 
 
@@ -15,6 +16,8 @@ def calculate_ndcg(chunk_id, predictions):
     y_pred = np.linspace(1, 0, len(predictions)).tolist()
     y_true = [0 if item != chunk_id else 1 for item in predictions]
 
+    from sklearn.metrics import ndcg_score
+
     return ndcg_score([y_true], [y_pred])
 
 
@@ -27,3 +30,105 @@ def slice_predictions_decorator(num_elements: int):
         return wrapper
 
     return decorator
+
+
+SIZES = [3, 5, 10, 20]
+
+
+def gold_hits(
+    chunk_ids: Sequence[str], predictions: Sequence[Sequence[str]], k: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns a (queries x k) boolean matrix of which of the first `k`
+    predictions of every query are its gold chunk, and how many predictions
+    each query actually has within those `k`
+    """
+    lengths = np.fromiter(map(len, predictions), dtype=np.int64, count=len(predictions))
+    flat = np.array(list(chain.from_iterable(predictions)), dtype=object)
+    rows = np.repeat(np.arange(len(predictions)), lengths)
+    cols = np.arange(len(flat)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+
+    within = cols < k
+    rows, cols = rows[within], cols[within]
+    gold = np.array(chunk_ids, dtype=object)[rows]
+    hits = np.zeros((len(predictions), k), dtype=bool)
+    hits[rows, cols] = flat[within] == gold
+    return hits, np.minimum(lengths, k)
+
+
+def score_predictions(
+    chunk_ids: Sequence[str],
+    predictions: Sequence[Sequence[str]],
+    sizes: Sequence[int] = SIZES,
+) -> Dict[str, np.ndarray]:
+    """
+    Computes MRR, NDCG and recall at every cutoff in `sizes` for a
+    whole batch of queries at once, returning one array per metric.
+
+    Values match `calculate_mrr` and `calculate_ndcg`. NDCG is NaN where
+    they return "N/A", which is when a query has no predictions.
+    """
+    max_k = max(sizes)
+    hits, lengths = gold_hits(chunk_ids, predictions, max_k)
+    # Rank of the first gold prediction, or max_k when it was not retrieved
+    ranks = np.where(hits.any(axis=1), hits.argmax(axis=1), max_k)
+    discounts = 1 / np.log2(np.arange(max_k) + 2)
+    ideal = np.concatenate([[0.0], np.cumsum(discounts)])
+
+    columns = {}
+    for k in sizes:
+        found = ranks < k
+        columns[f"MRR@{k}"] = np.where(found, 1 / (ranks + 1), 0.0)
+
+    for k in sizes:
+        top = hits[:, :k]
+        num_relevant = top.sum(axis=1)
+        dcg = top @ discounts[:k]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ndcg = np.where(num_relevant > 0, dcg / ideal[num_relevant], 0.0)
+        size = np.minimum(lengths, k)
+        ndcg = np.where(size == 1, top[:, 0].astype(float), ndcg)
+        columns[f"NDCG@{k}"] = np.where(size == 0, np.nan, ndcg)
+
+    # Every question has a single gold chunk, so recall is also the hit rate
+    for k in sizes:
+        columns[f"Recall@{k}"] = (ranks < k).astype(float)
+
+    return columns
+
+
+class MetricAggregate:
+    """
+    Running sums of every metric column, so means can be reported without
+    keeping per-question results around. NaN values are left out of a
+    column's mean, as pandas does.
+    """
+
+    def __init__(self, sums: Dict[str, float] = None, counts: Dict[str, int] = None):
+        self.sums = dict(sums or {})
+        self.counts = dict(counts or {})
+
+    def update(self, columns: Dict[str, Sequence[float]]):
+        for name, values in columns.items():
+            values = np.asarray(values, dtype=float)
+            valid = ~np.isnan(values)
+            self.sums[name] = self.sums.get(name, 0.0) + float(values[valid].sum())
+            self.counts[name] = self.counts.get(name, 0) + int(valid.sum())
+
+    def merge(self, other: "MetricAggregate"):
+        for name, total in other.sums.items():
+            self.sums[name] = self.sums.get(name, 0.0) + total
+            self.counts[name] = self.counts.get(name, 0) + other.counts[name]
+
+    def means(self) -> Dict[str, float]:
+        return {
+            name: self.sums[name] / count if count else float("nan")
+            for name, count in self.counts.items()
+        }
+
+    def to_dict(self) -> dict:
+        return {"sums": self.sums, "counts": self.counts}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "MetricAggregate":
+        return cls(data.get("sums"), data.get("counts"))
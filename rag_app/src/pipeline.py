@@ -0,0 +1,109 @@
+from queue import Queue
+from threading import Thread
+from typing import Callable, Iterable, List, Optional
+from rag_app.models import Document
+from rag_app.src.chunking import batch_items, chunk_text
+from rag_app.src.profiling import span, timed
+
+_DONE = object()
+
+
+class TableWriter:
+    """
+    Drains batches from a bounded queue into a LanceDB table on a background
+    thread. `put` blocks once `max_pending` batches are queued, which keeps the
+    producer from reading files faster than the table (and its embedding
+    calls) can absorb them.
+    """
+
+    def __init__(self, table, max_pending: int = 4, stage: str = "write"):
+        self.table = table
+        self.stage = stage
+        self.queue: Queue = Queue(maxsize=max_pending)
+        self.error: Optional[BaseException] = None
+        self.rows_written = 0
+        self.thread = Thread(target=self._drain, daemon=True)
+        self.thread.start()
+
+    def _drain(self):
+        while True:
+            batch = self.queue.get()
+            if batch is _DONE:
+                return
+            # Keep draining after a failure so the producer never blocks forever
+            if self.error is not None:
+                continue
+            try:
+                with span(self.stage, rows=len(batch)):
+                    self.table.add(batch)
+                self.rows_written += len(batch)
+            except BaseException as e:
+                self.error = e
+
+    def put(self, batch: List):
+        if self.error is not None:
+            raise self.error
+        self.queue.put(batch)
+
+    def close(self) -> int:
+        self.queue.put(_DONE)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+        return self.rows_written
+
+
+def stream_documents(
+    documents: Iterable[Document],
+    table,
+    document_table,
+    batch_size: int = 20,
+    chunk_batch_size: int = 500,
+    max_pending: int = 4,
+    workers: int = 1,
+    chunker: str = "unstructured",
+    window_size: int = 1024,
+    overlap: int = 0,
+    on_chunks: Optional[Callable[[int], None]] = None,
+    filter_chunks: Optional[Callable[[Iterable[dict]], Iterable[dict]]] = None,
+) -> int:
+    """
+    Writes each document and its chunks to their tables in a single pass.
+    Only `max_pending` batches per table are ever held in memory at once.
+    Chunks are written (and therefore embedded) `chunk_batch_size` at a time,
+    after passing through `filter_chunks` when it is given.
+    """
+    chunk_writer = TableWriter(table, max_pending, "write_chunks")
+    document_writer = TableWriter(document_table, max_pending, "write_documents")
+
+    def written_documents():
+        for document_batch in batch_items(documents, batch_size):
+            document_writer.put(document_batch)
+            yield from document_batch
+
+    chunks = chunk_text(
+        written_documents(),
+        window_size=window_size,
+        overlap=overlap,
+        workers=workers,
+        chunker=chunker,
+    )
+    if filter_chunks is not None:
+        chunks = filter_chunks(chunks)
+
+    try:
+        # Includes waiting for the writers whenever their queues are full
+        for chunk_batch in timed(
+            batch_items(chunks, chunk_batch_size), "read_and_chunk"
+        ):
+            chunk_writer.put(chunk_batch)
+            if on_chunks is not None:
+                on_chunks(len(chunk_batch))
+    finally:
+        # Both writers are always joined, even when the first to close fails
+        try:
+            document_writer.close()
+        finally:
+            ttl = chunk_writer.close()
+
+    return ttl
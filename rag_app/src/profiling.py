@@ -0,0 +1,198 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+from threading import Lock
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, TypeVar
+import numpy as np
+from rich.console import Console
+from rich.table import Table
+
+T = TypeVar("T")
+
+# A stage name, its start and duration in nanoseconds, the process and lane
+# (thread or asyncio task) it ran in and any arguments it was recorded with
+Span = Tuple[str, int, int, int, int, dict]
+
+_NOOP = nullcontext()
+_DONE = object()
+_profiler: Optional["Profiler"] = None
+
+
+class Profiler:
+    """
+    Collects the spans recorded by every thread and asyncio task of the
+    process. Every task gets its own lane, so concurrent requests show up as
+    overlapping spans rather than being folded into their thread.
+    """
+
+    def __init__(self):
+        self.origin = time.perf_counter_ns()
+        self.spans: List[Span] = []
+        self.lane_names: Dict[Tuple[int, int], str] = {}
+        self._lanes: Dict[Tuple[str, int], int] = {}
+        self._lock = Lock()
+
+    def lane(self) -> int:
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            task = None
+        if task is not None:
+            key, name = ("task", id(task)), f"task {task.get_name()}"
+        else:
+            thread = threading.current_thread()
+            key, name = ("thread", thread.ident), f"thread {thread.name}"
+        lane = self._lanes.get(key)
+        if lane is None:
+            with self._lock:
+                lane = self._lanes.setdefault(key, len(self._lanes) + 1)
+                self.lane_names.setdefault((os.getpid(), lane), name)
+        return lane
+
+    def record(self, name: str, start: int, end: int, lane: int, args: dict):
+        self.spans.append((name, start, end - start, os.getpid(), lane, args))
+
+    def merge(self, spans: Iterable[Span], lane_names: Dict[Tuple[int, int], str]):
+        """
+        Adds the spans of a profiler from another process, whose
+        `perf_counter_ns` shares our clock
+        """
+        self.spans.extend(tuple(span) for span in spans)
+        self.lane_names.update(lane_names)
+
+    def stages(self) -> Dict[str, np.ndarray]:
+        durations = defaultdict(list)
+        for name, _, duration, *_ in self.spans:
+            durations[name].append(duration)
+        return {name: np.array(values) / 1e6 for name, values in durations.items()}
+
+    def print_summary(self, console: Optional[Console] = None):
+        table = Table(title="Profile")
+        table.add_column("Stage", style="cyan")
+        table.add_column("Count", style="magenta")
+        table.add_column("Total s", style="green")
+        table.add_column("p50 ms", style="green")
+        table.add_column("p95 ms", style="green")
+        stages = sorted(self.stages().items(), key=lambda item: -item[1].sum())
+        for name, durations in stages:
+            table.add_row(
+                name,
+                str(len(durations)),
+                f"{durations.sum() / 1000:.3f}",
+                f"{np.percentile(durations, 50):.2f}",
+                f"{np.percentile(durations, 95):.2f}",
+            )
+        (console or Console()).print(table)
+
+    def to_chrome_trace(self) -> dict:
+        """
+        The spans in the Chrome trace event format, which chrome://tracing and
+        https://ui.perfetto.dev open
+        """
+        events = [
+            {
+                "name": "thread_name",
+                "ph": "M",
+                "pid": pid,
+                "tid": lane,
+                "args": {"name": name},
+            }
+            for (pid, lane), name in self.lane_names.items()
+        ]
+        for name, start, duration, pid, lane, args in self.spans:
+            events.append(
+                {
+                    "name": name,
+                    "cat": "rag_app",
+                    "ph": "X",
+                    "ts": (start - self.origin) / 1000,
+                    "dur": duration / 1000,
+                    "pid": pid,
+                    "tid": lane,
+                    "args": args,
+                }
+            )
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write_trace(self, path: str):
+        Path(path).write_text(json.dumps(self.to_chrome_trace()))
+
+
+class _Span:
+    __slots__ = ("profiler", "name", "args", "lane", "start")
+
+    def __init__(self, profiler: Profiler, name: str, args: dict):
+        self.profiler = profiler
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.lane = self.profiler.lane()
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.record(
+            self.name, self.start, time.perf_counter_ns(), self.lane, self.args
+        )
+
+
+def span(name: str, **args):
+    """
+    Times a block as one occurrence of the stage `name`. When profiling is off
+    this returns a shared no-op context manager, so it costs next to nothing.
+    """
+    profiler = _profiler
+    if profiler is None:
+        return _NOOP
+    return _Span(profiler, name, args)
+
+
+def timed(items: Iterable[T], name: str) -> Iterable[T]:
+    """
+    Times how long producing every item of an iterable takes
+    """
+    if _profiler is None:
+        return items
+    return _timed(iter(items), name)
+
+
+def _timed(items: Iterator[T], name: str) -> Iterator[T]:
+    while True:
+        with span(name):
+            item = next(items, _DONE)
+        if item is _DONE:
+            return
+        yield item
+
+
+@contextmanager
+def profiling(
+    enabled: bool = True, trace_path: Optional[str] = None, summary: bool = True
+):
+    """
+    Records spans while the block runs, then prints the per-stage breakdown
+    and writes a Chrome trace to `trace_path` when one is given. Passing a
+    `trace_path` turns profiling on by itself.
+    """
+    global _profiler
+    if not (enabled or trace_path):
+        yield None
+        return
+
+    profiler = Profiler()
+    _profiler = profiler
+    try:
+        yield profiler
+    finally:
+        _profiler = None
+        if summary:
+            profiler.print_summary()
+        if trace_path:
+            profiler.write_trace(trace_path)
+            print(f"Wrote {len(profiler.spans)} spans to {trace_path}")
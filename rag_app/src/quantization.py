@@ -0,0 +1,274 @@
+from pathlib import Path
+from typing import List, Optional, Tuple
+import numpy as np
+from rag_app.src.exact_search import METRICS, VectorMatrix, merge_top_k
+
+QUANTIZATIONS = ["int8", "binary"]
+
+# The +1/-1 value of each of the 8 bits of every possible byte, most
+# significant bit first like np.packbits
+BIT_SIGNS = (
+    np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).astype(np.float32)
+    * 2
+    - 1
+)
+
+
+class QuantizedVectors:
+    """
+    Compact codes of every vector of a `VectorMatrix`, in the same order, which
+    are searched in two stages. A coarse pass over the codes alone shortlists
+    `rescore_factor * k` chunks per query, and only the shortlisted rows of the
+    float vectors are read to rank them by their exact distance.
+
+    Every code decodes to `center + scale * levels`:
+
+    - `int8` maps each dimension linearly from its range across chunks onto
+      the 256 levels of an int8, a quarter of the size of float32 vectors.
+    - `binary` keeps one bit per dimension, whether the value is above the
+      dimension's mean, and decodes it to the mean +/- its mean deviation. The
+      codes are a 32nd of the size of float32 vectors. Comparing the float
+      query with the +1/-1 bits is an asymmetric Hamming distance, which
+      ranks chunks better than comparing bits with bits.
+    """
+
+    def __init__(
+        self,
+        kind: str,
+        codes: np.ndarray,
+        center: np.ndarray,
+        scale: np.ndarray,
+        version: Optional[int] = None,
+        norms: Optional[np.ndarray] = None,
+    ):
+        if kind not in QUANTIZATIONS:
+            raise ValueError(
+                f"Invalid quantization {kind}. Only {', '.join(QUANTIZATIONS)} is supported at the moment"
+            )
+        self.kind = kind
+        self.codes = codes
+        self.center = center
+        self.scale = scale
+        self.version = version
+        # Squared norms of the decoded vectors
+        self.norms = self.decoded_norms() if norms is None else norms
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    @property
+    def dimensions(self) -> int:
+        return len(self.center)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(
+            array.nbytes for array in (self.codes, self.center, self.scale, self.norms)
+        )
+
+    @classmethod
+    def build(
+        cls, matrix: VectorMatrix, kind: str, block_size: int = 65536
+    ) -> "QuantizedVectors":
+        vectors = matrix.vectors
+        if kind == "int8":
+            low, high = vectors.min(axis=0), vectors.max(axis=0)
+            scale = np.maximum((high - low) / 255, np.finfo(np.float32).tiny)
+            center = low + 128 * scale
+        elif kind == "binary":
+            center = vectors.mean(axis=0)
+            deviations = sum(
+                np.abs(vectors[offset : offset + block_size] - center).sum(axis=0)
+                for offset in range(0, len(vectors), block_size)
+            )
+            scale = deviations / max(len(vectors), 1)
+        else:
+            raise ValueError(
+                f"Invalid quantization {kind}. Only {', '.join(QUANTIZATIONS)} is supported at the moment"
+            )
+        center = center.astype(np.float32)
+        scale = scale.astype(np.float32)
+
+        blocks = []
+        for offset in range(0, len(vectors), block_size):
+            block = vectors[offset : offset + block_size] - center
+            if kind == "int8":
+                blocks.append(
+                    np.clip(np.rint(block / scale), -128, 127).astype(np.int8)
+                )
+            else:
+                blocks.append(np.packbits(block > 0, axis=1))
+        width = vectors.shape[1] if kind == "int8" else -(-vectors.shape[1] // 8)
+        codes = (
+            np.concatenate(blocks)
+            if blocks
+            else np.empty((0, width), dtype=np.int8 if kind == "int8" else np.uint8)
+        )
+
+        return cls(kind, codes, center, scale, matrix.version)
+
+    def subset(self, rows: np.ndarray) -> "QuantizedVectors":
+        """
+        The codes at `rows` only, to search alongside `VectorMatrix.subset`
+        """
+        return QuantizedVectors(
+            self.kind,
+            self.codes[rows],
+            self.center,
+            self.scale,
+            self.version,
+            self.norms[rows],
+        )
+
+    def levels(self, start: int, end: int) -> np.ndarray:
+        """
+        Returns the levels of the codes of chunks `start` to `end` as float32
+        """
+        codes = self.codes[start:end]
+        if self.kind == "int8":
+            return codes.astype(np.float32)
+        return BIT_SIGNS[codes].reshape(len(codes), -1)[:, : self.dimensions]
+
+    def decode(self, start: int, end: int) -> np.ndarray:
+        return self.center + self.scale * self.levels(start, end)
+
+    def decoded_norms(self, block_size: int = 65536) -> np.ndarray:
+        norms = np.empty(len(self), dtype=np.float32)
+        for offset in range(0, len(self), block_size):
+            decoded = self.decode(offset, offset + block_size)
+            norms[offset : offset + len(decoded)] = np.einsum(
+                "ij,ij->i", decoded, decoded
+            )
+        return norms
+
+    def save(self, path: Path):
+        np.savez(
+            path,
+            kind=np.array(self.kind),
+            codes=self.codes,
+            center=self.center,
+            scale=self.scale,
+            norms=self.norms,
+            version=np.array(-1 if self.version is None else self.version),
+        )
+
+    @classmethod
+    def load(cls, path: Path) -> "QuantizedVectors":
+        with np.load(path) as data:
+            version = int(data["version"])
+            return cls(
+                str(data["kind"]),
+                data["codes"],
+                data["center"],
+                data["scale"],
+                None if version == -1 else version,
+                data["norms"],
+            )
+
+    def shortlist(
+        self,
+        queries: np.ndarray,
+        size: int,
+        metric: str = "L2",
+        chunk_block_size: int = 65536,
+    ) -> np.ndarray:
+        """
+        Returns the rows of the `size` nearest chunks to every query by their
+        decoded vectors, in no particular order
+        """
+        # Like exact search, terms which are the same for every chunk are
+        # dropped. The offset of the codes is folded into one term per query.
+        scaled = queries * self.scale
+        offsets = (queries @ self.center)[:, None]
+        best_ids = np.empty((len(queries), 0), dtype=np.int64)
+        best = np.empty((len(queries), 0), dtype=np.float32)
+        for offset in range(0, len(self), chunk_block_size):
+            levels = self.levels(offset, offset + chunk_block_size)
+            norms = self.norms[offset : offset + chunk_block_size]
+            distances = scaled @ levels.T
+            distances += offsets
+            if metric == "L2":
+                distances *= -2
+                distances += norms
+            else:
+                distances /= -np.sqrt(np.maximum(norms, np.finfo(np.float32).tiny))
+            best, best_ids = merge_top_k(best, best_ids, distances, offset, size)
+        return best_ids
+
+    def search(
+        self,
+        queries: np.ndarray,
+        matrix: VectorMatrix,
+        k: int = 25,
+        metric: str = "L2",
+        rescore_factor: int = 4,
+        query_block_size: int = 256,
+        chunk_block_size: int = 65536,
+    ) -> Tuple[List[List[str]], np.ndarray]:
+        """
+        Returns the ids and exact distances of the `k` nearest chunks to every
+        query among the `rescore_factor * k` nearest by the coarse pass,
+        nearest first. `matrix` holds the float vectors the codes were built
+        from and is only read at the shortlisted rows.
+        """
+        if metric not in METRICS:
+            raise ValueError(
+                f"Invalid metric {metric}. Only {', '.join(METRICS)} is supported at the moment"
+            )
+        assert len(matrix.chunk_ids) == len(
+            self
+        ), "The quantized codes were built from a different version of the vectors"
+        queries = np.ascontiguousarray(queries, dtype=np.float32)
+        k = min(k, len(self))
+        if k == 0:
+            return [[] for _ in queries], np.empty((len(queries), 0), dtype=np.float32)
+        if metric == "cosine":
+            queries = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+        size = min(max(rescore_factor, 1) * k, len(self))
+
+        ids = np.empty((len(queries), k), dtype=np.int64)
+        distances = np.empty((len(queries), k), dtype=np.float32)
+        for start in range(0, len(queries), query_block_size):
+            block = queries[start : start + query_block_size]
+            rows = self.shortlist(block, size, metric, chunk_block_size)
+            # Reading the shortlisted rows in order keeps reads of a
+            # memory-mapped matrix sequential
+            unique, inverse = np.unique(rows, return_inverse=True)
+            candidates = np.asarray(matrix.vectors[unique], dtype=np.float32)[
+                inverse.reshape(rows.shape)
+            ]
+            if metric == "L2":
+                exact = ((candidates - block[:, None, :]) ** 2).sum(axis=2)
+            else:
+                exact = 1 - np.einsum("qsd,qd->qs", candidates, block) / (
+                    np.linalg.norm(candidates, axis=2)
+                )
+            order = np.argsort(exact, axis=1, kind="stable")[:, :k]
+            distances[start : start + len(block)] = np.take_along_axis(
+                exact, order, axis=1
+            )
+            ids[start : start + len(block)] = np.take_along_axis(rows, order, axis=1)
+
+        return [[matrix.chunk_ids[idx] for idx in row] for row in ids], distances
+
+
+def quantized_path(db_path: str, table_name: str, kind: str) -> Path:
+    return Path(db_path) / f"{table_name}.{kind}.npz"
+
+
+def load_quantized_vectors(
+    db_path: str, table_name: str, table, matrix: VectorMatrix, kind: str
+) -> QuantizedVectors:
+    """
+    Loads the persisted codes of a table, rebuilding them from `matrix`
+    whenever the table has been written to since they were built
+    """
+    path = quantized_path(db_path, table_name, kind)
+    if path.exists():
+        quantized = QuantizedVectors.load(path)
+        if quantized.version == table.version:
+            return quantized
+
+    quantized = QuantizedVectors.build(matrix, kind)
+    quantized.save(path)
+    return quantized
@@ -0,0 +1,17 @@
+from functools import lru_cache
+from typing import List
+
+
+@lru_cache(maxsize=1)
+def get_encoding(name: str = "cl100k_base"):
+    import tiktoken
+
+    return tiktoken.get_encoding(name)
+
+
+def count_tokens(texts: List[str]) -> List[int]:
+    """
+    Counts tokens with the `cl100k_base` encoding used by the
+    text-embedding-3 models
+    """
+    return [len(tokens) for tokens in get_encoding().encode_ordinary_batch(texts)]
@@ -0,0 +1,15 @@
+import pytest
+
+
+def count_words(texts):
+    return [len(text.split()) for text in texts]
+
+
+@pytest.fixture
+def offline_tokens(monkeypatch):
+    """
+    Counts tokens as words when chunking and packing embedding requests, so
+    tests never need tiktoken's encoding files
+    """
+    monkeypatch.setattr("rag_app.src.chunking.count_tokens", count_words)
+    monkeypatch.setattr("rag_app.src.embeddings.count_tokens", count_words)
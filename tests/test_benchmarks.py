@@ -0,0 +1,86 @@
+import json
+import socket
+import numpy as np
+import pytest
+from typer.testing import CliRunner
+from benchmarks.corpus import SyntheticCorpus
+from benchmarks.stubs import HashingEmbedder, extract_keywords, offline
+from benchmarks.suite import app
+from rag_app.models import KeywordExtractionResponse
+from rag_app.src.chunking import chunk_text, read_files
+
+
+@pytest.fixture
+def no_network(monkeypatch):
+    def connect(*args, **kwargs):
+        raise AssertionError("The benchmarks tried to use the network")
+
+    monkeypatch.setattr(socket.socket, "connect", connect)
+
+
+def test_corpus_is_deterministic_with_one_chunk_per_paragraph(tmp_path, no_network):
+    assert SyntheticCorpus().write(tmp_path / "a", 45) == 3
+    SyntheticCorpus().write(tmp_path / "b", 45)
+    assert [file.read_text() for file in sorted((tmp_path / "a").iterdir())] == [
+        file.read_text() for file in sorted((tmp_path / "b").iterdir())
+    ]
+
+    with offline():
+        chunks = list(
+            chunk_text(
+                read_files(tmp_path / "a", ".md"), window_size=128, chunker="window"
+            )
+        )
+    assert len(chunks) == 45
+    assert chunks[0]["total_chunks"] == 20 and chunks[-1]["total_chunks"] == 5
+
+
+def test_stub_embeddings_and_keywords():
+    embedder = HashingEmbedder(dimensions=32)
+    a, b, c, empty = embedder.embed(
+        ["lorem ipsum dolor sit", "Lorem ipsum dolor amet", "completely different", ""]
+    )
+    assert np.allclose(
+        a, HashingEmbedder(dimensions=32).embed(["lorem ipsum dolor sit"])
+    )
+    assert a @ b > a @ c
+    assert np.linalg.norm(a) == pytest.approx(1) and not empty.any()
+
+    keywords = extract_keywords("The question is what does the essay say about foo?")
+    assert keywords == ["foo"] * 8
+    KeywordExtractionResponse(keywords=extract_keywords("about foo bar baz"))
+
+
+def test_run_writes_comparable_results_offline(tmp_path, no_network):
+    output = tmp_path / "results.json"
+    args = ["run", "--chunks", "120", "--questions", "5", "--work-dir", str(tmp_path)]
+    for mode in ["semantic", "fts", "bm25-fast"]:
+        args += ["--eval-mode", mode]
+    result = CliRunner().invoke(app, args + ["--output-path", str(output)])
+    assert result.exit_code == 0, result.output
+
+    report = json.loads(output.read_text())
+    assert [row["benchmark"] for row in report["results"]] == [
+        "generate_corpus",
+        "chunk_text",
+        "ingest",
+        "embed",
+        "query_db",
+        "query_filtered",
+        "evaluate_semantic",
+        "evaluate_fts",
+        "evaluate_bm25-fast",
+        "score",
+    ]
+    assert all(
+        "error" not in row and row["per_second"] > 0 for row in report["results"]
+    )
+    assert report["results"][2]["items"] == 120
+
+    slower = tmp_path / "slower.json"
+    for row in report["results"]:
+        row["per_second"] /= 2
+    slower.write_text(json.dumps(report))
+    compare = ["compare", "--baseline-path", str(output), "--current-path"]
+    assert CliRunner().invoke(app, compare + [str(output)]).exit_code == 0
+    assert CliRunner().invoke(app, compare + [str(slower)]).exit_code == 1
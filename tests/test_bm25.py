@@ -0,0 +1,50 @@
+import math
+import pytest
+from rag_app.src.bm25 import BM25Index
+
+CHUNKS = [
+    ("a", "the cat sat on the mat"),
+    ("b", "the dog chased the cat around the yard"),
+    ("c", "a bird sang"),
+    ("d", "dogs and cats living together, the end"),
+]
+
+
+def naive_bm25(question, k1=1.2, b=0.75):
+    docs = [text.split() for _, text in CHUNKS]
+    avg_length = sum(len(doc) for doc in docs) / len(docs)
+    scores = {}
+    for (chunk_id, _), doc in zip(CHUNKS, docs):
+        score = 0.0
+        for term in set(question.split()):
+            tf = doc.count(term)
+            if not tf:
+                continue
+            df = sum(term in other for other in docs)
+            idf = math.log(1 + (len(docs) - df + 0.5) / (df + 0.5))
+            score += (
+                idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * len(doc) / avg_length))
+            )
+        if score:
+            scores[chunk_id] = score
+    return sorted(scores.items(), key=lambda item: -item[1])
+
+
+@pytest.fixture
+def index():
+    return BM25Index.build(CHUNKS)
+
+
+@pytest.mark.parametrize("question", ["cat", "the cat", "dog yard", "cat cat mat"])
+def test_search_matches_naive_bm25(index, question):
+    [results] = index.search([question])
+    expected = naive_bm25(question)
+    assert [chunk_id for chunk_id, _ in results] == [c for c, _ in expected]
+    for (_, score), (_, expected_score) in zip(results, expected):
+        assert score == pytest.approx(expected_score, rel=1e-5)
+
+
+def test_search_batches_and_limits(index):
+    results = index.search(["the", "bird", "unknown words"], k=2, batch_size=2)
+    assert [len(result) for result in results] == [2, 1, 0]
+    assert results[1][0][0] == "c"
@@ -0,0 +1,103 @@
+import pytest
+from rag_app.models import Document, DocumentMetadata
+from rag_app.src.chunking import (
+    batch_items,
+    chunk_documents,
+    list_files,
+    window_spans,
+)
+
+
+def test_batch_items():
+    assert list(batch_items(range(5), batch_size=2)) == [[0, 1], [2, 3], [4]]
+
+
+def test_list_files_recursive(tmp_path):
+    (tmp_path / "nested").mkdir()
+    (tmp_path / "a.md").write_text("a")
+    (tmp_path / "nested" / "b.md").write_text("b")
+    (tmp_path / "nested" / "c.txt").write_text("c")
+
+    assert list(list_files(tmp_path, ".md")) == [tmp_path / "a.md"]
+    assert list(list_files(tmp_path, ".md", recursive=True)) == [
+        tmp_path / "a.md",
+        tmp_path / "nested" / "b.md",
+    ]
+
+
+def test_window_spans_respect_budget_and_offsets(offline_tokens):
+    text = "One two three. Four five six.\n\nSeven eight. Nine ten eleven twelve."
+    spans = window_spans(text, window_size=6)
+
+    assert [text[start:end] for start, end in spans] == [
+        "One two three. Four five six.",
+        "Seven eight. Nine ten eleven twelve.",
+    ]
+    assert all(len(text[start:end].split()) <= 6 for start, end in spans)
+
+
+def test_window_spans_overlap_repeats_trailing_sentences(offline_tokens):
+    text = "A b. C d. E f. G h."
+    spans = window_spans(text, window_size=4, overlap=2)
+
+    assert [text[start:end] for start, end in spans] == [
+        "A b. C d.",
+        "C d. E f.",
+        "E f. G h.",
+    ]
+
+
+def test_window_spans_split_long_sentences_on_words(offline_tokens):
+    text = "one two three four five six seven"
+    spans = window_spans(text, window_size=3)
+
+    assert [text[start:end] for start, end in spans] == [
+        "one two three",
+        "four five six",
+        "seven",
+    ]
+
+
+def test_window_spans_rejects_overlap_larger_than_window(offline_tokens):
+    with pytest.raises(ValueError):
+        window_spans("Some text.", window_size=4, overlap=4)
+
+
+def make_document(i: int) -> Document:
+    paragraphs = [
+        f"Essay {i} paragraph {p}. It has a second sentence about startups."
+        for p in range(i + 1)
+    ]
+    return Document(
+        id=f"doc-{i}",
+        content="\n\n".join(paragraphs),
+        filename=f"post-{i}.md",
+        metadata=DocumentMetadata(
+            date="2024-10", url=f"https://example.com/{i}", title=f"Post {i}"
+        ),
+    )
+
+
+def test_chunk_documents_in_parallel_matches_serial(offline_tokens):
+    # Worker processes are forked, so they count tokens with the stub too
+    documents = [make_document(i) for i in range(9)]
+    serial = list(chunk_documents(documents, 12, chunker="window"))
+
+    read, in_flight = [], []
+
+    def reading():
+        for document in documents:
+            read.append(document)
+            yield document
+
+    parallel = []
+    for document, chunks in chunk_documents(reading(), 12, workers=2, chunker="window"):
+        in_flight.append(len(read) - len(parallel))
+        parallel.append((document, chunks))
+
+    assert [document.id for document, _ in parallel] == [
+        document.id for document in documents
+    ]
+    assert parallel == serial
+    assert sum(len(chunks) for _, chunks in serial) > len(documents)
+    assert max(in_flight) == 2 * 2
@@ -0,0 +1,72 @@
+import json
+import re
+import subprocess
+import sys
+import pytest
+
+HEAVY_MODULES = [
+    "lancedb",
+    "openai",
+    "torch",
+    "unstructured",
+    "nltk",
+    "sklearn",
+    "scipy",
+    "duckdb",
+    "instructor",
+]
+# Never needed before a command starts running
+NEVER_AT_STARTUP = ["torch", "unstructured", "nltk", "sklearn"]
+
+# Modules a command may never import just to start up. Commands which only
+# embed through a table's embedding function import openai once they call it.
+FORBIDDEN = {
+    ("--help",): HEAVY_MODULES,
+    ("query", "--help"): NEVER_AT_STARTUP + ["openai", "scipy", "instructor"],
+    ("ingest", "--help"): NEVER_AT_STARTUP + ["openai", "scipy", "instructor"],
+    ("generate", "--help"): NEVER_AT_STARTUP + ["scipy"],
+    ("evaluate", "--help"): NEVER_AT_STARTUP,
+    ("index", "--help"): NEVER_AT_STARTUP + ["openai", "scipy", "instructor"],
+    ("cache", "--help"): NEVER_AT_STARTUP
+    + ["lancedb", "openai", "scipy", "instructor"],
+    ("serve", "--help"): NEVER_AT_STARTUP + ["openai", "scipy", "instructor"],
+}
+
+RUN_COMMAND = """
+import json, sys
+import typer
+from rag_app.cli import app
+
+try:
+    typer.main.get_command(app)(sys.argv[1:], standalone_mode=False)
+except SystemExit:
+    pass
+print(json.dumps(sorted(m.split(".")[0] for m in sys.modules)))
+"""
+
+
+def imported_modules(*args: str) -> set:
+    output = subprocess.run(
+        [sys.executable, "-c", RUN_COMMAND, *args],
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return set(json.loads(output.splitlines()[-1]))
+
+
+@pytest.mark.parametrize("args", list(FORBIDDEN))
+def test_commands_only_import_what_they_use(args):
+    assert imported_modules(*args).isdisjoint(FORBIDDEN[args]), args
+
+
+def test_cli_import_time():
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import rag_app.cli"],
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stderr
+    cumulative = re.search(r"\|\s*(\d+) \| rag_app\.cli$", stderr, re.MULTILINE)
+    # Importing every subcommand eagerly took several seconds
+    assert int(cumulative.group(1)) < 1_000_000
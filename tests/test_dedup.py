@@ -0,0 +1,130 @@
+import random
+import numpy as np
+import pytest
+from lancedb import connect
+from rag_app.src.chunking import generate_string_hash
+from rag_app.src.dedup import (
+    ChunkDeduplicator,
+    DuplicateIndex,
+    MinHasher,
+    duplicate_index_path,
+    load_duplicate_index,
+    lsh_rows_per_band,
+)
+
+random.seed(0)
+WORDS = [f"word{idx}" for idx in range(2000)]
+ESSAY = " ".join(random.choices(WORDS, k=200))
+OTHER = " ".join(random.choices(WORDS, k=200))
+
+
+def edit(text: str, count: int) -> str:
+    tokens = text.split()
+    for idx in range(count):
+        tokens[idx * 10] = f"edited{idx}"
+    return " ".join(tokens)
+
+
+def make_chunk(doc_id: str, text: str) -> dict:
+    return {"chunk_id": generate_string_hash(text), "doc_id": doc_id, "text": text}
+
+
+def jaccard(a: str, b: str, size: int = 5) -> float:
+    def shingles(text):
+        tokens = text.split()
+        return {tuple(tokens[i : i + size]) for i in range(len(tokens) - size + 1)}
+
+    a, b = shingles(a), shingles(b)
+    return len(a & b) / len(a | b)
+
+
+@pytest.fixture
+def hasher():
+    return MinHasher()
+
+
+def test_signatures_estimate_jaccard_similarity(hasher):
+    texts = [ESSAY, edit(ESSAY, 2), edit(ESSAY, 8), OTHER]
+    signatures = hasher.signatures(texts)
+
+    assert signatures.shape == (4, 128)
+    for text, signature in zip(texts, signatures):
+        estimate = (signature == signatures[0]).mean()
+        assert estimate == pytest.approx(jaccard(ESSAY, text), abs=0.1)
+    assert (hasher.signature(ESSAY) == signatures[0]).all()
+
+
+def test_signatures_ignore_case_and_punctuation(hasher):
+    assert (
+        hasher.signature("Thanks for reading!")
+        == hasher.signature("thanks, FOR reading")
+    ).all()
+    assert (hasher.signature("") == np.iinfo(np.uint32).max).all()
+
+
+def test_lsh_rows_per_band_keeps_recall_at_threshold():
+    assert lsh_rows_per_band(128, 0.85) == 8
+    assert lsh_rows_per_band(128, 0.5) == 2
+    assert lsh_rows_per_band(128, 0.95) > lsh_rows_per_band(128, 0.85)
+
+
+def test_index_matches_exact_and_near_duplicates(hasher):
+    index = DuplicateIndex([], [], np.empty((0, 128), dtype=np.uint32))
+    index.add("essay", "a", hasher.signature(ESSAY))
+
+    assert index.match("essay", hasher.signature(ESSAY)) == ("essay", 1.0)
+    canonical_id, similarity = index.match("edited", hasher.signature(edit(ESSAY, 2)))
+    assert canonical_id == "essay" and similarity >= 0.85
+    assert index.match("other", hasher.signature(OTHER)) is None
+    assert index.match("empty", hasher.signature("")) is None
+
+    assert index.remove_documents(["a"]) == {"essay"}
+    assert index.match("essay", hasher.signature(ESSAY)) is None
+    assert len(index) == 0
+
+    # A document re-added after an edit can be removed again
+    index.add("other", "a", hasher.signature(OTHER))
+    assert index.remove_documents(["a", "missing"]) == {"other"}
+    assert index.remove_documents(["a"]) == set()
+
+
+def test_deduplicator_keeps_one_chunk_per_duplicate_set():
+    deduplicator = ChunkDeduplicator(
+        DuplicateIndex([], [], np.empty((0, 128), dtype=np.uint32)), batch_size=2
+    )
+    chunks = [
+        make_chunk("a", ESSAY),
+        make_chunk("a", OTHER),
+        make_chunk("b", ESSAY),
+        make_chunk("c", edit(ESSAY, 2)),
+    ]
+    duplicates = []
+    kept = list(deduplicator.filter(chunks, duplicates.extend))
+
+    assert kept == chunks[:2]
+    assert [(row["doc_id"], row["canonical_id"]) for row in duplicates] == [
+        ("b", chunks[0]["chunk_id"]),
+        ("c", chunks[0]["chunk_id"]),
+    ]
+    assert (deduplicator.kept, deduplicator.exact, deduplicator.near) == (2, 1, 1)
+    assert "2 duplicate chunks (1 exact, 1 near duplicates)" in deduplicator.summary(
+        1024
+    )
+
+
+def test_load_rebuilds_stale_index(tmp_path, hasher):
+    db = connect(tmp_path / "db")
+    table = db.create_table("pg", data=[make_chunk("a", ESSAY), make_chunk("b", OTHER)])
+    path = duplicate_index_path(tmp_path / "db", "pg")
+
+    index = load_duplicate_index(tmp_path / "db", "pg", table)
+    assert index.version == table.version
+    index.save(path)
+    loaded = load_duplicate_index(tmp_path / "db", "pg", table)
+    assert loaded.chunk_ids == index.chunk_ids
+    assert loaded.match("x", hasher.signature(edit(OTHER, 2)))[0] == (
+        generate_string_hash(OTHER)
+    )
+
+    table.add([make_chunk("c", edit(ESSAY, 8))])
+    assert len(load_duplicate_index(tmp_path / "db", "pg", table)) == 3
@@ -0,0 +1,231 @@
+import asyncio
+import json
+import pytest
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+from lancedb import connect
+from lancedb.embeddings import OpenAIEmbeddings
+from lancedb.pydantic import LanceModel, Vector
+from openai import AsyncOpenAI
+from rag_app.src.embeddings import (
+    EMBEDDING_DIMENSIONS,
+    EMBEDDING_MODEL,
+    CachedOpenAIEmbeddings,
+    EmbeddingBatcher,
+    EmbeddingCache,
+    embed_for_table,
+    get_embedding_cache,
+)
+
+
+def test_embedding_cache_round_trip(tmp_path):
+    cache = EmbeddingCache(tmp_path / "cache.sqlite")
+    cache.put_many("model", 2, ["a", "b"], [[1.0, 2.0], [3.0, 4.0]])
+
+    assert cache.get_many("model", 2, ["a", "c", "b"]) == [
+        [1.0, 2.0],
+        None,
+        [3.0, 4.0],
+    ]
+    assert (cache.hits, cache.misses) == (2, 1)
+
+
+def test_embedding_cache_is_keyed_by_model_and_dimensions(tmp_path):
+    cache = EmbeddingCache(tmp_path / "cache.sqlite")
+    cache.put_many("model", 2, ["a"], [[1.0, 2.0]])
+
+    assert cache.get_many("model", 3, ["a"]) == [None]
+    assert cache.get_many("other-model", 2, ["a"]) == [None]
+
+
+def test_embedding_cache_evicts_least_recently_used(tmp_path):
+    cache = EmbeddingCache(tmp_path / "cache.sqlite", max_entries=2)
+    cache.put_many("model", 1, ["a"], [[1.0]])
+    cache.put_many("model", 1, ["b"], [[2.0]])
+    cache.get_many("model", 1, ["a"])
+    cache.put_many("model", 1, ["c"], [[3.0]])
+
+    assert len(cache) == 2
+    assert cache.get_many("model", 1, ["a", "b", "c"]) == [[1.0], None, [3.0]]
+
+
+def test_embedding_cache_counts_entries_across_puts_and_reopens(tmp_path):
+    cache = EmbeddingCache(tmp_path / "cache.sqlite", max_entries=2)
+    cache.put_many("model", 1, ["a", "a"], [[1.0], [1.0]])
+    cache.put_many("model", 1, ["a", "b"], [[1.0], [2.0]])
+    assert cache.get_many("model", 1, ["a", "b"]) == [[1.0], [2.0]]
+
+    reopened = EmbeddingCache(tmp_path / "cache.sqlite", max_entries=2)
+    reopened.put_many("model", 1, ["c"], [[3.0]])
+    assert len(reopened) == 2
+    assert reopened.get_many("model", 1, ["a", "b", "c"]) == [None, [2.0], [3.0]]
+
+
+def fill_cache(path, shard):
+    cache = EmbeddingCache(path)
+    for i in range(100):
+        cache.put_many("model", 1, [f"{shard}-{i}"], [[float(i)]])
+    return len(cache.get_many("model", 1, [f"{shard}-{i}" for i in range(100)]))
+
+
+def test_embedding_cache_takes_writes_from_several_processes(tmp_path):
+    path = tmp_path / "cache.sqlite"
+    with ProcessPoolExecutor(max_workers=4) as pool:
+        assert list(pool.map(fill_cache, [path] * 4, range(4))) == [100] * 4
+
+    cache = EmbeddingCache(path)
+    assert len(cache) == 400
+    assert cache.conn.execute("PRAGMA journal_mode").fetchone() == ("wal",)
+
+
+def test_embedding_cache_can_be_disabled(tmp_path):
+    cache = EmbeddingCache(tmp_path / "cache.sqlite", max_entries=0)
+    cache.put_many("model", 1, ["a"], [[1.0]])
+
+    assert cache.get_many("model", 1, ["a"]) == [None]
+    assert not (tmp_path / "cache.sqlite").exists()
+
+
+class StubEmbeddingHandler(BaseHTTPRequestHandler):
+    """
+    Embeds each input as [number of words, index] and fails the first
+    `failures` requests with a 429
+    """
+
+    inputs = []
+    failures = 0
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        cls = type(self)
+        if cls.failures > 0:
+            cls.failures -= 1
+            self.send_json(
+                429, {"error": {"message": "Slow down"}}, {"Retry-After": "0"}
+            )
+            return
+
+        cls.inputs.append(body["input"])
+        self.send_json(
+            200,
+            {
+                "object": "list",
+                "model": body["model"],
+                "data": [
+                    {
+                        "object": "embedding",
+                        "index": i,
+                        "embedding": [float(len(text.split())), float(i)],
+                    }
+                    for i, text in enumerate(body["input"])
+                ],
+                "usage": {"prompt_tokens": 0, "total_tokens": 0},
+            },
+        )
+
+    def send_json(self, status, payload, headers={}):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_client():
+    StubEmbeddingHandler.inputs = []
+    StubEmbeddingHandler.failures = 0
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubEmbeddingHandler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    yield AsyncOpenAI(
+        base_url=f"http://127.0.0.1:{server.server_port}/v1", api_key="test"
+    )
+    server.shutdown()
+
+
+def test_batcher_packs_requests_by_token_budget(stub_client, offline_tokens):
+    batcher = EmbeddingBatcher(stub_client, max_tokens_per_request=3)
+    embeddings = asyncio.run(batcher.embed(["a b", "c", "a b", "d e f"]))
+
+    assert [embedding[0] for embedding in embeddings] == [2.0, 1.0, 2.0, 3.0]
+    # Requests are sent concurrently, so they may arrive in either order
+    assert sorted(StubEmbeddingHandler.inputs) == [["a b", "c"], ["d e f"]]
+    assert batcher.deduplicated == 1
+
+
+def test_batcher_deduplicates_across_concurrent_calls(stub_client, offline_tokens):
+    batcher = EmbeddingBatcher(stub_client)
+
+    async def embed_concurrently():
+        return await asyncio.gather(
+            batcher.embed(["x", "y"]), batcher.embed(["y", "z"])
+        )
+
+    first, second = asyncio.run(embed_concurrently())
+    assert first[1] == second[0]
+    sent = [text for request in StubEmbeddingHandler.inputs for text in request]
+    assert sorted(sent) == ["x", "y", "z"]
+
+
+def test_batcher_retries_after_rate_limit(stub_client, offline_tokens):
+    StubEmbeddingHandler.failures = 2
+    batcher = EmbeddingBatcher(stub_client)
+
+    assert asyncio.run(batcher.embed(["hello world"])) == [[2.0, 0.0]]
+    assert batcher.retries == 2
+    assert batcher.backoff.error_rate == 2 / 3
+
+
+def test_batcher_skips_cached_texts(stub_client, tmp_path, offline_tokens):
+    cache = EmbeddingCache(tmp_path / "cache.sqlite")
+    cache.put_many(EMBEDDING_MODEL, EMBEDDING_DIMENSIONS, ["cached"], [[9.0, 9.0]])
+    batcher = EmbeddingBatcher(stub_client, cache=cache)
+
+    assert asyncio.run(batcher.embed(["cached", "fresh"])) == [[9.0, 9.0], [1.0, 0.0]]
+    assert StubEmbeddingHandler.inputs == [["fresh"]]
+    assert cache.get_many(EMBEDDING_MODEL, EMBEDDING_DIMENSIONS, ["fresh"]) == [
+        [1.0, 0.0]
+    ]
+
+
+def test_legacy_openai_tables_embed_through_the_cache(
+    stub_client, tmp_path, monkeypatch, offline_tokens
+):
+    monkeypatch.setenv("RAG_APP_EMBEDDING_CACHE", str(tmp_path / "cache.sqlite"))
+    get_embedding_cache.cache_clear()
+    # LanceDB's own function, as recorded by tables created before the cache
+    function = OpenAIEmbeddings.create(
+        name="text-embedding-3-small",
+        dim=2,
+        base_url=str(stub_client.base_url),
+        api_key="test",
+    )
+
+    class Legacy(LanceModel):
+        text: str = function.SourceField()
+        vector: Vector(2) = function.VectorField()
+
+    db = connect(tmp_path / "db")
+    db.create_table("chunks", schema=Legacy)
+    table = db.open_table("chunks")
+    assert isinstance(
+        table.embedding_functions["vector"].function, CachedOpenAIEmbeddings
+    )
+
+    table.add([{"text": "a b"}, {"text": "c"}])
+    table.add([{"text": "c"}])
+    assert StubEmbeddingHandler.inputs == [["a b", "c"]]
+    assert get_embedding_cache().hits == 1
+    assert embed_for_table(table, ["a b"]) == [[2.0, 0.0]]
+    assert len(StubEmbeddingHandler.inputs) == 1
+
+    metadata = json.loads(table.schema.metadata[b"embedding_functions"])
+    assert metadata[0]["name"] == "openai"
+    get_embedding_cache.cache_clear()
@@ -0,0 +1,226 @@
+import json
+import lancedb
+import pytest
+from datetime import datetime
+from typer.testing import CliRunner
+from rag_app import evaluate
+from rag_app.evaluate import (
+    FullTextSearchEvaluationItem,
+    Retriever,
+    app,
+    read_evaluation_items,
+)
+from rag_app.ingest import open_chunk_table
+
+WORDS = ["alpha", "beta", "gamma", "delta", "epsilon", "zeta", "eta", "theta"]
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    db = lancedb.connect(tmp_path / "db")
+    db.create_table(
+        "chunks",
+        [
+            {"chunk_id": f"c{i}", "text": f"{WORDS[i % 8]} {WORDS[(i * 3) % 8]} {i}"}
+            for i in range(40)
+        ],
+    )
+    return str(tmp_path / "db")
+
+
+@pytest.fixture
+def embedded_db_path(tmp_path):
+    # Text searches of a table with an embedding function default to vectors
+    table = open_chunk_table(
+        lancedb.connect(tmp_path / "embedded"), "chunks", provider="local"
+    )
+    table.add(
+        [
+            {
+                "chunk_id": f"c{i}",
+                "doc_id": "doc",
+                "text": f"{WORDS[i % 8]} {WORDS[(i * 3) % 8]} {i}",
+                "post_title": "Title",
+                "publish_date": datetime(2024, 1, 1),
+                "chunk_number": i,
+                "total_chunks": 40,
+                "source": "https://example.com",
+            }
+            for i in range(40)
+        ]
+    )
+    return str(tmp_path / "embedded")
+
+
+@pytest.fixture
+def input_file_path(tmp_path):
+    path = tmp_path / "questions.jsonl"
+    with open(path, "w") as file:
+        for i in range(25):
+            item = {
+                "question": f"{WORDS[i % 8]} {WORDS[(i + 1) % 8]}",
+                "answer": "",
+                "chunk": "",
+                "chunk_id": f"c{i}",
+            }
+            file.write(json.dumps(item) + "\n")
+    return str(path)
+
+
+def run(db_path, input_file_path, output_file_path, *args):
+    return CliRunner().invoke(
+        app,
+        [
+            "--input-file-path",
+            input_file_path,
+            "--db-path",
+            db_path,
+            "--table-name",
+            "chunks",
+            "--eval-mode",
+            "bm25-fast",
+            "--batch-size",
+            "4",
+            "--output-file-path",
+            output_file_path,
+            *args,
+        ],
+    )
+
+
+def test_resume_after_interruption(db_path, input_file_path, tmp_path, monkeypatch):
+    complete = tmp_path / "complete.jsonl"
+    result = run(db_path, input_file_path, str(complete))
+    assert result.exit_code == 0, result.output
+
+    retrieve = Retriever.retrieve
+    calls = []
+
+    def crash_on_third_batch(self, items):
+        calls.append(len(items))
+        if len(calls) == 3:
+            raise KeyboardInterrupt
+        return retrieve(self, items)
+
+    interrupted = tmp_path / "interrupted.jsonl"
+    monkeypatch.setattr(Retriever, "retrieve", crash_on_third_batch)
+    run(db_path, input_file_path, str(interrupted))
+    checkpoint = json.loads(interrupted.with_suffix(".checkpoint.json").read_text())
+    assert checkpoint["processed"] == 8
+
+    monkeypatch.setattr(Retriever, "retrieve", retrieve)
+    result = run(db_path, input_file_path, str(interrupted), "--resume")
+    assert result.exit_code == 0, result.output
+    assert "Resuming after 8 questions" in result.output
+    assert interrupted.read_text() == complete.read_text()
+
+    complete_aggregate = json.loads(
+        complete.with_suffix(".checkpoint.json").read_text()
+    )["aggregate"]
+    resumed_aggregate = json.loads(
+        interrupted.with_suffix(".checkpoint.json").read_text()
+    )["aggregate"]
+    assert resumed_aggregate["counts"] == complete_aggregate["counts"]
+    assert resumed_aggregate["sums"] == pytest.approx(complete_aggregate["sums"])
+
+
+def test_output_rows(db_path, input_file_path, tmp_path):
+    output = tmp_path / "results.jsonl"
+    result = run(db_path, input_file_path, str(output))
+    assert result.exit_code == 0, result.output
+
+    rows = [json.loads(line) for line in output.read_text().splitlines()]
+    assert len(rows) == 25
+    assert rows[0]["chunk_id"] == "c0"
+    assert len(rows[0]["retrieved"]) == rows[0]["retrieved_size"]
+    assert 0 <= rows[0]["MRR@3"] <= 1
+
+
+def test_sharded_run_matches_single_process(db_path, input_file_path, tmp_path):
+    single = run(db_path, input_file_path, str(tmp_path / "single.jsonl"))
+    sharded = run(
+        db_path, input_file_path, str(tmp_path / "sharded.jsonl"), "--workers", "3"
+    )
+    assert sharded.exit_code == 0, sharded.output
+
+    def mean_values(output):
+        return output[output.index("Mean Values") :]
+
+    assert mean_values(sharded.output) == mean_values(single.output)
+    assert "Shards" in sharded.output
+
+    shards = [tmp_path / f"sharded.shard-{shard}.jsonl" for shard in range(3)]
+    rows = [
+        json.loads(line) for path in shards for line in path.read_text().splitlines()
+    ]
+    single_rows = [
+        json.loads(line)
+        for line in (tmp_path / "single.jsonl").read_text().splitlines()
+    ]
+    key = lambda row: row["chunk_id"]
+    assert sorted(rows, key=key) == sorted(single_rows, key=key)
+
+
+@pytest.mark.parametrize("eval_mode", ["bm25-fast", "fts"])
+def test_filtered_run_only_retrieves_matching_chunks(
+    db_path, input_file_path, tmp_path, monkeypatch, eval_mode
+):
+    async def question_words(queries):
+        return [
+            FullTextSearchEvaluationItem(
+                question=query.question,
+                keywords=query.question.split(),
+                chunk_id=query.chunk_id,
+            )
+            for query in queries
+        ]
+
+    monkeypatch.setattr(evaluate, "generate_keywords_for_questions", question_words)
+    allowed = {f"c{i}" for i in range(0, 40, 3)}
+    output = tmp_path / "results.jsonl"
+    where = f"chunk_id IN ({', '.join(repr(chunk_id) for chunk_id in allowed)})"
+    result = run(
+        db_path,
+        input_file_path,
+        str(output),
+        "--eval-mode",
+        eval_mode,
+        "--where",
+        where,
+    )
+    assert result.exit_code == 0, result.output
+
+    rows = [json.loads(line) for line in output.read_text().splitlines()]
+    retrieved = {chunk_id for row in rows for chunk_id in row["retrieved"]}
+    assert retrieved and retrieved <= allowed
+    checkpoint = json.loads(output.with_suffix(".checkpoint.json").read_text())
+    assert checkpoint["where"] == f"({where})"
+
+
+def test_bm25_mode_runs_a_full_text_search(embedded_db_path, input_file_path, tmp_path):
+    output = tmp_path / "results.jsonl"
+    result = run(embedded_db_path, input_file_path, str(output), "--eval-mode", "bm25")
+    assert result.exit_code == 0, result.output
+
+    rows = [json.loads(line) for line in output.read_text().splitlines()]
+    assert len(rows) == 25 and all(row["retrieved"] for row in rows)
+    table = lancedb.connect(embedded_db_path).open_table("chunks")
+    assert ["text"] in [index.columns for index in table.list_indices()]
+
+    rerun = run(embedded_db_path, input_file_path, str(output), "--eval-mode", "bm25")
+    assert rerun.exit_code == 0, rerun.output
+
+
+def test_bm25_fast_matches_lancedb_bm25(embedded_db_path, input_file_path):
+    items = list(read_evaluation_items(input_file_path))
+    native = Retriever("bm25", embedded_db_path, "chunks").retrieve(items)
+    fast = Retriever("bm25-fast", embedded_db_path, "chunks").retrieve(items)
+
+    def above(result, cutoff: float) -> set:
+        return {chunk.chunk_id for chunk in result.results if chunk.score > cutoff}
+
+    for expected, actual in zip(native, fast):
+        scores = [chunk.score for chunk in expected.results]
+        assert [chunk.score for chunk in actual.results] == pytest.approx(scores)
+        # Chunks tied with the last one retrieved may be cut off in any order
+        assert above(actual, scores[-1]) == above(expected, scores[-1])
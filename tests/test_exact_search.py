@@ -0,0 +1,63 @@
+import lancedb
+import numpy as np
+import pytest
+from rag_app.src.exact_search import VectorMatrix, load_vector_matrix
+
+
+@pytest.fixture
+def matrix():
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(50, 8)).astype(np.float32)
+    return VectorMatrix([f"c{i}" for i in range(50)], vectors)
+
+
+def brute_force(matrix, queries, k, metric):
+    if metric == "L2":
+        distances = ((queries[:, None, :] - matrix.vectors[None]) ** 2).sum(-1)
+    else:
+        q = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+        v = matrix.vectors / np.linalg.norm(matrix.vectors, axis=1, keepdims=True)
+        distances = 1 - q @ v.T
+    order = np.argsort(distances, axis=1)[:, :k]
+    return order, np.take_along_axis(distances, order, axis=1)
+
+
+@pytest.mark.parametrize("metric", ["L2", "cosine"])
+def test_search_matches_brute_force_across_blocks(matrix, metric):
+    queries = np.random.default_rng(1).normal(size=(7, 8)).astype(np.float32)
+    ids, distances = matrix.search(
+        queries, k=5, metric=metric, query_block_size=3, chunk_block_size=16
+    )
+    order, expected = brute_force(matrix, queries, 5, metric)
+    assert ids == [[f"c{i}" for i in row] for row in order]
+    np.testing.assert_allclose(distances, expected, rtol=1e-4, atol=1e-4)
+
+
+def test_search_with_fewer_chunks_than_k(matrix):
+    ids, distances = matrix.search(matrix.vectors[:2], k=100)
+    assert len(ids[0]) == 50
+    assert ids[0][0] == "c0" and ids[1][0] == "c1"
+
+
+def test_matches_lancedb_and_memory_maps_exports(tmp_path, matrix):
+    db = lancedb.connect(tmp_path)
+    table = db.create_table(
+        "chunks",
+        [
+            {"chunk_id": chunk_id, "vector": vector.tolist()}
+            for chunk_id, vector in zip(matrix.chunk_ids, matrix.vectors)
+        ],
+    )
+    loaded = load_vector_matrix(tmp_path, "chunks", table)
+    query = matrix.vectors[3] + 0.1
+    ids, distances = loaded.search(query[None], k=5)
+    expected = table.search(query).limit(5).to_list()
+    assert ids[0] == [row["chunk_id"] for row in expected]
+    np.testing.assert_allclose(
+        distances[0], [row["_distance"] for row in expected], rtol=1e-4
+    )
+
+    loaded.save(tmp_path / "chunks.vectors.npy")
+    exported = load_vector_matrix(tmp_path, "chunks", table)
+    assert isinstance(exported.vectors, np.memmap)
+    assert exported.search(query[None], k=5)[0] == ids
@@ -0,0 +1,97 @@
+import pytest
+from datetime import datetime
+from lancedb import connect
+from typer.testing import CliRunner
+from rag_app.ingest import open_chunk_table
+from rag_app.query import app, filtered_search
+from rag_app.src.embeddings import embed_for_table
+from rag_app.src.exact_search import VectorMatrix
+from rag_app.src.filters import SearchFilter, build_filter, create_scalar_indexes
+
+
+def make_row(idx: int, doc_id: str, text: str, year: int) -> dict:
+    return {
+        "chunk_id": f"chunk-{idx}",
+        "doc_id": doc_id,
+        "text": text,
+        "post_title": "Title",
+        "publish_date": datetime(year, 1, 1),
+        "chunk_number": idx,
+        "total_chunks": 100,
+        "source": f"https://example.com/{doc_id}",
+    }
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    # Eighty chunks of one document crowd out the twenty of the other
+    table = open_chunk_table(connect(tmp_path / "db"), "chunks", provider="local")
+    table.add(
+        [make_row(i, "crowd", f"alpha beta {i}", 2010 + i % 5) for i in range(80)]
+        + [make_row(i, "rare", f"gamma delta {i}", 2020) for i in range(80, 100)]
+    )
+    create_scalar_indexes(table)
+    return str(tmp_path / "db")
+
+
+def test_build_filter():
+    assert build_filter() is None
+    assert (
+        build_filter(
+            "chunk_number > 2",
+            after=datetime(2021, 1, 1),
+            before=datetime(2022, 1, 1),
+            doc_ids=["a", "o'b"],
+        )
+        == "(chunk_number > 2) AND publish_date >= timestamp '2021-01-01 00:00:00' "
+        "AND publish_date < timestamp '2022-01-01 00:00:00' AND doc_id IN ('a', 'o''b')"
+    )
+
+
+def test_filtered_search_never_drops_results(db_path):
+    table = connect(db_path).open_table("chunks")
+    assert {index.name for index in table.list_indices()} == {
+        "publish_date_idx",
+        "doc_id_idx",
+        "source_idx",
+    }
+    query_vector = embed_for_table(table, ["alpha beta"])[0]
+
+    for sql, prefilter in [
+        (build_filter(after=datetime(2014, 1, 1), before=datetime(2015, 1, 1)), False),
+        (build_filter(doc_ids=["rare"]), False),
+        (build_filter(doc_ids=["rare"], where="chunk_number < 83"), True),
+    ]:
+        search_filter = SearchFilter.resolve(table, sql)
+        assert search_filter.prefilter == prefilter
+        rows = filtered_search(table, query_vector, 5, search_filter=search_filter)
+        expected = table.search(query_vector).where(sql).limit(5).to_list()
+        assert len(rows) == min(5, search_filter.matches)
+        assert [row["chunk_id"] for row in rows] == [
+            row["chunk_id"] for row in expected
+        ]
+
+
+def test_filtered_in_memory_index(db_path):
+    table = connect(db_path).open_table("chunks")
+    matrix = VectorMatrix.from_table(table)
+    search_filter = SearchFilter.resolve(table, build_filter(doc_ids=["rare"]))
+    subset = matrix.subset(search_filter.rows(table, matrix.chunk_ids))
+    assert subset.chunk_ids == [f"chunk-{i}" for i in range(80, 100)]
+    ids, _ = subset.search(matrix.vectors[:1], k=3)
+    assert len(ids[0]) == 3 and set(ids[0]) <= set(subset.chunk_ids)
+
+    table.add([make_row(100, "late", "epsilon", 2024)])
+    create_scalar_indexes(table)
+    table = connect(db_path).open_table("chunks")
+    stats = table.index_stats("doc_id_idx")
+    assert (stats.num_indexed_rows, stats.num_unindexed_rows) == (101, 0)
+
+
+def test_query_db_filters(db_path):
+    args = ["db", "--db-path", db_path, "--table-name", "chunks"]
+    args += ["--query", "alpha beta", "--n", "3", "--after", "2020-01-01"]
+    for extra in [[], ["--quantization", "int8"]]:
+        result = CliRunner().invoke(app, args + extra)
+        assert result.exit_code == 0, result.output
+        assert "gamma delta" in result.output and "alpha beta" not in result.output
@@ -0,0 +1,169 @@
+import asyncio
+import io
+import json
+from datetime import datetime
+import httpx
+import openai
+import pytest
+from pydantic import ValidationError
+from rag_app.generate_synthetic_question import (
+    gather_questions,
+    generate_question_answer_pair,
+    read_generated_chunk_ids,
+)
+from rag_app.models import TextChunk
+from rag_app.src.embeddings import RequestBackoff
+
+
+def make_chunk(idx: int) -> TextChunk:
+    return TextChunk(
+        chunk_id=f"chunk-{idx}",
+        doc_id="doc",
+        text=f"text {idx}",
+        post_title="title",
+        publish_date=datetime(2024, 1, 1),
+        chunk_number=idx,
+        source="source",
+    )
+
+
+class StubCompletions:
+    def __init__(self, failures: int = 0):
+        self.failures = failures
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def create(self, model, messages, response_model, **kwargs):
+        self.calls += 1
+        if self.failures:
+            self.failures -= 1
+            request = httpx.Request("POST", "https://api.openai.com")
+            raise openai.RateLimitError(
+                "rate limited",
+                response=httpx.Response(
+                    429, headers={"retry-after-ms": "1"}, request=request
+                ),
+                body=None,
+            )
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(0.001)
+        self.in_flight -= 1
+        return response_model(
+            chain_of_thought="", question=f"question {self.calls}", answer="answer"
+        )
+
+
+class StubClient:
+    def __init__(self, completions: StubCompletions):
+        self.chat = type("Chat", (), {"completions": completions})
+
+
+def test_gather_questions_bounds_concurrency_and_reads_lazily():
+    completions = StubCompletions()
+    pulled = []
+
+    def chunks():
+        for idx in range(20):
+            pulled.append(idx)
+            yield make_chunk(idx)
+
+    output = io.StringIO()
+    written = asyncio.run(
+        gather_questions(
+            chunks(), output, concurrency=3, client=StubClient(completions)
+        )
+    )
+
+    rows = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert written == 20
+    assert sorted(row["chunk_id"] for row in rows) == sorted(
+        f"chunk-{idx}" for idx in range(20)
+    )
+    assert completions.max_in_flight == 3
+    assert len(pulled) == 20
+
+
+def test_gather_questions_stops_on_failure_after_writing_results():
+    class FailingCompletions(StubCompletions):
+        async def create(self, model, messages, response_model, **kwargs):
+            if "text 3" in messages[1]["content"]:
+                raise ValueError("bad response")
+            return await super().create(model, messages, response_model, **kwargs)
+
+    pulled = []
+
+    def chunks():
+        for idx in range(100):
+            pulled.append(idx)
+            yield make_chunk(idx)
+
+    output = io.StringIO()
+    with pytest.raises(ValueError):
+        asyncio.run(
+            gather_questions(
+                chunks(),
+                output,
+                concurrency=2,
+                client=StubClient(FailingCompletions()),
+            )
+        )
+    assert len(output.getvalue().splitlines()) >= 3
+    assert len(pulled) < 100
+
+
+def test_generate_question_answer_pair_retries_rate_limits():
+    completions = StubCompletions(failures=2)
+    backoff = RequestBackoff()
+    res, chunk = asyncio.run(
+        generate_question_answer_pair(StubClient(completions), make_chunk(0), backoff)
+    )
+
+    assert chunk.chunk_id == "chunk-0"
+    assert res.question == "question 3"
+    assert list(backoff.outcomes) == [False, False, True]
+
+
+def test_read_generated_chunk_ids_drops_incomplete_line(tmp_path):
+    path = tmp_path / "output.jsonl"
+    assert read_generated_chunk_ids(path) == set()
+
+    rows = [{"chunk_id": "a"}, {"chunk_id": "b"}]
+    complete = "".join(json.dumps(row) + "\n" for row in rows)
+    path.write_text(complete + '{"chunk_id": "c", "quest')
+
+    assert read_generated_chunk_ids(path) == {"a", "b"}
+    assert path.read_text() == complete
+
+
+def test_generate_question_answer_pair_retries_invalid_responses():
+    class InvalidOnce(StubCompletions):
+        async def create(self, model, messages, response_model, **kwargs):
+            if not self.calls:
+                self.calls += 1
+                response_model.model_validate({})
+            return await super().create(model, messages, response_model, **kwargs)
+
+    completions = InvalidOnce()
+    backoff = RequestBackoff()
+    res, _ = asyncio.run(
+        generate_question_answer_pair(StubClient(completions), make_chunk(0), backoff)
+    )
+
+    assert res.question == "question 2"
+    assert list(backoff.outcomes) == [True]
+
+    class AlwaysInvalid(StubCompletions):
+        async def create(self, model, messages, response_model, **kwargs):
+            self.calls += 1
+            response_model.model_validate({})
+
+    completions = AlwaysInvalid()
+    with pytest.raises(ValidationError):
+        asyncio.run(
+            generate_question_answer_pair(
+                StubClient(completions), make_chunk(0), max_retries=2
+            )
+        )
+    assert completions.calls == 3
@@ -0,0 +1,82 @@
+import json
+import re
+from datetime import datetime
+from lancedb import connect
+from typer.testing import CliRunner
+from rag_app.index import app, default_num_partitions, default_num_sub_vectors
+from rag_app.ingest import open_chunk_table
+
+
+def test_default_num_partitions():
+    assert default_num_partitions(0) == 1
+    assert default_num_partitions(1_000_000) == 1000
+
+
+def test_default_num_sub_vectors_divides_dimensions():
+    assert default_num_sub_vectors(256) == 16
+    assert default_num_sub_vectors(1536) == 96
+    assert 100 % default_num_sub_vectors(100) == 0
+
+
+def test_build_and_report_recall(tmp_path):
+    words = ["alpha", "beta", "gamma", "delta", "epsilon", "zeta", "eta", "theta"]
+    db_path = tmp_path / "db"
+    table = open_chunk_table(
+        connect(db_path), "chunks", provider="local", dimensions=32
+    )
+    table.add(
+        [
+            {
+                "chunk_id": f"c{i}",
+                "doc_id": f"d{i // 8}",
+                "text": f"{words[i % 8]} {words[(i // 8) % 8]} {words[i % 5]} {i}",
+                "post_title": "Title",
+                "publish_date": datetime(2024, 1, 1),
+                "chunk_number": i % 8,
+                "total_chunks": 8,
+                "source": "https://example.com",
+            }
+            for i in range(512)
+        ]
+    )
+    input_file_path = tmp_path / "questions.jsonl"
+    with open(input_file_path, "w") as file:
+        for i in range(0, 512, 16):
+            item = {
+                "question": f"{words[i % 8]} {words[(i // 8) % 8]}",
+                "answer": "",
+                "chunk": "",
+                "chunk_id": f"c{i}",
+            }
+            file.write(json.dumps(item) + "\n")
+
+    args = ["--db-path", str(db_path), "--table-name", "chunks"]
+    result = CliRunner().invoke(
+        app, ["build", *args, "--index-type", "IVF_PQ", "--num-partitions", "4"]
+    )
+    assert result.exit_code == 0, result.output
+    assert "Built a IVF_PQ index on 512 chunks" in result.output
+    table = connect(db_path).open_table("chunks")
+    assert [index.index_type for index in table.list_indices()] == ["IvfPq"]
+
+    result = CliRunner().invoke(
+        app,
+        ["report", *args, "--input-file-path", str(input_file_path), "--k", "5"]
+        + ["--nprobes", "1", "--nprobes", "4", "--refine-factor", "0"]
+        + ["--refine-factor", "5"],
+        terminal_width=200,
+    )
+    assert result.exit_code == 0, result.output
+    rows = re.findall(
+        r"│ (\S+) +│ (\S+) +│ ([\d.]+) +│ ([\d.]+) +│ ([\d.]+) +│", result.output
+    )
+    assert [(probes, refine) for probes, refine, *_ in rows] == [
+        ("exact", "-"),
+        ("1", "-"),
+        ("1", "5"),
+        ("4", "-"),
+        ("4", "5"),
+    ]
+    assert all(0 <= float(recall) <= 1 for _, _, recall, _, _ in rows)
+    # Searching every partition and re-ranking exactly can only find more
+    assert float(rows[-1][2]) >= float(rows[1][2])
@@ -0,0 +1,57 @@
+import pytest
+from lancedb import connect
+from typer.testing import CliRunner
+from rag_app.ingest import app
+
+pytestmark = pytest.mark.usefixtures("offline_tokens")
+
+
+def write_post(path, content):
+    path.write_text(
+        f"---\ntitle: {path.stem}\ndate: 2024-10\nurl: https://example.com/{path.stem}\n---\n{content}"
+    )
+
+
+def ingest(db_path, folder):
+    args = ["--db-path", str(db_path), "--table-name", "chunks"]
+    args += ["--folder-path", str(folder), "--incremental", "--chunker", "window"]
+    args += ["--embedding-provider", "local"]
+    result = CliRunner().invoke(app, args)
+    assert result.exit_code == 0, result.output
+    return result.output
+
+
+def doc_ids(db_path):
+    db = connect(db_path)
+    chunks = db.open_table("chunks").to_lance().to_table(columns=["doc_id"])
+    documents = db.open_table("document").to_lance().to_table(columns=["id"])
+    return set(chunks.column("doc_id").to_pylist()), set(
+        documents.column("id").to_pylist()
+    )
+
+
+def test_incremental_ingest_of_more_than_ten_files(tmp_path):
+    folder, db_path = tmp_path / "posts", tmp_path / "db"
+    folder.mkdir()
+    for i in range(15):
+        write_post(folder / f"post-{i}.md", f"Essay number {i} about startups.")
+
+    assert "15 changed, 0 unchanged and 0 removed" in ingest(db_path, folder)
+    chunk_docs, documents = doc_ids(db_path)
+    assert len(chunk_docs) == 15 and chunk_docs == documents
+
+    output = ingest(db_path, folder)
+    assert "Embedded 0 new chunks" in output
+    assert "0 changed, 15 unchanged and 0 removed" in output
+    assert doc_ids(db_path) == (chunk_docs, documents)
+
+    for i in range(2):
+        write_post(folder / f"post-{i}.md", f"Essay number {i} was rewritten.")
+    for i in range(3, 15):
+        (folder / f"post-{i}.md").unlink()
+    assert "2 changed, 1 unchanged and 12 removed" in ingest(db_path, folder)
+
+    chunk_docs, documents = doc_ids(db_path)
+    assert len(chunk_docs) == 3 and chunk_docs == documents
+    texts = connect(db_path).open_table("chunks").to_lance().to_table(columns=["text"])
+    assert sum("rewritten" in text for text in texts.column("text").to_pylist()) == 2
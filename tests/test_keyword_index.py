@@ -0,0 +1,50 @@
+import pytest
+from rag_app.src.keyword_index import KeywordIndex, tokenize
+
+
+@pytest.fixture
+def index():
+    return KeywordIndex.build(
+        [
+            ("a", "Startups raise money from venture capital firms."),
+            ("b", "Venture capital is one way to fund a startup."),
+            ("c", "Capital venture is not the same phrase."),
+            ("d", "Nothing relevant here (really)."),
+        ]
+    )
+
+
+def test_tokenize_lowercases_and_drops_punctuation():
+    assert tokenize("Venture-Capital, (VC)!") == ["venture", "capital", "vc"]
+
+
+def test_match_phrase_and_prefix(index):
+    assert index.match("venture capital").tolist() == [0, 1]
+    assert index.match("startup").tolist() == [0, 1]
+    assert index.match("start up").tolist() == []
+
+
+def test_match_ignores_regex_metacharacters(index):
+    assert index.match("(really").tolist() == [3]
+    assert index.match(".*").tolist() == []
+    assert index.match("[").tolist() == []
+
+
+def test_search_ranks_by_keywords_matched(index):
+    assert index.search(["startup", "venture capital", "fund"]) == [
+        ("b", 3),
+        ("a", 2),
+    ]
+    assert index.search(["capital"], limit=2) == [("a", 1), ("b", 1)]
+
+
+def test_phrases_do_not_span_chunks(index):
+    assert index.match("firms venture").tolist() == []
+
+
+def test_save_and_load(index, tmp_path):
+    index.version = 3
+    index.save(tmp_path / "index.npz")
+    loaded = KeywordIndex.load(tmp_path / "index.npz")
+    assert loaded.version == 3
+    assert loaded.search(["venture capital"]) == index.search(["venture capital"])
@@ -0,0 +1,122 @@
+import asyncio
+import pytest
+from pydantic import BaseModel
+from rag_app.src.llm_cache import CacheMissError, ResponseCache, cached_client
+
+
+class Keywords(BaseModel):
+    keywords: list[str]
+
+
+MESSAGES = [{"role": "user", "content": "keywords for lancedb"}]
+
+
+class StubCompletions:
+    def __init__(self):
+        self.calls = 0
+
+    async def create(self, model, messages, response_model, **kwargs):
+        self.calls += 1
+        return response_model(keywords=[f"call {self.calls}"])
+
+
+def stub_client(completions: StubCompletions):
+    factory_calls = []
+
+    def factory():
+        factory_calls.append(1)
+
+        class Client:
+            class chat:
+                pass
+
+        Client.chat.completions = completions
+        return Client
+
+    return factory, factory_calls
+
+
+def request(client, model="gpt-4", messages=MESSAGES, **kwargs):
+    return asyncio.run(
+        client.chat.completions.create(
+            model=model, messages=messages, response_model=Keywords, **kwargs
+        )
+    )
+
+
+@pytest.fixture
+def completions():
+    return StubCompletions()
+
+
+def test_auto_mode_reuses_responses(tmp_path, completions):
+    cache = ResponseCache(tmp_path / "llm.sqlite")
+    factory, _ = stub_client(completions)
+    client = cached_client(factory, cache)
+
+    assert request(client, max_retries=5).keywords == ["call 1"]
+    assert request(client, max_retries=2).keywords == ["call 1"]
+    assert request(client, model="gpt-3.5-turbo").keywords == ["call 2"]
+    assert (cache.hits, cache.misses, completions.calls) == (1, 2, 2)
+    assert "33% hit rate" in cache.summary()
+
+
+def test_key_includes_response_schema(tmp_path):
+    class Other(BaseModel):
+        keywords: list[str]
+        reason: str
+
+    key = ResponseCache.request_key("gpt-4", MESSAGES, Keywords)
+    assert key == ResponseCache.request_key("gpt-4", MESSAGES, Keywords)
+    assert key != ResponseCache.request_key("gpt-4", MESSAGES, Other)
+
+
+def test_replay_mode_is_offline(tmp_path, completions):
+    factory, _ = stub_client(completions)
+    request(cached_client(factory, ResponseCache(tmp_path / "llm.sqlite")))
+
+    replay = ResponseCache(tmp_path / "llm.sqlite", mode="replay")
+    offline, factory_calls = stub_client(completions)
+    client = cached_client(offline, replay)
+    assert request(client).keywords == ["call 1"]
+    with pytest.raises(CacheMissError):
+        request(client, model="gpt-3.5-turbo")
+    assert factory_calls == []
+
+
+def test_record_mode_refreshes_responses(tmp_path, completions):
+    factory, _ = stub_client(completions)
+    request(cached_client(factory, ResponseCache(tmp_path / "llm.sqlite")))
+    record = ResponseCache(tmp_path / "llm.sqlite", mode="record")
+    assert request(cached_client(factory, record)).keywords == ["call 2"]
+    auto = ResponseCache(tmp_path / "llm.sqlite")
+    assert request(cached_client(factory, auto)).keywords == ["call 2"]
+
+
+def test_ttl_and_eviction(tmp_path, completions):
+    factory, _ = stub_client(completions)
+    expired = ResponseCache(tmp_path / "llm.sqlite", ttl=1e-9)
+    client = cached_client(factory, expired)
+    request(client)
+    request(client)
+    assert completions.calls == 2
+
+    small = ResponseCache(tmp_path / "small.sqlite", max_entries=2)
+    client = cached_client(factory, small)
+    for content in ["a", "b", "c"]:
+        request(client, messages=[{"role": "user", "content": content}])
+    assert len(small) == 2
+
+    # Recording over a cached response doesn't count as a new entry, and a
+    # reopened cache counts what is already stored
+    record = ResponseCache(tmp_path / "small.sqlite", max_entries=2, mode="record")
+    request(cached_client(factory, record), messages=[MESSAGES[0] | {"content": "c"}])
+    reopened = ResponseCache(tmp_path / "small.sqlite", max_entries=2)
+    client = cached_client(factory, reopened)
+    request(client, messages=[{"role": "user", "content": "d"}])
+    assert len(reopened) == 2
+    calls = completions.calls
+    assert request(client, messages=[{"role": "user", "content": "c"}]).keywords == [
+        f"call {calls - 1}"
+    ]
+    assert completions.calls == calls
@@ -0,0 +1,88 @@
+import asyncio
+import numpy as np
+import pytest
+from datetime import datetime
+from lancedb import connect
+from rag_app.ingest import open_chunk_table
+from rag_app.src.embeddings import (
+    FunctionEmbedder,
+    create_embedding_function,
+    describe_embedding_function,
+    get_query_embedder,
+    table_embedding_function,
+)
+from rag_app.src.local_embeddings import embed_batch
+
+
+def make_row(idx: int, text: str) -> dict:
+    return {
+        "chunk_id": f"chunk-{idx}",
+        "doc_id": "doc",
+        "text": text,
+        "post_title": "Title",
+        "publish_date": datetime(2024, 1, 1),
+        "chunk_number": idx,
+        "total_chunks": 3,
+        "source": "https://example.com",
+    }
+
+
+def test_local_embeddings_are_deterministic_and_lexical():
+    embeddings = create_embedding_function("local", dimensions=64)
+    a, b, c, empty = embeddings.embed(
+        [
+            "The lorem ipsum dolor sit",
+            "lorem ipsum dolor amet",
+            "completely different words",
+            "",
+        ]
+    )
+    assert a.shape == (64,)
+    assert np.allclose(a, embed_batch(["lorem ipsum dolor sit"], 64, 0)[0])
+    assert a @ b > a @ c
+    assert np.linalg.norm(a) == pytest.approx(1) and not empty.any()
+    assert not np.allclose(a, embed_batch(["lorem ipsum dolor sit"], 64, 1)[0])
+
+    with pytest.raises(ValueError):
+        create_embedding_function("local", model="text-embedding-3-large")
+
+
+def test_local_embeddings_split_large_batches_across_workers(monkeypatch):
+    monkeypatch.setenv("RAG_APP_EMBEDDING_WORKERS", "2")
+    texts = [f"essay number {i} about topic {i % 7}" for i in range(200)]
+    embeddings = create_embedding_function("local")
+    assert np.allclose(embeddings.embed(texts), embed_batch(texts, 256, 0))
+
+
+def test_tables_record_their_embedding_backend(tmp_path):
+    db = connect(tmp_path / "db")
+    table = open_chunk_table(db, "local", provider="local", dimensions=64)
+    table.add([make_row(i, f"chunk {i} about lorem ipsum") for i in range(3)])
+
+    table = db.open_table("local")
+    assert describe_embedding_function(table_embedding_function(table)) == (
+        "local",
+        "hashing-v1",
+        64,
+    )
+    embedder = get_query_embedder(table)
+    assert isinstance(embedder, FunctionEmbedder)
+    vectors = asyncio.run(embedder.embed(["chunk 1 about lorem ipsum"] * 2))
+    assert embedder.deduplicated == 1
+    assert np.allclose(
+        vectors[0], table.search(vectors[0]).limit(1).to_list()[0]["vector"]
+    )
+    assert table.search(vectors[0]).limit(1).to_list()[0]["chunk_id"] == "chunk-1"
+
+    assert open_chunk_table(db, "local") is not None
+    with pytest.raises(ValueError):
+        open_chunk_table(db, "local", provider="openai")
+    with pytest.raises(ValueError):
+        open_chunk_table(db, "local", dimensions=256)
+
+    default = open_chunk_table(db, "default")
+    assert describe_embedding_function(table_embedding_function(default)) == (
+        "openai",
+        "text-embedding-3-large",
+        256,
+    )
@@ -0,0 +1,60 @@
+import os
+from rag_app.models import FileManifest
+from rag_app.src.manifest import diff_manifest, generate_file_hash
+
+
+def write_post(path, content):
+    path.write_text(
+        f"---\ntitle: Test Title\ndate: 2024-10\nurl: https://example.com\n---\n{content}"
+    )
+
+
+def entry_for(folder, name, doc_id="doc123", chunk_count=3):
+    file = folder / name
+    stat = file.stat()
+    return FileManifest(
+        path=name,
+        doc_id=doc_id,
+        content_hash=generate_file_hash(file),
+        mtime=stat.st_mtime_ns,
+        size=stat.st_size,
+        chunk_count=chunk_count,
+    )
+
+
+def test_diff_manifest_new_files_are_changed(tmp_path):
+    write_post(tmp_path / "a.md", "Hello world")
+    (tmp_path / "ignored.txt").write_text("Not markdown")
+
+    diff = diff_manifest(tmp_path, ".md", {})
+    assert diff.changed == [tmp_path / "a.md"]
+    assert diff.unchanged == []
+    assert diff.removed == []
+
+
+def test_diff_manifest_skips_unchanged_and_touched_files(tmp_path):
+    write_post(tmp_path / "a.md", "Hello world")
+    write_post(tmp_path / "b.md", "Goodbye world")
+    manifest = {name: entry_for(tmp_path, name) for name in ["a.md", "b.md"]}
+
+    stat = (tmp_path / "b.md").stat()
+    os.utime(tmp_path / "b.md", ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+    diff = diff_manifest(tmp_path, ".md", manifest)
+    assert diff.changed == []
+    assert sorted(entry.path for entry in diff.unchanged) == ["a.md", "b.md"]
+    touched = next(entry for entry in diff.unchanged if entry.path == "b.md")
+    assert touched.mtime == stat.st_mtime_ns + 10**9
+
+
+def test_diff_manifest_detects_edited_and_removed_files(tmp_path):
+    write_post(tmp_path / "a.md", "Hello world")
+    write_post(tmp_path / "b.md", "Goodbye world")
+    manifest = {name: entry_for(tmp_path, name) for name in ["a.md", "b.md"]}
+
+    write_post(tmp_path / "a.md", "Hello there, world")
+    (tmp_path / "b.md").unlink()
+
+    diff = diff_manifest(tmp_path, ".md", manifest)
+    assert diff.changed == [tmp_path / "a.md"]
+    assert [entry.path for entry in diff.removed] == ["b.md"]
@@ -0,0 +1,59 @@
+import math
+import random
+import pytest
+from rag_app.src.metrics import (
+    SIZES,
+    calculate_mrr,
+    calculate_ndcg,
+    score_predictions,
+    slice_predictions_decorator,
+)
+
+CASES = [
+    ("a", []),
+    ("a", ["a"]),
+    ("a", ["b"]),
+    ("a", ["b", "a"]),
+    ("a", ["b", "c", "d", "a"]),
+    ("a", ["a", "b", "a"]),
+    ("a", [f"c{i}" for i in range(30)] + ["a"]),
+    ("a", [f"c{i}" for i in range(7)] + ["a"] + [f"d{i}" for i in range(20)]),
+]
+
+
+def reference(chunk_id, predictions, size):
+    mrr = slice_predictions_decorator(size)(calculate_mrr)(chunk_id, predictions)
+    ndcg = slice_predictions_decorator(size)(calculate_ndcg)(chunk_id, predictions)
+    return mrr, ndcg
+
+
+def assert_matches_reference(cases):
+    columns = score_predictions([c for c, _ in cases], [p for _, p in cases])
+    for row, (chunk_id, predictions) in enumerate(cases):
+        for size in SIZES:
+            mrr, ndcg = reference(chunk_id, predictions, size)
+            assert columns[f"MRR@{size}"][row] == pytest.approx(mrr)
+            if ndcg == "N/A":
+                assert math.isnan(columns[f"NDCG@{size}"][row])
+            else:
+                assert columns[f"NDCG@{size}"][row] == pytest.approx(ndcg)
+
+
+def test_matches_reference_edge_cases():
+    assert_matches_reference(CASES)
+
+
+def test_matches_reference_on_random_rankings():
+    rng = random.Random(0)
+    cases = []
+    for _ in range(200):
+        predictions = [f"c{rng.randrange(40)}" for _ in range(rng.randrange(26))]
+        cases.append((f"c{rng.randrange(40)}", predictions))
+    assert_matches_reference(cases)
+
+
+def test_recall():
+    columns = score_predictions(["a", "a"], [["b", "c", "d", "a"], ["a"]])
+    assert columns["Recall@3"].tolist() == [0.0, 1.0]
+    assert columns["Recall@5"].tolist() == [1.0, 1.0]
+    assert not any(name.startswith("Hit@") for name in columns)
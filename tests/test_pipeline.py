@@ -0,0 +1,50 @@
+import pytest
+import time
+from rag_app.models import Document, DocumentMetadata
+from rag_app.src.pipeline import stream_documents
+
+pytestmark = pytest.mark.usefixtures("offline_tokens")
+
+
+class StubTable:
+    def __init__(self, error=None, delay: float = 0.0):
+        self.error = error
+        self.delay = delay
+        self.rows = []
+
+    def add(self, batch):
+        time.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        self.rows.extend(batch)
+
+
+def make_document(i: int) -> Document:
+    return Document(
+        id=f"doc-{i}",
+        content=f"Essay number {i} about startups.",
+        filename=f"post-{i}.md",
+        metadata=DocumentMetadata(date="2024-10", url="https://example.com", title="T"),
+    )
+
+
+def test_stream_documents_writes_every_chunk():
+    chunks, documents = StubTable(), StubTable()
+    ttl = stream_documents(
+        (make_document(i) for i in range(5)), chunks, documents, chunker="window"
+    )
+    assert ttl == len(chunks.rows) == 5
+    assert [document.id for document in documents.rows] == [
+        f"doc-{i}" for i in range(5)
+    ]
+
+
+def test_stream_documents_joins_both_writers_when_one_fails():
+    chunks = StubTable(delay=0.5)
+    documents = StubTable(RuntimeError("disk full"))
+    with pytest.raises(RuntimeError, match="disk full"):
+        stream_documents(
+            (make_document(i) for i in range(5)), chunks, documents, chunker="window"
+        )
+    # The slower chunk writer was still waited for
+    assert len(chunks.rows) == 5
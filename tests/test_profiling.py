@@ -0,0 +1,93 @@
+import asyncio
+import json
+import time
+from datetime import datetime
+from lancedb import connect
+from typer.testing import CliRunner
+from rag_app.ingest import open_chunk_table
+from rag_app.query import app
+from rag_app.src.profiling import profiling, span, timed
+
+
+def test_spans_are_free_when_profiling_is_off():
+    items = [1, 2, 3]
+    assert span("a") is span("b", rows=1)
+    assert timed(items, "a") is items
+    with profiling(enabled=False) as profiler:
+        assert profiler is None
+
+
+def test_spans_record_every_stage(capsys):
+    with profiling() as profiler:
+        with span("outer"):
+            for _ in timed(range(3), "produce"):
+                with span("inner", rows=2):
+                    time.sleep(0.01)
+
+    stages = profiler.stages()
+    assert {name: len(durations) for name, durations in stages.items()} == {
+        "outer": 1,
+        "produce": 4,
+        "inner": 3,
+    }
+    assert stages["inner"].min() >= 10 and stages["outer"][0] >= 30
+    assert "Profile" in capsys.readouterr().out
+    assert span("inner") is span("outer")
+
+
+def test_concurrent_async_spans_overlap(tmp_path):
+    async def request(i: int):
+        with span("request", i=i):
+            await asyncio.sleep(0.05)
+
+    async def requests():
+        await asyncio.gather(*[request(i) for i in range(3)])
+
+    trace_path = tmp_path / "trace.json"
+    with profiling(trace_path=str(trace_path)) as profiler:
+        start = time.perf_counter()
+        asyncio.run(requests())
+        elapsed = time.perf_counter() - start
+
+    assert profiler.stages()["request"].sum() / 1000 > 2 * elapsed
+    events = json.loads(trace_path.read_text())["traceEvents"]
+    spans = sorted(
+        (event for event in events if event["ph"] == "X"), key=lambda e: e["ts"]
+    )
+    assert [event["args"]["i"] for event in spans] == [0, 1, 2]
+    assert len({event["tid"] for event in spans}) == 3
+    assert spans[1]["ts"] < spans[0]["ts"] + spans[0]["dur"]
+    assert {event["tid"] for event in events if event["ph"] == "M"} >= {
+        event["tid"] for event in spans
+    }
+
+
+def test_query_db_profile(tmp_path):
+    db_path = tmp_path / "db"
+    table = open_chunk_table(connect(db_path), "chunks", provider="local")
+    table.add(
+        [
+            {
+                "chunk_id": f"chunk-{i}",
+                "doc_id": "doc",
+                "text": f"chunk {i} about lorem ipsum",
+                "post_title": "Title",
+                "publish_date": datetime(2024, 1, 1),
+                "chunk_number": i,
+                "total_chunks": 3,
+                "source": "https://example.com",
+            }
+            for i in range(3)
+        ]
+    )
+    trace_path = tmp_path / "trace.json"
+    args = ["db", "--db-path", str(db_path), "--table-name", "chunks"]
+    args += ["--query", "lorem", "--profile", "--trace-path", str(trace_path)]
+    result = CliRunner().invoke(app, args)
+    assert result.exit_code == 0, result.output
+
+    assert all(stage in result.output for stage in ["embed_query", "search", "render"])
+    names = {
+        event["name"] for event in json.loads(trace_path.read_text())["traceEvents"]
+    }
+    assert {"open_table", "embed_query", "embed", "search", "to_model"} <= names
@@ -0,0 +1,90 @@
+import lancedb
+import numpy as np
+import pytest
+from rag_app.src.exact_search import VectorMatrix
+from rag_app.src.quantization import (
+    QuantizedVectors,
+    load_quantized_vectors,
+    quantized_path,
+)
+
+
+@pytest.fixture
+def matrix():
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(300, 16)).astype(np.float32)
+    return VectorMatrix([f"c{i}" for i in range(300)], vectors, version=1)
+
+
+@pytest.fixture
+def queries(matrix):
+    noise = np.random.default_rng(1).normal(scale=0.1, size=(9, 16))
+    return (matrix.vectors[:9] + noise).astype(np.float32)
+
+
+def recall(found, truth):
+    return np.mean([len(set(a) & set(b)) / len(b) for a, b in zip(found, truth)])
+
+
+def test_codes_are_compact_and_decode_close_to_the_vectors(matrix):
+    int8 = QuantizedVectors.build(matrix, "int8")
+    binary = QuantizedVectors.build(matrix, "binary")
+
+    assert int8.codes.dtype == np.int8 and int8.codes.shape == (300, 16)
+    assert binary.codes.dtype == np.uint8 and binary.codes.shape == (300, 2)
+    assert (np.abs(int8.decode(0, 300) - matrix.vectors) <= int8.scale).all()
+    signs = np.sign(binary.decode(0, 300) - binary.center)
+    assert (signs == np.where(matrix.vectors > binary.center, 1, -1)).all()
+    np.testing.assert_allclose(
+        int8.norms, (int8.decode(0, 300) ** 2).sum(axis=1), rtol=1e-5
+    )
+
+
+@pytest.mark.parametrize("kind", ["int8", "binary"])
+@pytest.mark.parametrize("metric", ["L2", "cosine"])
+def test_rescoring_every_chunk_matches_exact_search(matrix, queries, kind, metric):
+    quantized = QuantizedVectors.build(matrix, kind)
+    ids, distances = quantized.search(
+        queries, matrix, k=5, metric=metric, rescore_factor=60, query_block_size=4
+    )
+    expected_ids, expected = matrix.search(queries, k=5, metric=metric)
+
+    assert ids == expected_ids
+    np.testing.assert_allclose(distances, expected, rtol=1e-4, atol=1e-4)
+
+
+def test_small_shortlists_keep_most_neighbours(matrix, queries):
+    truth, _ = matrix.search(queries, k=5)
+    int8, _ = QuantizedVectors.build(matrix, "int8").search(
+        queries, matrix, k=5, rescore_factor=2, chunk_block_size=64
+    )
+    binary, _ = QuantizedVectors.build(matrix, "binary").search(
+        queries, matrix, k=5, rescore_factor=10, chunk_block_size=64
+    )
+
+    assert recall(int8, truth) >= 0.95
+    assert recall(binary, truth) >= 0.8
+    assert [row[0] for row in binary] == [f"c{i}" for i in range(9)]
+
+
+def test_load_rebuilds_stale_codes(tmp_path, matrix):
+    db = lancedb.connect(tmp_path)
+    table = db.create_table(
+        "chunks",
+        [
+            {"chunk_id": chunk_id, "vector": vector.tolist()}
+            for chunk_id, vector in zip(matrix.chunk_ids, matrix.vectors)
+        ],
+    )
+    table_matrix = VectorMatrix.from_table(table)
+
+    quantized = load_quantized_vectors(tmp_path, "chunks", table, table_matrix, "int8")
+    assert quantized_path(tmp_path, "chunks", "int8").exists()
+    loaded = load_quantized_vectors(tmp_path, "chunks", table, table_matrix, "int8")
+    assert loaded.version == table.version
+    assert (loaded.codes == quantized.codes).all()
+
+    table.add([{"chunk_id": "new", "vector": matrix.vectors[0].tolist()}])
+    table_matrix = VectorMatrix.from_table(table)
+    rebuilt = load_quantized_vectors(tmp_path, "chunks", table, table_matrix, "int8")
+    assert len(rebuilt) == 301 and rebuilt.version == table.version
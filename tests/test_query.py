@@ -0,0 +1,150 @@
+import asyncio
+import io
+import json
+import pytest
+from datetime import datetime
+from lancedb import connect
+from typer.testing import CliRunner
+from rag_app.ingest import open_chunk_table
+from rag_app.query import app, read_queries, run_batch_queries
+
+CHUNK = {
+    "chunk_id": "chunk",
+    "doc_id": "doc",
+    "text": "Some text",
+    "post_title": "Test Title",
+    "publish_date": "2024-10-01T00:00:00",
+    "chunk_number": 1,
+    "total_chunks": 2,
+    "source": "https://example.com",
+}
+
+
+class StubQuery:
+    def __init__(self, vector):
+        self.vector = vector
+
+    def limit(self, n):
+        self.n = n
+        return self
+
+    def select(self, columns):
+        return self
+
+    def to_list(self):
+        return [{**CHUNK, "_distance": self.vector[0] + i} for i in range(self.n)]
+
+
+class StubSchema:
+    names = list(CHUNK)
+
+
+class StubTable:
+    schema = StubSchema
+
+    def search(self, vector):
+        return StubQuery(vector)
+
+
+class StubBatcher:
+    def __init__(self):
+        self.calls = []
+
+    async def embed(self, texts):
+        self.calls.append(texts)
+        return [[float(len(text))] for text in texts]
+
+
+def test_read_queries(tmp_path):
+    path = tmp_path / "queries.jsonl"
+    path.write_text('{"query": "a"}\n\n{"question": "b", "chunk_id": "c"}\n')
+
+    assert list(read_queries(path)) == [
+        {"query": "a"},
+        {"question": "b", "chunk_id": "c", "query": "b"},
+    ]
+
+
+def test_read_queries_requires_a_query(tmp_path):
+    path = tmp_path / "queries.jsonl"
+    path.write_text('{"answer": "a"}\n')
+
+    with pytest.raises(ValueError):
+        list(read_queries(path))
+
+
+def test_run_batch_queries_writes_results_in_order():
+    items = [{"query": "x" * i} for i in range(1, 6)]
+    batcher = StubBatcher()
+    output = io.StringIO()
+
+    ttl = asyncio.run(
+        run_batch_queries(items, StubTable(), batcher, output, n=2, batch_size=2)
+    )
+
+    lines = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert ttl == 5
+    assert [len(call) for call in batcher.calls] == [2, 2, 1]
+    assert [line["query"] for line in lines] == [item["query"] for item in items]
+    assert [result["distance"] for result in lines[2]["results"]] == [3.0, 4.0]
+    assert "text" not in lines[0]["results"][0]
+
+
+def test_query_tables_with_other_dimensions(tmp_path):
+    db_path = tmp_path / "db"
+    table = open_chunk_table(
+        connect(db_path), "chunks", provider="local", dimensions=64
+    )
+    table.add(
+        [
+            {
+                **CHUNK,
+                "chunk_id": f"chunk-{i}",
+                "text": f"chunk {i} about lorem ipsum",
+                "publish_date": datetime(2024, 10, 1),
+            }
+            for i in range(3)
+        ]
+    )
+    args = ["--db-path", str(db_path), "--table-name", "chunks"]
+
+    result = CliRunner().invoke(app, ["db", *args, "--query", "lorem ipsum"])
+    assert result.exit_code == 0, result.output
+    assert "chunk-0" in result.output
+
+    input_path, output_path = tmp_path / "queries.jsonl", tmp_path / "results.jsonl"
+    input_path.write_text(json.dumps({"query": "chunk 2 about lorem"}) + "\n")
+    result = CliRunner().invoke(
+        app,
+        ["batch", *args, "--input", str(input_path), "--output", str(output_path)],
+    )
+    assert result.exit_code == 0, result.output
+    results = json.loads(output_path.read_text())["results"]
+    assert results[0]["chunk_id"] == "chunk-2"
+
+
+def test_batch_counts_chunks_of_older_tables(tmp_path):
+    db_path = tmp_path / "db"
+    table = open_chunk_table(connect(db_path), "chunks", provider="local")
+    # Chunks ingested before their count was recorded
+    table.add(
+        [
+            {
+                **CHUNK,
+                "chunk_id": f"chunk-{i}",
+                "total_chunks": None,
+                "publish_date": datetime(2024, 10, 1),
+            }
+            for i in range(3)
+        ]
+    )
+    input_path, output_path = tmp_path / "queries.jsonl", tmp_path / "results.jsonl"
+    input_path.write_text(json.dumps({"query": "Some text"}) + "\n")
+    args = ["--db-path", str(db_path), "--table-name", "chunks"]
+    result = CliRunner().invoke(
+        app,
+        ["batch", *args, "--input", str(input_path), "--output", str(output_path)],
+    )
+    assert result.exit_code == 0, result.output
+    results = json.loads(output_path.read_text())["results"]
+    assert [row["total_chunks"] for row in results] == [3, 3, 3]
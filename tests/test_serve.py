@@ -0,0 +1,54 @@
+import json
+import pytest
+from threading import Thread
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+from rag_app.serve import SearchServer
+
+
+class StubTable:
+    version = 3
+
+
+class StubSearchService:
+    def current_table(self):
+        return StubTable()
+
+    def search(self, query, n=3):
+        return {"query": query, "version": 3, "results": [{"chunk_id": "a"}] * n}
+
+
+@pytest.fixture
+def base_url():
+    server = SearchServer(("127.0.0.1", 0), StubSearchService(), default_n=2)
+    Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+
+
+def fetch(url, body=None):
+    data = json.dumps(body).encode("utf-8") if body is not None else None
+    with urlopen(Request(url, data=data)) as response:
+        return json.loads(response.read())
+
+
+def test_search_with_query_string(base_url):
+    response = fetch(f"{base_url}/search?query=hello")
+    assert response["query"] == "hello"
+    assert len(response["results"]) == 2
+
+
+def test_search_with_json_body(base_url):
+    response = fetch(f"{base_url}/search", {"query": "hello", "n": 1})
+    assert len(response["results"]) == 1
+
+
+def test_search_requires_a_query(base_url):
+    with pytest.raises(HTTPError) as excinfo:
+        fetch(f"{base_url}/search")
+    assert excinfo.value.code == 400
+
+
+def test_health(base_url):
+    assert fetch(f"{base_url}/health") == {"status": "ok", "version": 3}